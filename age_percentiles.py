@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from result_cache import ResultCache
+
+_Values = np.ndarray | pd.Series | list
+
+
+class AgePercentiles:
+    def __init__(self, age_reference: pd.DataFrame, after: int = None) -> None:
+        df = age_reference if after is None else age_reference[age_reference.year >= after]
+        id_cols = ['name', 'sex']
+
+        # each (name, sex) curve becomes one contiguous, year-ordered run of cumulative living percentages
+        cumulative = df.groupby(id_cols, observed=True).number_living_pct.cumsum().to_numpy()
+        codes = df.name.cat.codes.to_numpy().astype(np.int64) * len(df.sex.cat.categories) + df.sex.cat.codes.to_numpy()
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        self._cumulative = cumulative[order]
+        self._years = df.year.to_numpy()[order]
+        self._starts = np.flatnonzero(np.diff(codes, prepend=-1))
+        self._ends = np.append(self._starts[1:], len(order))
+        self._run_codes = codes[self._starts]
+        self.keys = df[id_cols].iloc[order[self._starts]].reset_index(drop=True)
+        self._bounds_cache = ResultCache(max_entries=16, copy_results=False)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def predict(
+            self,
+            names: _Values,
+            sexes: _Values,
+            mid_percentiles: float | _Values,
+    ) -> pd.DataFrame:
+        # every (name, sex, mid_percentile) query in one pass over the curves, in the order given
+        positions = self._find_runs(names, sexes)
+        found = positions >= 0
+        mid_percentiles = np.broadcast_to(np.asarray(mid_percentiles, dtype=float), positions.shape)[found]
+
+        # large batches repeat the same queries, so each distinct (curve, percentile) is searched once
+        percentile_codes, percentiles = pd.factorize(mid_percentiles)
+        query_codes, queries = pd.factorize(positions[found] * len(percentiles) + percentile_codes)
+        year_lower, year_upper = self._year_bounds(percentiles[queries % len(percentiles)], queries // len(percentiles))
+        year_lower, year_upper = year_lower[query_codes], year_upper[query_codes]
+        columns = {}
+        for col, years in dict(year_lower=year_lower, year_upper=year_upper, year_band=year_upper - year_lower).items():
+            # like a left merge: whole years unless some queries had no match
+            columns[col] = np.empty(len(positions), years.dtype) if found.all() else np.full(len(positions), np.nan)
+            columns[col][found] = years
+        return pd.DataFrame(columns)
+
+    def _find_runs(self, names: _Values, sexes: _Values) -> np.ndarray:
+        name_codes = pd.Categorical(names, categories=self.keys.name.cat.categories).codes.astype(np.int64)
+        sex_codes = pd.Categorical(sexes, categories=self.keys.sex.cat.categories).codes
+        codes = name_codes * len(self.keys.sex.cat.categories) + sex_codes
+        if not len(self._run_codes):
+            return np.full(len(codes), -1)
+        positions = np.minimum(np.searchsorted(self._run_codes, codes), len(self._run_codes) - 1)
+        return np.where((name_codes >= 0) & (sex_codes >= 0) & (self._run_codes[positions] == codes), positions, -1)
+
+    def bounds(self, mid_percentile: float) -> pd.DataFrame:
+        return self._bounds_cache.get_or_compute(mid_percentile, lambda: self._build_bounds(mid_percentile))
+
+    def _build_bounds(self, mid_percentile: float) -> pd.DataFrame:
+        year_lower, year_upper = self._year_bounds(mid_percentile, slice(None))
+        return self.keys.assign(year_lower=year_lower, year_upper=year_upper)
+
+    def _year_bounds(
+            self,
+            mid_percentile: float | np.ndarray,
+            runs: slice | np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        lower_percentile = .5 - mid_percentile / 2
+        upper_percentile = 1 - lower_percentile
+        starts, ends = self._starts[runs], self._ends[runs]
+        first_lower, last_lower = self._nearest(lower_percentile, starts, ends)
+        first_upper, last_upper = self._nearest(upper_percentile, starts, ends)
+        return self._years[np.minimum(first_lower, first_upper)], self._years[np.maximum(last_lower, last_upper)]
+
+    def _nearest(
+            self,
+            percentile: float | np.ndarray,
+            starts: np.ndarray,
+            ends: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # the closest cumulative value sits on one side or the other of the insertion point, and every year
+        # with a value just as close (equal values on either side, or an exact tie across) counts too
+        values = self._cumulative
+        after = _search_runs(values, starts, ends, percentile, 'left')
+        before = np.maximum(after - 1, 0)
+        distance_before = np.where(after > starts, np.abs(percentile - values[before]), np.inf)
+        distance_after = np.where(after < ends, np.abs(percentile - values[np.minimum(after, len(values) - 1)]), np.inf)
+        nearest = np.minimum(distance_before, distance_after)
+
+        first = np.where(distance_before == nearest, _search_runs(values, starts, ends, values[before], 'left'), after)
+        last = np.where(distance_after == nearest, _search_runs(
+            values, starts, ends, values[np.minimum(after, len(values) - 1)], 'right') - 1, before)
+        return first, last
+
+
+def _search_runs(
+        values: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        targets: float | np.ndarray,
+        side: str,
+) -> np.ndarray:
+    # np.searchsorted for every ascending run at once: each step halves all of the runs' search ranges together
+    low, high = starts.copy(), ends.copy()
+    while (active := low < high).any():
+        middle = (low + high) // 2
+        probe = values[np.minimum(middle, len(values) - 1)]
+        go_right = active & ((probe < targets) if side == 'left' else (probe <= targets))
+        low = np.where(go_right, middle + 1, low)
+        high = np.where(active & ~go_right, middle, high)
+    return low
@@ -1,23 +1,116 @@
-from flask import Flask, request, jsonify, render_template
+import functools
+import io
+import logging
+import os
+import threading
+from itertools import chain
+from time import perf_counter
+
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, render_template, stream_with_context
 
 from core import Displayer
-from names_by_peak import load_final, filter_final
-from predict_gender_and_age import predict_gender_batch, predict_age_batch
+from names_by_peak import load_final, filter_final, filter_cache_stats
+from predict_gender_and_age import (
+    predict_gender_batch, predict_age_batch, warm_predict_gender_reference, warm_predict_age_reference)
+from predict_stream import StreamFormat, Predictor, parse_flag, stream_predictions
 
-app = Flask(__name__)
-app.json.sort_keys = False
+api = Blueprint('api', __name__)
+_RETRY_AFTER_SECONDS: int = 5
 
 
 class AppDataset:
-    names_by_peak = load_final()
+    def __init__(self, mmap: bool = False, displayer: Displayer = None) -> None:
+        self.mmap = mmap
+        self.started = perf_counter()
+        self.seconds_to_ready: float | None = None
+        self.error: BaseException | None = None
+        self._ready = threading.Event()
+        self._displayer = displayer
+        # the peak table is small and read straight from disk, so /peak works before the displayer is built
+        self.names_by_peak = load_final(mmap=mmap)
+        if displayer is not None:
+            self._set_ready()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def displayer(self) -> Displayer:
+        return self._displayer
+
+    def start(self) -> None:
+        threading.Thread(target=self._build, name='dataset-build', daemon=True).start()
+        return
+
+    def _build(self) -> None:
+        try:
+            displayer = Displayer()
+            displayer.build_base(mmap=self.mmap)
+            warm_predict_gender_reference(displayer)
+            warm_predict_age_reference(displayer)
+        except Exception as e:
+            self.error = e
+            logging.getLogger(__name__).exception('dataset failed to build')
+            return
+        self._displayer = displayer
+        self._set_ready()
+        return
+
+    def _set_ready(self) -> None:
+        self.seconds_to_ready = perf_counter() - self.started
+        self._ready.set()
+        logging.getLogger(__name__).info(f'dataset ready {self.seconds_to_ready:.1f}s after startup')
+        return
+
+
+def create_app(mmap: bool = None, dataset: AppDataset = None) -> Flask:
+    # with NAME_FINDER_MMAP=1, worker processes map one shared on-disk copy of the tables instead of loading their own
+    if mmap is None:
+        mmap = os.environ.get('NAME_FINDER_MMAP') == '1'
+    app = Flask(__name__)
+    app.json.sort_keys = False
+    app.register_blueprint(api)
+    if dataset is None:
+        dataset = AppDataset(mmap)
+        dataset.start()
+    app.extensions['dataset'] = dataset
+    return app
+
+
+def _dataset() -> AppDataset:
+    return current_app.extensions['dataset']
+
+
+def _requires_displayer(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        dataset = _dataset()
+        if dataset.error is not None:
+            return jsonify(dict(errors=['dataset failed to build'])), 500
+        if not dataset.ready:
+            response = jsonify(dict(errors=['dataset is still loading'], retry_after=_RETRY_AFTER_SECONDS))
+            return response, 503, {'Retry-After': str(_RETRY_AFTER_SECONDS)}
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@api.route('/ready')
+def ready_api():
+    dataset = _dataset()
+    result = dict(ready=dataset.ready, seconds_to_ready=dataset.seconds_to_ready)
+    if dataset.ready:
+        return jsonify(result)
+    return jsonify(result), 503, {'Retry-After': str(_RETRY_AFTER_SECONDS)}
 
 
-@app.route('/')
+@api.route('/')
 def index_page():
     return render_template('index.html')
 
 
-@app.route('/peak', methods=['GET', 'POST'])
+@api.route('/peak', methods=['GET', 'POST'])
 def peak_page():
     if request.method == 'GET':
         return render_template('names_by_peak.html')
@@ -38,7 +131,7 @@ def peak_page():
         yearBand = 0
 
     result = filter_final(
-        AppDataset.names_by_peak,
+        _dataset().names_by_peak,
         year=int(year),
         yearBand=int(yearBand),
         usePeak=payload.get('usePeak'),
@@ -50,22 +143,27 @@ def peak_page():
         numLo=int(numLo) if numLo else None,
         numHi=int(numHi) if numHi else None,
     )
-    if len(result):
-        result = result.iloc[:int(numResults)].to_dict('records')
-    return jsonify(result)
+    return jsonify(result.iloc[:int(numResults)].to_dict('records'))
 
 
-@app.route('/predict-gender', methods=['POST'])
+@api.route('/predict-gender', methods=['POST'])
+@_requires_displayer
 def predict_gender_api():
-    payload = request.json
+    # flags are parsed once, so the prediction and the echoed params agree even when they're sent as strings
+    payload = dict(request.json)
+    payload.update({i: parse_flag(payload.get(i)) for i in ('living', 'fuzzy')})
     result = dict(
-        params=dict(after=payload.get('after'), before=payload.get('before')),
-        data=predict_gender_batch(**payload, displayer=displayer),
+        params=dict(
+            after=payload.get('after'), before=payload.get('before'), year=payload.get('year'),
+            living=payload['living'], fuzzy=payload['fuzzy'],
+        ),
+        data=predict_gender_batch(**payload, displayer=_dataset().displayer),
     )
     return jsonify(result)
 
 
-@app.route('/predict-age', methods=['POST'])
+@api.route('/predict-age', methods=['POST'])
+@_requires_displayer
 def predict_age_api():
     payload = request.json
     name = payload.get('name')
@@ -89,24 +187,26 @@ def predict_age_api():
         kwargs = dict(name=name, sex=sex)
         if mid_percentile:
             kwargs['mid_percentile'] = float(mid_percentile)
-        result = displayer.predict_age(**kwargs)
+        result = _dataset().displayer.predict_age(**kwargs)
         result.percentile = result.percentile.round(3)
         result = dict(params=kwargs, data=result.to_dict('index'))
 
     return jsonify(result)
 
 
-@app.route('/predict-age-batch', methods=['POST'])
+@api.route('/predict-age-batch', methods=['POST'])
+@_requires_displayer
 def predict_age_batch_api():
     payload = request.json
     data = payload.get('data')
     mid_percentile = payload.get('mid_percentile')
+    fuzzy = parse_flag(payload.get('fuzzy'))
 
     if data:
         mid_percentile = float(mid_percentile) if mid_percentile else .68
         result = dict(
-            params=dict(mid_percentile=mid_percentile),
-            data=predict_age_batch(displayer, mid_percentile, data),
+            params=dict(mid_percentile=mid_percentile, fuzzy=fuzzy),
+            data=predict_age_batch(_dataset().displayer, mid_percentile, data, fuzzy),
         )
     else:
         result = dict(errors=['`data` not passed'])
@@ -114,7 +214,45 @@ def predict_age_batch_api():
     return jsonify(result)
 
 
+@api.route('/predict-gender-stream', methods=['POST'])
+@_requires_displayer
+def predict_gender_stream_api():
+    return _stream_predictions_response(Predictor.GENDER)
+
+
+@api.route('/predict-age-stream', methods=['POST'])
+@_requires_displayer
+def predict_age_stream_api():
+    return _stream_predictions_response(Predictor.AGE)
+
+
+def _stream_predictions_response(predictor: str):
+    # the body is csv or jsonl rows, and parameters come from the query string since the body isn't json
+    fmt = StreamFormat.CSV if request.mimetype == 'text/csv' else StreamFormat.JSONL
+    kwargs = {k: v for k, type_ in Predictor.PARAMETERS[predictor].items() if (
+        v := request.args.get(k, type=type_)) is not None}
+    lines = stream_predictions(
+        io.TextIOWrapper(request.stream, encoding='utf-8'), predictor, _dataset().displayer, fmt, **kwargs)
+
+    # the first chunk is read up front, so bad input gets a proper error instead of a truncated stream
+    try:
+        first = next(lines, '')
+    except ValueError as e:
+        return jsonify(dict(errors=[str(e)])), 400
+    mimetype = 'text/csv' if fmt == StreamFormat.CSV else 'application/x-ndjson'
+    return Response(stream_with_context(chain([first], lines)), mimetype=mimetype)
+
+
+@api.route('/cache-stats')
+@_requires_displayer
+def cache_stats_api():
+    result = dict(
+        displayer=_dataset().displayer.result_cache.stats(),
+        names_by_peak=filter_cache_stats(),
+    )
+    return jsonify(result)
+
+
 if __name__ == '__main__':
-    displayer = Displayer()
-    displayer.build_base()
-    app.run()
+    logging.basicConfig(level=logging.INFO)
+    create_app().run()
@@ -0,0 +1,1148 @@
+import argparse
+import functools
+import http.server
+import inspect
+import multiprocessing
+import os
+import re
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
+from time import perf_counter, sleep
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import core_state
+from app import AppDataset, create_app
+from core import (
+    Filepath, DFAgg, Displayer, UnknownName, Year, build_all_generated_data, _load_name_data_for_one_year, _NameIndex)
+from demos import SsaSex
+from name_filter import TextFilter, NgramIndex
+from name_matching import FuzzyNameIndex, _edit_distances, _encode
+from name_loader import list_name_files, open_name_file, load_name_files
+from name_normalization import standardize_name, standardize_names
+import names_by_peak
+from names_by_peak import PeakTable, load_final, filter_final
+from predict_gender_and_age import predict_age_frame, predict_gender_frame
+from refresh_data import SsaDataDownloader, SsaUrl
+from result_cache import ResultCache
+from snapshot import _MANIFEST_FILENAME
+
+
+def _time_subprocess(code: str) -> float:
+    start = perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True)
+    return perf_counter() - start
+
+
+def benchmark_cold_start(repeat: int = 3) -> None:
+    build = 'from core import Displayer; Displayer().build_base(use_snapshot={})'
+    shutil.rmtree(Filepath.SNAPSHOT_DIR, ignore_errors=True)
+    without_snapshot = min(_time_subprocess(build.format(False)) for _ in range(repeat))
+    snapshot_write = _time_subprocess(build.format(True))
+    with_snapshot = min(_time_subprocess(build.format(True)) for _ in range(repeat))
+    print(f'cold start without snapshot: {without_snapshot:.2f}s')
+    print(f'cold start writing snapshot: {snapshot_write:.2f}s')
+    print(f'cold start from snapshot:    {with_snapshot:.2f}s ({without_snapshot / with_snapshot:.1f}x)')
+    return
+
+
+def _build_displayer(cache: bool = False) -> Displayer:
+    displayer = Displayer()
+    displayer.build_base()
+    if not cache:
+        displayer.result_cache = ResultCache(max_entries=0)
+    return displayer
+
+
+def _sample_names(displayer: Displayer, size: int, seed: int = 0) -> list[str]:
+    # noinspection PyProtectedMember
+    names = displayer._calcd.name.drop_duplicates()
+    return names.sample(min(size, len(names)), random_state=seed).tolist()
+
+
+def _latency_percentiles(func, args: list) -> str:
+    timings = []
+    for arg in args:
+        start = perf_counter()
+        func(arg)
+        timings.append(perf_counter() - start)
+    p50, p99 = np.percentile(timings, [50, 99]) * 1000
+    return f'p50={p50:.2f}ms p99={p99:.2f}ms'
+
+
+class _FullScanIndex:
+    def __init__(self, df: pd.DataFrame) -> None:
+        self._df = df
+
+    def get(self, name: str) -> pd.DataFrame:
+        df = self._df.copy()
+        return df[df.name == name]
+
+
+def benchmark_name_lookup(size: int = 200) -> None:
+    displayer = _build_displayer()
+    names = _sample_names(displayer, size)
+    indexed = vars(displayer).copy()
+    for attr in ('_calcd', '_peaks'):
+        setattr(displayer, f'{attr}_by_name', _FullScanIndex(getattr(displayer, attr)))
+    print(f'full scan: name() {_latency_percentiles(displayer.name, names)}')
+    vars(displayer).update(indexed)
+    print(f'indexed:   name() {_latency_percentiles(displayer.name, names)}')
+    return
+
+
+def _time_per_call(func, repeat: int) -> float:
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat
+
+
+def benchmark_count_matrix(repeat: int = 5) -> None:
+    displayer = _build_displayer()
+    calcd = displayer.calculated
+    counts = displayer.counts
+    print(f'matrix: {len(counts.names):,} names x {counts.last_year - counts.first_year + 1} years,'
+          f' {counts.nbytes / 2 ** 20:.1f} MiB')
+    for window in (dict(), dict(after=1990), dict(after=1950, before=1990), dict(year=2000)):
+        years = calcd.year == window['year'] if 'year' in window else (
+                (calcd.year >= window.get('after', 0)) & (calcd.year <= window.get('before', 9999)))
+        groupby = _time_per_call(lambda: calcd[years].groupby('name', as_index=False).agg(DFAgg.NUMBER_SUM), repeat)
+        matrix = _time_per_call(lambda: counts.frame(**window), repeat)
+        print(f'{window}: groupby {groupby * 1000:.1f}ms, matrix {matrix * 1000:.1f}ms')
+    return
+
+
+_SEARCHES: tuple[dict, ...] = (
+    dict(start=('ma',), number_min=1000),
+    dict(end=('lyn', 'lynn'), after=1990),
+    dict(contains=('ar', 'e'), not_contains=('q',), length_max=7),
+    dict(contains_any=('ae', 'ei', 'ie'), gender=(.3, .7)),
+    dict(order=('a', 'e', 'a'), not_start=('a',), not_end=('e',)),
+    dict(pattern='^[^aeiou]+a[^aeiou]+$', year=2000),
+    dict(start=('j',), end=('n',), contains=('a',), order=('j', 'a'), number_min=500, top=50),
+)
+
+
+def benchmark_search(repeat: int = 20) -> None:
+    displayer = _build_displayer()
+    for kwargs in _SEARCHES:
+        per_call = _time_per_call(lambda: displayer.search(**kwargs), repeat)
+        print(f'{1 / per_call:8.1f} searches/s  {kwargs}')
+    return
+
+
+def _synthetic_vocabulary(names: pd.Series, size: int, seed: int = 0) -> pd.Index:
+    rng = np.random.default_rng(seed)
+    heads = names.str.slice(0, 3).to_numpy()
+    tails = names.str.slice(3).str.lower().to_numpy()
+    vocabulary = pd.Index(names)
+    while len(vocabulary) < size:
+        vocabulary = vocabulary.union(np.unique(rng.choice(heads, size) + rng.choice(tails, size)))
+    return vocabulary[rng.permutation(len(vocabulary))[:size]].sort_values()
+
+
+def benchmark_ngram_search(sizes: tuple[int, ...] = (10_000, 100_000, 1_000_000), repeat: int = 5) -> None:
+    displayer = _build_displayer()
+    names = pd.Series(displayer.counts.names)
+    text_keys = inspect.signature(TextFilter).parameters
+    filters = [TextFilter(**{k: v for k, v in i.items() if k in text_keys}) for i in _SEARCHES]
+    for size in sizes:
+        vocabulary = _synthetic_vocabulary(names, size)
+        series = pd.Series(vocabulary)
+        start = perf_counter()
+        index = NgramIndex(vocabulary)
+        build = perf_counter() - start
+        scan = sum(_time_per_call(lambda: i.mask(series), repeat) for i in filters)
+
+        def prefiltered(text_filter: TextFilter) -> np.ndarray:
+            positions = index.candidates(text_filter)
+            candidates = series if positions is None else series.iloc[positions]
+            return candidates[text_filter.mask(candidates)]
+
+        indexed = sum(_time_per_call(lambda: prefiltered(i), repeat) for i in filters)
+        print(f'{size:>9,} names: index built in {build:.2f}s;'
+              f' {len(filters)} text filters: scan {scan * 1000:.1f}ms, n-gram prefilter {indexed * 1000:.1f}ms')
+    return
+
+
+def benchmark_result_cache(size: int = 2000, vocabulary: int = 500, seed: int = 0) -> None:
+    # popular names dominate real traffic, so requests are drawn from a zipf distribution over the vocabulary
+    rng = np.random.default_rng(seed)
+    uncached = _build_displayer()
+    names = _sample_names(uncached, vocabulary, seed)
+    requests = [names[i % len(names)] for i in rng.zipf(1.3, size) - 1]
+    cached = _build_displayer(cache=True)
+    for method in ('name', 'predict_gender'):
+        for label, displayer in (('uncached', uncached), ('cached', cached)):
+            print(f'{label:>8}: {method}() {_latency_percentiles(getattr(displayer, method), requests)}')
+    print(f'cache stats: {cached.result_cache.stats()}')
+    return
+
+
+def benchmark_predict_gender_load(batch_sizes: tuple[int, ...] = (1, 100, 10_000), duration: float = 3.) -> None:
+    displayer = _build_displayer()
+    client = create_app(dataset=AppDataset(displayer=displayer)).test_client()
+    names = _sample_names(displayer, max(batch_sizes))
+    for batch_size in batch_sizes:
+        payload = dict(data=[dict(name=i) for i in names[:batch_size]])
+        for label, max_entries in (('rebuilt per request', 0), ('cached reference', 8)):
+            displayer.reference_cache = ResultCache(max_entries=max_entries, copy_results=False)
+            client.post('/predict-gender', json=payload)
+            requests, start = 0, perf_counter()
+            while perf_counter() - start < duration:
+                client.post('/predict-gender', json=payload)
+                requests += 1
+            print(f'batch of {batch_size:>6,}, {label:>19}: {requests / (perf_counter() - start):8.1f} requests/s')
+    return
+
+
+def _legacy_predict_gender(
+        raw_with_actuarial: _NameIndex,
+        name: str,
+        after: int = None,
+        before: int = None,
+        year: int = None,
+        living: bool = True,
+) -> tuple[float, str | None, float | None]:
+    # the original per-name algorithm: filter the name's rows to the window, then sum by sex
+    df = raw_with_actuarial.get(name)
+    number_col = 'number_living' if living else 'number'
+    if year:
+        df = df[df.year == year]
+    else:
+        df = df[(df.year >= (after or 0)) & (df.year <= (before or df.year.max()))]
+    number = df[number_col].sum()
+    if not number:
+        return number, None, None
+    numbers = df.groupby('sex', observed=True)[number_col].sum()
+    prediction = SsaSex.Female if numbers.get(SsaSex.Female, 0) > numbers.get(SsaSex.Male, 0) else SsaSex.Male
+    return int(number), prediction, round(numbers[prediction] / number, 2)
+
+
+def benchmark_predict_gender_living(
+        batch_sizes: tuple[int, ...] = (1, 100, 10_000),
+        windows: tuple[dict, ...] = (
+            dict(after=Year.DATA_QUALITY_BEST_AFTER), dict(after=1950, before=1990), dict(year=1970)),
+        checks: int = 200,
+) -> None:
+    displayer = _build_displayer()
+    names = _sample_names(displayer, max(batch_sizes)) + ['Notaname']
+    raw_with_actuarial = _NameIndex(displayer.raw_with_actuarial)
+    start = perf_counter()
+    counts = displayer.actuarial_counts()
+    print(f'cumulative counts: built in {perf_counter() - start:.2f}s, {counts.nbytes / 2 ** 20:.1f} MiB')
+
+    # the single-name wrapper must agree with the original algorithm, and the batch with the single-name wrapper
+    bad = 0
+    for window in windows:
+        for living in (True, False):
+            for name in names[:checks // len(windows)] + ['Notaname']:
+                output = displayer.predict_gender(name, living=living, **window)
+                expected = _legacy_predict_gender(raw_with_actuarial, name, living=living, **window)
+                bad += (output['number'], output.get('prediction'), output.get('confidence')) != (
+                    int(expected[0]), *expected[1:])
+        batch = predict_gender_frame(pd.DataFrame(dict(name=names[:checks])), living=True, displayer=displayer,
+                                     **window).set_index('name').gender_prediction
+        for name in names[:checks]:
+            number, prediction, _ = _legacy_predict_gender(raw_with_actuarial, name, **window)
+            expected = 'unk' if not number else 'rare' if number < 25 else prediction
+            bad += batch[name] != expected and not (batch[name] == 'x' and expected in SsaSex.Both)
+    print(f'checked {checks} names in {len(windows)} windows against the original algorithm: {bad} mismatches')
+
+    for window in windows:
+        label = ', '.join(f'{k}={v}' for k, v in window.items())
+        for batch_size in batch_sizes:
+            batch = names[:batch_size]
+            repeat = max(1, 100 // batch_size)
+            loop = _time_per_call(lambda: [_legacy_predict_gender(
+                raw_with_actuarial, i, **window) for i in batch[:1000]], 1) * batch_size / len(batch[:1000])
+            vectorized = _time_per_call(lambda: predict_gender_frame(
+                pd.DataFrame(dict(name=batch)), living=True, displayer=displayer, **window), repeat)
+            print(f'{label:>22}, batch of {batch_size:>6,}: per-name loop {loop * 1000:9.1f}ms,'
+                  f' vectorized {vectorized * 1000:7.1f}ms')
+    return
+
+
+def _legacy_predict_age(
+        age_reference: pd.DataFrame,
+        name: str,
+        sex: str,
+        mid_percentile: float,
+) -> tuple[int, int] | None:
+    # the original single-name algorithm: the years whose cumulative share is nearest to either percentile
+    lower_percentile = .5 - mid_percentile / 2
+    upper_percentile = 1 - lower_percentile
+    df = age_reference[(age_reference.name == name) & (age_reference.sex == sex)]
+    cumulative = df.number_living_pct.cumsum()
+    lower, upper = (lower_percentile - cumulative).abs(), (upper_percentile - cumulative).abs()
+    years = df.year[(lower == lower.min()) | (upper == upper.min())]
+    if not len(years):
+        return None
+    return int(years.min()), int(years.max())
+
+
+def benchmark_predict_age_batch(batch_sizes: tuple[int, ...] = (1, 1_000, 1_000_000), checks: int = 300) -> None:
+    displayer = _build_displayer()
+    # noinspection PyProtectedMember
+    age_reference = displayer._age_reference
+    keys = age_reference[['name', 'sex']].drop_duplicates().astype(str)
+    rng = np.random.default_rng(0)
+    data = keys.sample(max(batch_sizes), replace=True, random_state=0).assign(
+        mid_percentile=rng.choice([.25, .5, .68, .9, .95], max(batch_sizes))).reset_index(drop=True)
+    data.loc[data.index[::1000], 'name'] = 'Notaname'
+
+    # the batch engine, the single-name wrapper and the original algorithm must agree query by query
+    sample = data[data.name != 'Notaname'].head(checks)
+    batch = predict_age_frame(displayer, .68, sample)
+    windowed = age_reference[age_reference.year >= Year.DATA_QUALITY_BEST_AFTER]
+    bad = sum(
+        (None if pd.isna(row.year_lower) else (row.year_lower, row.year_upper)) != _legacy_predict_age(
+            windowed, row.name, row.sex, row.mid_percentile) for row in batch.itertuples())
+    # both paths use the same window, so the single-name answer is checked against the batch row as well
+    for row in batch.head(checks // 3).itertuples():
+        single = displayer.predict_age(row.name, row.sex, row.mid_percentile).year
+        expected = _legacy_predict_age(windowed, row.name, row.sex, row.mid_percentile)
+        bad += (single.lower, single.upper) != expected or single.band != expected[1] - expected[0]
+        bad += (single.lower, single.upper) != (row.year_lower, row.year_upper)
+    fixed = predict_age_frame(displayer, .68, data.drop(columns='mid_percentile').head(10_000))
+    merged = data.head(10_000).assign(sex=data.sex.str.lower()).merge(displayer.age_percentiles(
+        Year.DATA_QUALITY_BEST_AFTER).bounds(.68), on=['name', 'sex'], how='left')
+    bad += not fixed.year_lower.equals(merged.year_lower) or not fixed.year_upper.equals(merged.year_upper)
+    print(f'checked {checks} batch and {checks // 3} single-name predictions against the original algorithm (and the'
+          f' single ones against the batch) and 10,000 against the merged bounds: {bad} mismatches')
+
+    for batch_size in batch_sizes:
+        batch = data.head(batch_size)
+        # noinspection PyProtectedMember
+        displayer._age_percentiles = {}
+        cold = _time_per_call(lambda: predict_age_frame(displayer, .68, batch.drop(columns='mid_percentile')), 1)
+        repeat = max(1, 1000 // batch_size)
+        warm = _time_per_call(lambda: predict_age_frame(displayer, .68, batch.drop(columns='mid_percentile')), repeat)
+        mixed = _time_per_call(lambda: predict_age_frame(displayer, .68, batch), repeat)
+        print(f'batch of {batch_size:>9,}: first call {cold * 1000:.1f}ms, one percentile {warm * 1000:.1f}ms,'
+              f' a percentile per query {mixed * 1000:.1f}ms')
+    return
+
+
+def _misspelled_names(names: pd.Index, size: int, seed: int = 0) -> pd.Index:
+    # one or two typos each: a letter substituted, dropped, doubled or swapped with the next one
+    rng = np.random.default_rng(seed)
+    misspelled = set()
+    for name in rng.choice(np.asarray(names, dtype=object), size * 2):
+        for _ in range(rng.integers(1, 3)):
+            i, letter, edit = rng.integers(0, len(name)), chr(rng.integers(97, 123)), rng.integers(0, 4)
+            name = [name[:i] + letter + name[i + 1:], name[:i] + name[i + 1:], name[:i] + name[i:i + 1] + name[i:],
+                    name[:i] + name[i + 1:i + 2] + name[i:i + 1] + name[i + 2:]][edit]
+        misspelled.add(standardize_name(name))
+    misspelled = pd.Index(sorted(misspelled - set(names) - {''}))
+    return misspelled[rng.permutation(len(misspelled))[:size]]
+
+
+def _osa_distance(a: str, b: str) -> int:
+    # the textbook optimal string alignment distance, one pair at a time
+    rows = [list(range(len(b) + 1))]
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            row[j] = min(rows[-1][j] + 1, row[j - 1] + 1, rows[-1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], rows[-2][j - 2] + 1)
+        rows.append(row)
+    return rows[-1][-1]
+
+
+# the usual spelling first, then others that are queried with the usual one as the only one left to match
+_SPELLING_VARIANTS: tuple[tuple[str, ...], ...] = (
+    ('Muhammad', 'Mohammed', 'Mohamed', 'Muhammed'), ('Alexander', 'Aleksandr', 'Aleksander'),
+    ('Catherine', 'Katherine', 'Kathryn'), ('Philip', 'Filip', 'Phillip'), ('Christopher', 'Kristopher', 'Cristofer'),
+    ('Stephen', 'Steven', 'Stefan'), ('Jeffrey', 'Geoffrey'), ('Caitlin', 'Kaitlyn', 'Katelyn'),
+    ('Yusuf', 'Yousef', 'Youssef'), ('Sean', 'Shawn', 'Shaun'), ('Sofia', 'Sophia'), ('Nikolai', 'Nicolai'),
+    ('Dmitri', 'Dimitri'), ('Sergei', 'Sergey'), ('Ahmad', 'Ahmed'), ('Hussein', 'Husain'), ('Aisha', 'Ayesha'),
+    ('Carlos', 'Karlos'), ('Chloe', 'Khloe'), ('Cameron', 'Kameron'), ('Camila', 'Kamila'), ('Xander', 'Zander'),
+)
+_NICKNAMES: tuple[tuple[str, ...], ...] = (
+    ('William', 'Bill', 'Will'), ('Robert', 'Bob', 'Rob'), ('Margaret', 'Peggy', 'Maggie'), ('Richard', 'Dick'),
+    ('Elizabeth', 'Betsy', 'Liz'), ('Edward', 'Ted', 'Ned'), ('James', 'Jim'), ('John', 'Jack'), ('Henry', 'Hank'),
+)
+
+
+def _variant_recall(names: pd.Index, numbers: np.ndarray, groups: tuple[tuple[str, ...], ...]) -> dict[str, str]:
+    # every variant is taken out of the index, so the usual spelling is the match to find; usual spellings the data
+    # lacks are added with a middling count
+    usual = pd.Index([i[0] for i in groups]).difference(names)
+    names, numbers = names.append(usual), np.append(numbers, np.full(len(usual), int(np.median(numbers))))
+    variants = pd.Series([j for i in groups for j in i[1:]])
+    expected = np.array([i[0] for i in groups for _ in i[1:]], dtype=object)
+    is_kept = ~names.isin(variants)
+    index = FuzzyNameIndex(names[is_kept], numbers[is_kept])
+    recall = dict(metaphone_and_soundex=index.match(variants, score_min=0).matched_name.to_numpy() == expected)
+    # noinspection PyProtectedMember
+    index._metaphone, index._metaphone_keys = np.zeros_like(index._metaphone), np.empty(0, dtype=np.int64)
+    recall['soundex_only'] = index.match(variants, score_min=0).matched_name.to_numpy() == expected
+    return {k: f'{v.sum()} of {len(v)}' for k, v in recall.items()}
+
+
+def benchmark_fuzzy_match(
+        sizes: tuple[int, ...] = (10_000, 100_000),
+        caps: tuple[int, ...] = (8, 32, 128),
+        queries: int = 20_000,
+        rows: int = 1_000_000,
+        checks: int = 300,
+) -> None:
+    displayer = _build_displayer()
+    names = pd.Series(displayer.counts.names)
+    rng = np.random.default_rng(0)
+
+    # the vectorized distances must match the textbook ones, and an uncapped lookup must find a name as close as
+    # the closest of all of them, whenever that one is within the index's max distance
+    vocabulary = _synthetic_vocabulary(names, min(sizes))
+    index = FuzzyNameIndex(vocabulary, rng.integers(5, 100_000, len(vocabulary)))
+    sample = _misspelled_names(vocabulary, checks)
+    a, b = rng.choice(vocabulary.str.lower(), 2000), rng.choice(sample.str.lower(), 2000)
+    (a_chars, a_lengths), (b_chars, b_lengths) = _encode(pd.Index(a)), _encode(pd.Index(b))
+    bad = sum(int(i) != _osa_distance(x, y) for i, x, y in zip(
+        _edit_distances(a_chars, a_lengths, b_chars, b_lengths), a, b))
+    chars, lengths = _encode(vocabulary)
+    closest = np.array([_edit_distances(
+        np.repeat(query_chars[None], len(chars), axis=0), np.repeat(query_length, len(chars)), chars, lengths,
+    ).min() for query_chars, query_length in zip(*_encode(sample))])
+    for cap in (10 ** 9, *caps):
+        matches = index.match(pd.Series(sample), max_candidates=cap, score_min=0)
+        found = np.array([_osa_distance(x.lower(), y.lower()) if y else 99 for x, y in zip(
+            sample, matches.matched_name)])
+        within = closest <= index.max_distance
+        if cap == 10 ** 9:
+            bad += int((found[within] != closest[within]).sum())
+        else:
+            print(f'candidate cap {cap:>3}: closest name found for {(found[within] == closest[within]).mean():.1%}'
+                  f' of {within.sum()} typos with one within {index.max_distance} edits')
+    print(f'checked 2,000 distances and {checks} uncapped matches against brute force: {bad} mismatches')
+
+    # phonetic keys find spellings too far apart for the edit distance; nicknames need a lookup table instead
+    numbers = displayer.counts.window().sum(axis=1)
+    for label, groups in dict(spelling_variants=_SPELLING_VARIANTS, nicknames=_NICKNAMES).items():
+        recall = _variant_recall(displayer.counts.names, numbers, groups)
+        print(f'{label} matched to the usual spelling: {", ".join(f"{k} {v}" for k, v in recall.items())}')
+
+    for size in sizes:
+        vocabulary = _synthetic_vocabulary(names, size)
+        start = perf_counter()
+        index = FuzzyNameIndex(vocabulary, rng.integers(5, 100_000, len(vocabulary)))
+        build = perf_counter() - start
+        typos = pd.Series(_misspelled_names(vocabulary, queries))
+        timings = []
+        for cap in caps:
+            elapsed = _time_per_call(lambda: index.match(typos, max_candidates=cap), 1)
+            timings.append(f'cap {cap} {len(typos) / elapsed:,.0f}/s')
+        print(f'{size:>7,} names: index built in {build:.2f}s, {index.nbytes / 2 ** 20:.1f} MiB;'
+              f' {len(typos):,} distinct typos matched at {", ".join(timings)}')
+
+    # a realistic batch: mostly known names, the rest drawn from a smaller pool of typos that repeat
+    known = rng.choice(names.to_numpy(dtype=object), rows)
+    typos = _misspelled_names(displayer.counts.names, 2_000)
+    batch = pd.DataFrame(dict(name=np.where(rng.random(rows) < .1, rng.choice(typos, rows), known)))
+    ages = batch.assign(sex=rng.choice(['f', 'm'], rows))
+    for label, func in (
+            ('gender', lambda fuzzy: predict_gender_frame(batch, fuzzy=fuzzy, displayer=displayer)),
+            ('age', lambda fuzzy: predict_age_frame(displayer, .68, ages, fuzzy)),
+    ):
+        exact, fuzzy = func(False), func(True)
+        matched = (exact.gender_prediction == 'unk') if label == 'gender' else exact.year_lower.isna()
+        recovered = matched & ((fuzzy.gender_prediction != 'unk') if label == 'gender' else fuzzy.year_lower.notna())
+        print(f'{rows:,} {label} predictions: exact {_time_per_call(lambda: func(False), 1):.2f}s,'
+              f' fuzzy {_time_per_call(lambda: func(True), 1):.2f}s;'
+              f' {recovered.sum():,} of {matched.sum():,} rows without a prediction given one')
+    return
+
+
+def _legacy_standardize_name(name: str) -> str:
+    reference = {
+        'a': 'à|á',
+        'c': 'ç',
+        'e': 'è|é|ê|ë',
+        'i': 'í|î',
+        'n': 'ñ',
+        'o': 'ó|ô',
+        'u': 'ù|ú|ü',
+    }
+    name = name.lower()
+    for deacc, acc in reference.items():
+        name = re.sub(acc, deacc, name)
+    return ''.join(re.findall(f'[{string.ascii_lowercase}]+', name)).title()
+
+
+def _noisy_names(names: list[str], size: int, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    # noise limited to what the legacy function handles, so both versions must agree on every input
+    noise = np.array(list(' -.\'!0123456789àáçèéêëíîñóôùúüÀÉÑ'))
+    names = rng.choice(np.array(names, dtype=object), size)
+    positions = rng.integers(0, 8, size)
+    return pd.Series([
+        (i[:p] + c + i[p:]).upper() if upper else i[:p] + c + i[p:]
+        for i, p, c, upper in zip(names, positions, rng.choice(noise, size), rng.random(size) < .1)
+    ])
+
+
+def benchmark_standardize_name(size: int = 200_000) -> None:
+    displayer = _build_displayer()
+    names = _noisy_names(_sample_names(displayer, 20_000), size)
+    legacy = names.map(_legacy_standardize_name)
+    mismatches = names[standardize_names(names) != legacy]
+    print(f'compared against legacy standardization: {len(mismatches)} mismatches {mismatches.head().tolist()}')
+
+    standardize_name.cache_clear()
+    for label, func in (
+            ('legacy, per row', lambda: names.map(_legacy_standardize_name)),
+            ('translate, per row', lambda: names.map(standardize_name.__wrapped__)),
+            ('series, cold memo', lambda: (standardize_name.cache_clear(), standardize_names(names))),
+            ('series, warm memo', lambda: standardize_names(names)),
+    ):
+        elapsed = _time_per_call(func, 1)
+        print(f'{label:>18}: {len(names) / elapsed:12,.0f} names/s')
+    return
+
+
+def _write_synthetic_batch(filepath: str, names: list[str], rows: int, chunk_size: int = 1_000_000) -> None:
+    rng = np.random.default_rng(0)
+    names = np.array(names, dtype=object)
+    for start in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - start)
+        pd.DataFrame(dict(
+            id=np.arange(start, start + size),
+            name=rng.choice(names, size),
+            sex=rng.choice(np.array(['f', 'm'], dtype=object), size),
+        )).to_csv(filepath, mode='a', header=not start, index=False)
+    return
+
+
+def _run_with_peak_rss(code: str) -> tuple[float, float]:
+    code += '\nimport resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+    start = perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return perf_counter() - start, int(output.split()[-1]) / 2 ** 10
+
+
+def benchmark_predict_stream(sizes: tuple[int, ...] = (1_000_000, 10_000_000)) -> None:
+    names = _sample_names(_build_displayer(), 50_000) + ['Notaname', 'Bâby', 'NA']
+    build = 'from core import Displayer; Displayer().build_base()'
+    build_elapsed, build_rss = _run_with_peak_rss(build)
+    print(f'dataset only: {build_elapsed:.1f}s, peak RSS {build_rss:,.0f} MiB')
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            input_filepath = os.path.join(directory, f'{rows}.csv')
+            _write_synthetic_batch(input_filepath, names, rows)
+            for predictor in ('gender', 'age'):
+                output_filepath = os.path.join(directory, f'{predictor}.jsonl')
+                stream = (f'import sys, predict_stream; sys.argv = ["", "{predictor}", "{input_filepath}",'
+                          f' "-o", "{output_filepath}"]; predict_stream.main()')
+                elapsed, rss = _run_with_peak_rss(stream)
+                print(f'{predictor:>6}, {rows:>10,} rows: {rows / (elapsed - build_elapsed):12,.0f} rows/s,'
+                      f' peak RSS {rss:,.0f} MiB')
+    return
+
+
+def _memory_usage_mib() -> dict[str, float]:
+    # pss splits each shared page between the processes mapping it, so it adds up across workers
+    with open('/proc/self/smaps_rollup') as f:
+        fields = dict(line.split()[:2] for line in f if line.split()[0] in ('Rss:', 'Pss:'))
+    return dict(rss=int(fields['Rss:']) / 2 ** 10, pss=int(fields['Pss:']) / 2 ** 10)
+
+
+def _boot_worker(mmap: bool, started: float, barrier, results) -> None:
+    displayer = Displayer()
+    displayer.build_base(mmap=mmap)
+    final = load_final(mmap=mmap)
+    booted = perf_counter() - started
+    for name in _sample_names(displayer, 20):
+        displayer.name(name)
+        displayer.predict_gender(name)
+    displayer.search(start=('a',))
+    displayer.filter_peaks_or_raw(use_raw=True, year=2000)
+    final.df.describe()
+    # every worker stays alive until all are measured, so shared pages are split between all of them
+    barrier.wait()
+    results.put(dict(booted=booted, **_memory_usage_mib()))
+    barrier.wait()
+    return
+
+
+def benchmark_workers(workers: tuple[int, ...] = (1, 4, 16)) -> None:
+    context = multiprocessing.get_context('spawn')
+    Displayer().build_base()
+    load_final(mmap=True)
+    for mmap in (False, True):
+        for n in workers:
+            barrier, results = context.Barrier(n), context.Queue()
+            started = perf_counter()
+            processes = [context.Process(target=_boot_worker, args=(mmap, started, barrier, results)) for _ in range(n)]
+            for process in processes:
+                process.start()
+            measured = pd.DataFrame([results.get() for _ in processes])
+            for process in processes:
+                process.join()
+            print(f'{"mapped" if mmap else "private"}, {n:>2} workers: boot {measured.booted.mean():5.1f}s'
+                  f' (last {measured.booted.max():5.1f}s), per worker RSS {measured.rss.mean():6.0f} MiB,'
+                  f' PSS {measured.pss.mean():6.0f} MiB, total PSS {measured.pss.sum():7.0f} MiB')
+    return
+
+
+def benchmark_app_startup(poll_interval: float = .05) -> None:
+    started = perf_counter()
+    client = create_app().test_client()
+    created = perf_counter() - started
+    peak = client.post('/peak', json=dict(year=1990, yearBand=5, numResults=5))
+    not_ready = client.post('/predict-gender', json=dict(data=[dict(name='Mary')]))
+    print(f'app created in {created:.2f}s; /peak {peak.status_code}, /predict-gender {not_ready.status_code}'
+          f' (Retry-After {not_ready.headers.get("Retry-After")}) while loading')
+    while client.get('/ready').status_code != 200:
+        sleep(poll_interval)
+    print(f'ready after {perf_counter() - started:.2f}s; /predict-gender'
+          f' {client.post("/predict-gender", json=dict(data=[dict(name="Mary")])).status_code}')
+    return
+
+
+def _legacy_filter_final(final: pd.DataFrame, **kwargs) -> pd.DataFrame:
+    df = final.copy()
+    year, year_band, sex = kwargs['year'], kwargs['yearBand'], kwargs.get('sex')
+    age_ballpark, never_top = kwargs.get('ageBallpark'), kwargs.get('neverTop')
+    gender_category = kwargs.get('genderCat')
+    after, before = year - year_band, year + year_band
+    for col in PeakTable._INTEGER_COLUMNS:
+        df[col] = df[col].fillna(0).astype(int)
+    final_cols = {'name': 'Name', 'total_usages': f'Total {Year.DATA_QUALITY_BEST_AFTER}-{Year.MAX_YEAR}'}
+    sexes = (sex,) if sex else ('f', 'm')
+    prefixes = ('',) if sex else ('F ', 'M ')
+    if kwargs.get('usePeak'):
+        for s, prefix in zip(sexes, prefixes):
+            df = df[(df[f'peak_year_{s}'] >= after) & (df[f'peak_year_{s}'] <= before)]
+            final_cols.update({f'peak_year_{s}': f'{prefix}Peak Year', f'peak_rank_{s}': f'{prefix}Peak Rank'})
+    if age_ballpark:
+        for s, prefix in zip(sexes, prefixes):
+            df = df[(df[f'middle_lo_{s}{age_ballpark}'] <= year) & (df[f'middle_hi_{s}{age_ballpark}'] >= year)]
+            final_cols.update({
+                f'middle_lo_{s}{age_ballpark}': f'{prefix}Age Ballpark Lower',
+                f'middle_hi_{s}{age_ballpark}': f'{prefix}Age Ballpark Upper',
+            })
+    if never_top:
+        for s, prefix in zip(sexes, prefixes):
+            df = df[df[f'peak_rank_{s}'] > never_top]
+            final_cols.update({f'peak_year_{s}': f'{prefix}Peak Year', f'peak_rank_{s}': f'{prefix}Peak Rank'})
+    final_cols.update({'gender': 'Gender Category'})
+    if gender_category:
+        remaining = df.gender.str.get_dummies(sep=', ').drop(columns=list(gender_category), errors='ignore')
+        df = df[remaining.sum(axis=1) == 0]
+    if kwargs.get('numLo'):
+        df = df[df.total_usages >= kwargs['numLo']]
+    if kwargs.get('numHi'):
+        df = df[df.total_usages <= kwargs['numHi']]
+    df = df.copy()
+    df['year_peak_gap'] = (
+        (year - df[f'peak_year_{sex}']).abs() if sex else
+        ((year - df.peak_year_f).abs() + (year - df.peak_year_m).abs()) / 2
+    )
+    df = df.sort_values('year_peak_gap').drop_duplicates(subset=['name'], keep='first')
+    df = df.sort_values('total_usages', ascending=False)
+    df.total_usages = df.total_usages.map(lambda x: f'{x:,}')
+    return df[final_cols.keys()].rename(columns=final_cols)
+
+
+def _peak_queries(size: int, seed: int = 0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    categories = ('Masc', 'NeutMasc', 'Neut', 'NeutFem', 'Fem')
+    queries = []
+    for _ in range(size):
+        number_low = int(rng.choice([0, 1000, 10_000, 100_000]))
+        queries.append(dict(
+            year=int(rng.integers(Year.DATA_QUALITY_BEST_AFTER, Year.MAX_YEAR + 1)),
+            yearBand=int(rng.choice([0, 2, 5, 10])),
+            usePeak=bool(rng.random() < .7),
+            ageBallpark=rng.choice([None, 50, 80]),
+            sex=rng.choice([None, 'f', 'm']),
+            genderCat=tuple(i for i in categories if rng.random() < .3),
+            neverTop=rng.choice([None, 10, 100, 1000]),
+            numLo=number_low or None,
+            numHi=int(rng.choice([0, 10 * number_low + 1_000_000])) or None,
+        ))
+    return queries
+
+
+def _peak_payload(query: dict) -> dict:
+    payload = {k: v for k, v in query.items() if k != 'genderCat'}
+    return dict(payload, numResults=100, **{f'genderCat{i}': True for i in query['genderCat']})
+
+
+def benchmark_peak(size: int = 500) -> None:
+    table = load_final()
+    legacy = pd.read_csv(names_by_peak._OUTPUT_FILEPATH)
+    queries = _peak_queries(size)
+    # replayed queries would otherwise mostly measure the result cache
+    names_by_peak._FILTER_CACHE = ResultCache(max_entries=0)
+    mismatches = [i for i in queries if not _legacy_filter_final(legacy, **i).equals(filter_final(table, **i))]
+    print(f'{len(queries)} replayed queries compared against legacy filter: {len(mismatches)} mismatches')
+    print(f'legacy:   filter_final() {_latency_percentiles(lambda i: _legacy_filter_final(legacy, **i), queries)}')
+    print(f'prepared: filter_final() {_latency_percentiles(lambda i: filter_final(table, **i), queries)}')
+
+    dataset = AppDataset(displayer=Displayer())
+    client = create_app(dataset=dataset).test_client()
+    payloads = [_peak_payload(i) for i in queries]
+    dataset.names_by_peak = legacy
+    with mock.patch('app.filter_final', _legacy_filter_final):
+        print(f'legacy:   /peak {_latency_percentiles(lambda i: client.post("/peak", json=i), payloads)}')
+    dataset.names_by_peak = table
+    print(f'prepared: /peak {_latency_percentiles(lambda i: client.post("/peak", json=i), payloads)}')
+    return
+
+
+def _import_times(module: str) -> dict[str, int]:
+    # -X importtime reports, per imported module, the microseconds spent including everything it imported
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'], check=True, capture_output=True, text=True,
+    ).stderr
+    return {match.group(2): int(match.group(1)) for match in re.finditer(
+        r'^import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)$', stderr, re.MULTILINE)}
+
+
+def benchmark_import_time(modules: tuple[str, ...] = ('core', 'name_normalization', 'app')) -> None:
+    for module in modules:
+        timings = _import_times(module)
+        heavy = [i for i in ('seaborn', 'matplotlib', 'flask') if i in timings]
+        print(f'import {module}: {timings[module] / 1000:7.1f}ms; pandas {timings.get("pandas", 0) / 1000:.1f}ms;'
+              f' also imported: {", ".join(heavy) or "none of seaborn/matplotlib/flask"}')
+    max_year = 'import core, time; s = time.perf_counter(); core.Year.MAX_YEAR; print(time.perf_counter() - s)'
+    elapsed = float(subprocess.run([sys.executable, '-c', max_year], check=True, capture_output=True, text=True).stdout)
+    print(f'first Year.MAX_YEAR lookup: {elapsed * 1000:.2f}ms')
+    return
+
+
+def benchmark_build_profile() -> None:
+    displayer = Displayer()
+    displayer.build_base(use_snapshot=False)
+    total = sum(displayer.build_timings.values())
+    for step, elapsed in sorted(displayer.build_timings.items(), key=lambda i: i[1], reverse=True):
+        print(f'{step:>45}: {elapsed:6.2f}s {elapsed / total:6.1%}')
+    print(f'{"total":>45}: {total:6.2f}s')
+    return
+
+
+def _snapshot_files(directory: str) -> dict[str, bytes]:
+    # every file of the snapshot but the manifest, whose source fingerprints include modification times
+    snapshot_dir = os.path.join(directory, Filepath.SNAPSHOT_DIR)
+    files = {}
+    for root, _, filenames in os.walk(snapshot_dir):
+        for filename in filenames:
+            filepath = os.path.join(root, filename)
+            with open(filepath, 'rb') as f:
+                files[os.path.relpath(filepath, snapshot_dir)] = f.read()
+    files.pop(_MANIFEST_FILENAME)
+    return files
+
+
+def benchmark_incremental_build() -> None:
+    # the newest year is held back while the previous release is built, then added back as a new release would be
+    newest = max(i for i in os.listdir(Filepath.NATIONAL_DATA_DIR) if i.lower().endswith('.txt'))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        full, incremental, held_back = (os.path.join(tmp, i) for i in ('full', 'incremental', newest))
+        shutil.copytree(Filepath.DATA_DIR, os.path.join(full, Filepath.DATA_DIR), ignore=shutil.ignore_patterns(
+            'snapshot*'))
+        shutil.move(os.path.join(full, Filepath.NATIONAL_DATA_DIR, newest), held_back)
+        try:
+            os.chdir(full)
+            # the latest year is looked up once and kept, so it's looked up again whenever the year files change, as
+            # refresh_data does after a download
+            Year.MAX_YEAR = None
+            previous_max_year = Year.MAX_YEAR
+            build_all_generated_data()
+            shutil.copytree(full, incremental)
+            for directory in (full, incremental):
+                shutil.copy(held_back, os.path.join(directory, Filepath.NATIONAL_DATA_DIR, newest))
+                os.chdir(directory)
+                Year.MAX_YEAR = None
+                elapsed = _time_per_call(lambda: build_all_generated_data(incremental=directory == incremental), 1)
+                print(f'{os.path.basename(directory):>11} rebuild after adding {newest}'
+                      f' (latest year {previous_max_year} to {Year.MAX_YEAR}): {elapsed:.2f}s')
+        finally:
+            os.chdir(cwd)
+            Year.MAX_YEAR = None
+
+        expected, actual = _snapshot_files(full), _snapshot_files(incremental)
+        mismatches = sorted(i for i in expected.keys() | actual.keys() if expected.get(i) != actual.get(i))
+        for filepath in (
+                Filepath.GENDER_PREDICTION_REFERENCE,
+                Filepath.TOTAL_NUMBER_LIVING_REFERENCE,
+                Filepath.AGE_PREDICTION_REFERENCE,
+        ):
+            with open(os.path.join(full, filepath), 'rb') as f, open(os.path.join(incremental, filepath), 'rb') as g:
+                if f.read() != g.read():
+                    mismatches.append(filepath)
+    print(f'incremental compared byte for byte against full rebuild: {len(mismatches)} mismatches {mismatches}')
+    assert not mismatches, mismatches
+    return
+
+
+class _FixtureRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # just enough of a static server to answer conditional and range requests the way ssa.gov does
+    def do_GET(self) -> None:
+        filepath = self.translate_path(self.path)
+        if not os.path.isfile(filepath):
+            self.send_error(404)
+            return
+        stat = os.stat(filepath)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        self.server.requests += 1
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start = 0
+        if (requested := re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))) and self.headers.get(
+                'If-Range') == etag:
+            start = int(requested.group(1))
+        with open(filepath, 'rb') as f:
+            f.seek(start)
+            body = f.read()
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{stat.st_size - 1}/{stat.st_size}')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        # the first request for a file listed in drop_after is cut off partway, like a dropped connection
+        if (cut := self.server.drop_after.pop(self.path, None)) is not None:
+            body = body[:cut]
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+        return
+
+    def log_message(self, *args) -> None:
+        return
+
+
+def _write_download_fixtures(directory: str) -> None:
+    archives = {
+        SsaUrl.NAME_DATA[0]: Filepath.NATIONAL_DATA_DIR,
+        SsaUrl.NAME_DATA[1]: core_state.StateFilepath.NAME_DATA_DIR,
+        SsaUrl.NAME_DATA[2]: Filepath.TERRITORIES_DATA_DIR,
+    }
+    for url, source_dir in archives.items():
+        os.makedirs(os.path.dirname(os.path.join(directory, url)), exist_ok=True)
+        with zipfile.ZipFile(os.path.join(directory, url), 'w', zipfile.ZIP_DEFLATED) as z:
+            for filename in sorted(os.listdir(source_dir)):
+                z.write(source_dir + filename, filename)
+
+    applicants = pd.read_csv(Filepath.APPLICANTS_DATA).rename(columns=dict(
+        year='Year of birth', number_m='Male', number_f='Female', number='Total'))
+    applicants.to_html(os.path.join(directory, SsaUrl.APPLICANTS), index=False)
+    for s in ('F', 'M'):
+        url = SsaUrl.ACTUARIAL.format(Year.MAX_YEAR + 1, s)
+        os.makedirs(os.path.dirname(os.path.join(directory, url)), exist_ok=True)
+        table = pd.read_csv(Filepath.ACTUARIAL.format(sex=s.lower())).rename(columns=dict(
+            year='Year', age='x', survivors='l(x)'))
+        with open(os.path.join(directory, url), 'w') as f:
+            f.write('\n' * 5 + table.to_string(index=False) + '\n')
+    return
+
+
+def _read_name_file(filepath: str) -> bytes:
+    with open_name_file(filepath) as f:
+        return f.read()
+
+
+def benchmark_download() -> None:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures, work = os.path.join(tmp, 'fixtures'), os.path.join(tmp, 'work')
+        _write_download_fixtures(fixtures)
+        for subdir in (Filepath.APPLICANTS_DATA, Filepath.ACTUARIAL):
+            os.makedirs(os.path.join(work, os.path.dirname(subdir)), exist_ok=True)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(
+            _FixtureRequestHandler, directory=fixtures))
+        server.requests, server.bytes_sent = 0, 0
+        names_zip = SsaUrl.NAME_DATA[0]
+        server.drop_after = {'/' + names_zip: os.path.getsize(os.path.join(fixtures, names_zip)) // 2}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+        try:
+            os.chdir(work)
+            for label in ('interrupted', 'resumed', 'no-change refresh'):
+                server.requests, server.bytes_sent = 0, 0
+                downloader = SsaDataDownloader(Year.MAX_YEAR, base_url)
+                start = perf_counter()
+                try:
+                    downloader.download()
+                except Exception as e:
+                    label = f'{label} ({type(e).__name__})'
+                print(f'{label:>37}: {perf_counter() - start:6.2f}s, {server.requests} requests,'
+                      f' {server.bytes_sent / 2 ** 20:7.2f} MiB sent, {len(downloader.changed)} files replaced')
+            source_dir = os.path.join(cwd, Filepath.NATIONAL_DATA_DIR)
+            mismatches = [i for i in list_name_files(Filepath.NATIONAL_DATA_DIR, Filepath.NATIONAL_DATA_ARCHIVE) if (
+                _read_name_file(i) != _read_name_file(os.path.join(source_dir, os.path.basename(i))))]
+            tables = [Filepath.APPLICANTS_DATA, *(Filepath.ACTUARIAL.format(sex=s) for s in SsaSex.Both)]
+            mismatches += [i for i in tables if not pd.read_csv(i).equals(pd.read_csv(os.path.join(cwd, i)))]
+            print(f'downloaded files compared against the source: {len(mismatches)} mismatches {mismatches}')
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+            server.server_close()
+    return
+
+
+def benchmark_loader(workers: tuple[int, ...] = (1, 2, 4, 8)) -> None:
+    national = [Filepath.NATIONAL_DATA_DIR + i for i in os.listdir(Filepath.NATIONAL_DATA_DIR)]
+    regional = [directory + i for directory in (core_state.StateFilepath.NAME_DATA_DIR, Filepath.TERRITORIES_DATA_DIR)
+                for i in os.listdir(directory)]
+    # noinspection PyProtectedMember
+    datasets = dict(
+        national=(national, _load_name_data_for_one_year),
+        regional=(regional, core_state._load_name_data_for_one_state),
+    )
+    for dataset, (filepaths, read_one) in datasets.items():
+        for processes in (False, True):
+            for n in workers:
+                elapsed = _time_per_call(lambda: load_name_files(filepaths, read_one, n, processes), 1)
+                print(f'{dataset} ({len(filepaths)} files), {n} {"processes" if processes else "threads"}:'
+                      f' {elapsed:.2f}s')
+    return
+
+
+def benchmark_zip_loader(repeat: int = 3) -> None:
+    datasets = dict(
+        national=([(Filepath.NATIONAL_DATA_DIR, 'names.zip')], _load_name_data_for_one_year),
+        regional=([
+            (core_state.StateFilepath.NAME_DATA_DIR, 'namesbystate.zip'),
+            (Filepath.TERRITORIES_DATA_DIR, 'namesbyterritory.zip'),
+        ], core_state._load_name_data_for_one_state),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for dataset, (sources, read_one) in datasets.items():
+            archives = [os.path.join(tmp, archive) for _, archive in sources]
+            for (directory, _), archive in zip(sources, archives):
+                with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as z:
+                    for filepath in list_name_files(directory):
+                        z.write(filepath, os.path.basename(filepath))
+            extracted = [i for directory, _ in sources for i in list_name_files(directory)]
+            members = [i for archive in archives for i in list_name_files(tmp, archive)]
+            timings = {label: min(_time_per_call(lambda: load_name_files(filepaths, read_one), 1) for _ in range(
+                repeat)) for label, filepaths in (('extracted', extracted), ('zip', members))}
+            same = load_name_files(extracted, read_one).equals(load_name_files(members, read_one))
+            size = sum(os.path.getsize(i) for i in archives) / 2 ** 20
+            print(f'{dataset} ({len(members)} files): extracted {timings["extracted"]:.2f}s,'
+                  f' zip {timings["zip"]:.2f}s ({size:.1f} MiB in {len(archives)} archives); same rows: {same}')
+    return
+
+
+def _write_state_fixtures(directory: str, rows: int, seed: int = 0) -> None:
+    # every state and DC, drawn from the state files on disk with perturbed numbers and suffixed names until the
+    # dataset is about as large as the real one
+    rng = np.random.default_rng(seed)
+    source = pd.concat(core_state._load_name_data_for_one_state(i) for i in list_name_files(
+        core_state.StateFilepath.NAME_DATA_DIR)).drop(columns='rank_')
+    states = sorted(sum((core_state.Region.get(i) for i in ('northeast', 'midwest', 'south', 'west')), ()))
+    per_state = rows // len(states)
+    for state in states:
+        df = source.sample(per_state, replace=True, random_state=rng.integers(2 ** 31)).assign(state=state)
+        df['name'] = df.name + pd.Series(rng.choice(list(string.ascii_lowercase), len(df)), index=df.index).where(
+            rng.random(len(df)) < .5, '')
+        df['number'] = np.maximum(5, df.number.to_numpy() + rng.integers(-3, 4, len(df)))
+        df = df.groupby(['state', 'sex', 'year', 'name'], as_index=False).number.sum()
+        df.to_csv(os.path.join(directory, f'{state}.TXT'), header=False, index=False)
+    return
+
+
+def _build_state_displayer(rows: int) -> core_state.StateDisplayer:
+    with tempfile.TemporaryDirectory() as directory:
+        _write_state_fixtures(directory, rows)
+        with mock.patch.multiple(core_state.StateFilepath, NAME_DATA_DIR=directory + '/', NAME_DATA_ARCHIVE=''):
+            displayer = core_state.StateDisplayer()
+            start = perf_counter()
+            displayer.build_base()
+            timings = ', '.join(f'{step} {seconds:.1f}s' for step, seconds in displayer.build_timings.items())
+            print(f'build: {perf_counter() - start:.1f}s ({timings})')
+    displayer.result_cache = ResultCache(max_entries=0)
+    return displayer
+
+
+def benchmark_state(rows: int = 6_000_000, size: int = 200) -> None:
+    displayer = _build_state_displayer(rows)
+    # noinspection PyProtectedMember
+    raw, counts = displayer._raw, displayer._counts
+    legacy = raw.astype(dict(state=object, name=object, sex=object))
+    print(f'{len(raw):,} rows: frame {legacy.memory_usage(deep=True).sum() / 2 ** 20:.0f} MiB as objects,'
+          f' {raw.memory_usage(deep=True).sum() / 2 ** 20:.0f} MiB as categories;'
+          f' cube {counts.rows:,} (state, year, name) rows in {counts.nbytes / 2 ** 20:.0f} MiB')
+
+    # ranks used to be taken over every year of a state at once
+    legacy_ranks = raw.groupby(['state', 'sex'], observed=True).number.rank(method='min', ascending=False)
+    expected_ranks = raw.groupby(['state', 'year', 'sex'], observed=True).number.rank(method='min', ascending=False)
+    print(f'ranks: {(legacy_ranks != expected_ranks).mean():.1%} of rows were ranked differently before,'
+          f' {(raw.rank_ != expected_ranks).sum()} mismatches now')
+
+    start = perf_counter()
+    displayer.search(region='south')
+    print(f'first use of a region (merged once): {(perf_counter() - start) * 1000:.0f}ms')
+
+    rng = np.random.default_rng(0)
+    names = raw.name.drop_duplicates().sample(size, random_state=0).astype(str).tolist()
+    states = rng.choice(counts.states, size).tolist()
+    bad = 0
+    for name, state in zip(names, states):
+        expected = raw[(raw.name == name) & (raw.state == state)].groupby('year', observed=True).number.sum()
+        actual = counts.name_frame(name, counts.states.get_loc(state)).set_index('year').number
+        bad += not expected.astype(np.int64).equals(actual.astype(np.int64).rename_axis('year'))
+    south = raw[raw.state.isin(core_state.Region.South)]
+    expected = south[south.year >= 1990].groupby('name', observed=True).number.sum()
+    actual = displayer.search(region='south', after=1990, top=None).set_index('name').number
+    bad += not expected[expected > 0].astype(np.int64).sort_index().equals(actual.sort_index())
+    region_year = south[south.year == 2000].groupby('name', observed=True).number.sum()
+    ranks = displayer.search(region='south', year=2000, top=None).set_index('name').rank_
+    bad += not region_year.rank(method='min', ascending=False).astype(int).sort_index().equals(
+        ranks.astype(int).sort_index())
+    print(f'checked {size} name/state pairs and region totals and ranks against groupby: {bad} mismatches')
+
+    name_state = lambda i: displayer.name(names[i], state=states[i])
+    print(f'name(state=): {_latency_percentiles(name_state, range(size))}')
+    print(f'name(region=): {_latency_percentiles(lambda i: displayer.name(i, region="south"), names)}')
+    search_state = lambda i: displayer.search(start=(i[0].lower(),), state='CA')
+    print(f'search(state=): {_latency_percentiles(search_state, names)}')
+    search_region = lambda _: displayer.search(region='south', after=1990)
+    print(f'search(region=, after=): {_latency_percentiles(search_region, names[:20])}')
+    groupby = lambda _: south[south.year >= 1990].groupby('name', observed=True).number.sum().nlargest(20)
+    print(f'groupby equivalent of the region search: {_latency_percentiles(groupby, names[:20])}')
+    return
+
+
+def benchmark_state_distribution(rows: int = 6_000_000, size: int = 100) -> None:
+    displayer = _build_state_displayer(rows)
+    # noinspection PyProtectedMember
+    raw = displayer._raw
+    national = raw[~raw.state.isin(displayer.territories)]
+    names = raw.name.drop_duplicates().sample(size, random_state=0).astype(str).tolist()
+    windows = [dict(), dict(after=1990), dict(year=2000), dict(after=1950, before=1980)]
+    in_window = lambda df, w: df[(df.year == w['year']) if 'year' in w else (df.year >= w.get('after', 0)) & (
+            df.year <= w.get('before', 9999))]
+
+    def distribution_by_groupby(name: str, window: dict) -> pd.DataFrame:
+        df = in_window(raw, window)
+        numbers = df[df.name == name].groupby('state', observed=True).number.sum()
+        births = df.groupby('state', observed=True).number.sum()
+        return (numbers[numbers > 0] / births).dropna().sort_values(ascending=False)
+
+    def over_represented_by_groupby(state: str, window: dict) -> pd.DataFrame:
+        local = in_window(raw[raw.state == state], window).groupby('name', observed=True).number.sum()
+        country = in_window(national, window).groupby('name', observed=True).number.sum()
+        ratio = (local / local.sum()) / (country / country.sum())
+        ratio = ratio[(local.reindex(ratio.index) >= 100) & ~ratio.index.isin(UnknownName.get())]
+        return ratio.dropna().sort_values(ascending=False).head(20)
+
+    bad = 0
+    for i, name in enumerate(names[:20]):
+        window = windows[i % len(windows)]
+        expected = distribution_by_groupby(name, window)
+        actual = displayer.distribution(name, **window).set_index('state').share
+        bad += not np.allclose(expected.sort_index().to_numpy(), actual.sort_index().to_numpy())
+    states = list(displayer.counts.states[:4])
+    for state, window in zip(states, windows):
+        expected = over_represented_by_groupby(state, window)
+        actual = displayer.over_represented(state, **window, top=None).set_index('name').ratio
+        bad += not np.allclose(expected.to_numpy(), actual.reindex(expected.index).to_numpy())
+    print(f'checked 20 distributions and {len(states)} over-representation rankings against groupby: {bad} mismatches')
+
+    window = lambda i: windows[i % len(windows)]
+    queries = dict(
+        distribution=lambda i: displayer.distribution(names[i], **window(i)),
+        distribution_by_groupby=lambda i: distribution_by_groupby(names[i], window(i)),
+        over_represented_state=lambda i: displayer.over_represented(states[i % len(states)], **window(i)),
+        over_represented_region=lambda i: displayer.over_represented(region='south', **window(i)),
+        over_represented_by_groupby=lambda i: over_represented_by_groupby(states[i % len(states)], window(i)),
+    )
+    for label, func in queries.items():
+        print(f'{label}: {_latency_percentiles(func, range(20 if label.endswith("groupby") else size))}')
+    return
+
+
+def _to_legacy_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    legacy = {}
+    for col, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            legacy[col] = object
+        elif pd.api.types.is_integer_dtype(dtype):
+            legacy[col] = np.int64
+    return df.astype(legacy)
+
+
+def benchmark_dtypes(size: int = 50) -> None:
+    displayer = _build_displayer()
+    legacy = Displayer()
+    for attr in Displayer._SNAPSHOT_FRAMES:
+        df = getattr(displayer, attr)
+        setattr(legacy, attr, _to_legacy_dtypes(df))
+        before = getattr(legacy, attr).memory_usage(deep=True).sum()
+        after = df.memory_usage(deep=True).sum()
+        print(f'{attr:>20}: {before / 2 ** 20:8.1f} MiB -> {after / 2 ** 20:8.1f} MiB ({after / before:.0%})')
+    # noinspection PyProtectedMember
+    legacy._build_indexes()
+
+    # noinspection PyProtectedMember
+    age_keys = displayer._age_reference[['name', 'sex']].drop_duplicates().head(size).to_numpy().tolist()
+    mismatches = [name for name in _sample_names(displayer, size) if (
+            displayer.name(name) != legacy.name(name) or
+            displayer.predict_gender(name) != legacy.predict_gender(name))]
+    mismatches += [name for name, sex in age_keys if not displayer.predict_age(name, sex).equals(
+        legacy.predict_age(name, sex))]
+    for kwargs in _SEARCHES:
+        if not displayer.search(**kwargs).astype(legacy.search(**kwargs).dtypes).equals(legacy.search(**kwargs)):
+            mismatches.append(kwargs)
+    print(f'outputs compared against legacy dtypes: {len(mismatches)} mismatches {mismatches[:5]}')
+    return
+
+
+_BENCHMARKS = dict(
+    cold_start=benchmark_cold_start,
+    name_lookup=benchmark_name_lookup,
+    count_matrix=benchmark_count_matrix,
+    search=benchmark_search,
+    ngram_search=benchmark_ngram_search,
+    result_cache=benchmark_result_cache,
+    predict_gender_load=benchmark_predict_gender_load,
+    predict_gender_living=benchmark_predict_gender_living,
+    predict_age_batch=benchmark_predict_age_batch,
+    fuzzy_match=benchmark_fuzzy_match,
+    standardize_name=benchmark_standardize_name,
+    predict_stream=benchmark_predict_stream,
+    workers=benchmark_workers,
+    app_startup=benchmark_app_startup,
+    peak=benchmark_peak,
+    build_profile=benchmark_build_profile,
+    import_time=benchmark_import_time,
+    incremental_build=benchmark_incremental_build,
+    download=benchmark_download,
+    loader=benchmark_loader,
+    zip_loader=benchmark_zip_loader,
+    state=benchmark_state,
+    state_distribution=benchmark_state_distribution,
+    dtypes=benchmark_dtypes,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', choices=list(_BENCHMARKS), default=list(_BENCHMARKS))
+    args = parser.parse_args()
+    for benchmark in args.benchmarks:
+        print(f'== {benchmark}')
+        _BENCHMARKS[benchmark]()
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,63 @@
+import io
 import os
 import re
-import string
 from enum import Enum
+from time import perf_counter
+from typing import Callable, TypeVar
 
+import numpy as np
 import pandas as pd
-import seaborn as sns
 
 from demos import SsaSex
+from age_percentiles import AgePercentiles
+from name_filter import TextFilter, NgramIndex
+from name_matching import FuzzyNameIndex
+from name_loader import (
+    list_name_files, open_name_file, split_archive_path, fingerprint_archive_members, load_name_files)
+from name_normalization import standardize_name
+from result_cache import ResultCache, cached_result
+from snapshot import (
+    fingerprint_files, fingerprints_match, changed_fingerprints, read_manifest, save_frames, load_frames, load_arrays)
+
+_T = TypeVar('_T')
 
 
 class Filepath:
     DATA_DIR: str = 'data/'
     NATIONAL_DATA_DIR: str = 'data/names/'
+    NATIONAL_DATA_ARCHIVE: str = 'data/names.zip'
     TERRITORIES_DATA_DIR: str = 'data/namesbyterritory/'
+    TERRITORIES_DATA_ARCHIVE: str = 'data/namesbyterritory.zip'
     ACTUARIAL: str = 'data/actuarial/{sex}.csv'
     APPLICANTS_DATA: str = 'data/applicants/data.csv'
     AGE_PREDICTION_REFERENCE: str = 'data/generated/age_prediction_reference.csv'
     GENDER_PREDICTION_REFERENCE: str = 'data/generated/gender_prediction_reference.csv'
     TOTAL_NUMBER_LIVING_REFERENCE: str = 'data/generated/raw_with_actuarial.total_number_living.csv'
+    SNAPSHOT_DIR: str = 'data/snapshot/'
 
 
 class Pattern:
     YEAR: str = '^yob([0-9]{4}).txt$'
 
 
-class Year:
+class _YearMeta(type):
+    @property
+    def MAX_YEAR(cls) -> int:
+        # looked up on first use rather than on import; assigning None makes the next use look again
+        if cls._max_year is None:
+            cls._max_year = _find_max_year()
+        return cls._max_year
+
+    @MAX_YEAR.setter
+    def MAX_YEAR(cls, value: int | None) -> None:
+        cls._max_year = value
+        return
+
+
+class Year(metaclass=_YearMeta):
     MIN_YEAR: int = 1880
-    MAX_YEAR: int = int(re.search(Pattern.YEAR, os.listdir(Filepath.NATIONAL_DATA_DIR)[-1]).group(1))
     DATA_QUALITY_BEST_AFTER: int = 1937
+    _max_year: int | None = None
 
     @classmethod
     def get_default_years_as_dict(cls) -> dict[str, int]:
@@ -52,8 +82,165 @@ class DFAgg:
     NUMBER_SUM = dict(number='sum', number_f='sum', number_m='sum')
 
 
+class Dtype:
+    SEX: pd.CategoricalDtype = pd.CategoricalDtype([SsaSex.All, *SsaSex.Both])
+    YEAR: type = np.int16
+    NUMBER: type = np.int32
+    RANK: type = np.int32
+
+
+def _name_codes(names: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        return names.cat.codes.to_numpy(), names.cat.categories
+    codes, uniques = pd.factorize(names, sort=True)
+    return codes, pd.Index(uniques)
+
+
+class _NameIndex:
+    def __init__(self, df: pd.DataFrame) -> None:
+        self._df = df
+        # row positions grouped by name in two flat arrays, rather than one small array per name
+        codes, self._names = _name_codes(df.name)
+        self._order = np.argsort(codes, kind='stable').astype(np.int32)
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(self._names)))))
+
+    def get(self, name: str) -> pd.DataFrame:
+        if name not in self._names:
+            return self._df.iloc[:0]
+        code = self._names.get_loc(name)
+        return self._df.iloc[self._order[self._offsets[code]:self._offsets[code + 1]]]
+
+
+def _year_bounds(
+        first_year: int,
+        last_year: int,
+        year: int = None,
+        after: int = None,
+        before: int = None,
+) -> tuple[int, int]:
+    # positions along a year axis that starts at first_year, as a half-open range
+    if year:
+        after = before = year
+    lo = min(max(after or first_year, first_year), last_year + 1) - first_year
+    hi = max(min(before or last_year, last_year), first_year - 1) - first_year + 1
+    return lo, max(lo, hi)
+
+
+class NameYearCounts:
+    def __init__(self, names: pd.Index, first_year: int, cumulative: np.ndarray) -> None:
+        self.names: pd.Index = pd.Index(names)
+        self.first_year: int = first_year
+        self.last_year: int = first_year + cumulative.shape[1] - 2
+        # cumulative counts along the year axis, with a leading zero column: (names, years + 1, [f, m])
+        self._cumulative = cumulative
+
+    @classmethod
+    def from_raw(cls, raw: pd.DataFrame) -> 'NameYearCounts':
+        name_codes, names = _name_codes(raw.name)
+        first_year, last_year = int(raw.year.min()), int(raw.year.max())
+        cumulative = np.zeros((len(names), last_year - first_year + 2, len(SsaSex.Both)), dtype=np.int32)
+        sex_codes = (raw.sex == SsaSex.Male).to_numpy().astype(np.intp)
+        np.add.at(cumulative, (name_codes, raw.year.to_numpy() - first_year + 1, sex_codes), raw.number)
+        np.cumsum(cumulative, axis=1, out=cumulative)
+        return cls(names, first_year, cumulative)
+
+    @property
+    def cumulative(self) -> np.ndarray:
+        return self._cumulative
+
+    @property
+    def nbytes(self) -> int:
+        return self._cumulative.nbytes
+
+    def window(self, year: int = None, after: int = None, before: int = None) -> np.ndarray:
+        lo, hi = _year_bounds(self.first_year, self.last_year, year, after, before)
+        return self._cumulative[:, hi] - self._cumulative[:, lo]
+
+    def get(self, name: str, year: int = None, after: int = None, before: int = None) -> tuple[int, int]:
+        if name not in self.names:
+            return 0, 0
+        lo, hi = _year_bounds(self.first_year, self.last_year, year, after, before)
+        cumulative = self._cumulative[self.names.get_loc(name)]
+        number_f, number_m = (cumulative[hi] - cumulative[lo]).tolist()
+        return number_f, number_m
+
+    def frame(
+            self,
+            year: int = None,
+            after: int = None,
+            before: int = None,
+            positions: np.ndarray = None,
+    ) -> pd.DataFrame:
+        numbers = self.window(year, after, before).astype(np.int64)
+        names = self.names
+        if positions is not None:
+            numbers, names = numbers[positions], names[positions]
+        df = pd.DataFrame(dict(
+            name=names,
+            number=numbers.sum(axis=1),
+            number_f=numbers[:, 0],
+            number_m=numbers[:, 1],
+        ))
+        return df[df.number > 0].reset_index(drop=True)
+
+
+class ActuarialCounts:
+    def __init__(self, raw_with_actuarial: pd.DataFrame) -> None:
+        df = raw_with_actuarial
+        name_codes, self.names = _name_codes(df.name)
+        runs = name_codes.astype(np.int64) * len(SsaSex.Both) + (df.sex == SsaSex.Male).to_numpy()
+        years = df.year.to_numpy().astype(np.int64)
+
+        # each (name, sex) gets a cumulative run over every year from its first to its last, with a leading zero, so
+        # any window is two lookups: (runs, [first year, offset into the flat arrays])
+        run_count = len(self.names) * len(SsaSex.Both)
+        self._first_years = np.full(run_count, 0, dtype=np.int64)
+        last_years = np.full(run_count, -1, dtype=np.int64)
+        present = np.unique(runs)
+        self._first_years[present] = pd.Series(years).groupby(runs).min().to_numpy()
+        last_years[present] = pd.Series(years).groupby(runs).max().to_numpy()
+        self._spans = last_years - self._first_years + 1
+        self._offsets = np.concatenate(([0], np.cumsum(self._spans + 1)))
+        positions = self._offsets[runs] + 1 + years - self._first_years[runs]
+        self._number = np.zeros(self._offsets[-1], dtype=np.int64)
+        self._living = np.zeros(self._offsets[-1], dtype=np.float64)
+        np.add.at(self._number, positions, df.number.to_numpy())
+        np.add.at(self._living, positions, df.number_living.to_numpy())
+        np.cumsum(self._number, out=self._number)
+        np.cumsum(self._living, out=self._living)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(i.nbytes for i in (self._first_years, self._spans, self._offsets, self._number, self._living))
+
+    def window(
+            self,
+            names: np.ndarray | pd.Series | list,
+            year: int = None,
+            after: int = None,
+            before: int = None,
+            living: bool = False,
+    ) -> np.ndarray:
+        # births, or those births still living, for each name in the window: (names, [f, m])
+        if year:
+            after = before = year
+        name_codes = self.names.get_indexer(names)
+        runs = np.maximum(name_codes, 0)[:, None] * len(SsaSex.Both) + np.arange(len(SsaSex.Both))
+        first_years, spans, offsets = self._first_years[runs], self._spans[runs], self._offsets[runs]
+        lo = np.clip(after - first_years, 0, spans) if after else 0
+        hi = np.clip(before - first_years + 1, 0, spans) if before else spans
+        cumulative = self._living if living else self._number
+        numbers = cumulative[offsets + np.maximum(lo, hi)] - cumulative[offsets + lo]
+        numbers[name_codes < 0] = 0
+        return numbers
+
+
 class Builder:
-    def __init__(self) -> None:
+    _SNAPSHOT_FRAMES: tuple[str, ...] = (
+        '_raw', '_applicants_data', '_name_by_year', '_peaks', '_calcd', 'raw_with_actuarial', '_age_reference')
+
+    def __init__(self, workers: int = None) -> None:
+        self.workers = workers
         self._raw: pd.DataFrame
         self._age_reference: pd.DataFrame
         self._applicants_data: pd.DataFrame
@@ -61,81 +248,262 @@ class Builder:
         self._peaks: pd.DataFrame
         self._calcd: pd.DataFrame
         self.raw_with_actuarial: pd.DataFrame
+        self._calcd_by_name: _NameIndex
+        self._peaks_by_name: _NameIndex
+        self._counts: NameYearCounts
+        self._name_ngrams: NgramIndex
+        self._age_percentiles: dict[int | None, AgePercentiles] = {}
+        self._actuarial_counts: ActuarialCounts | None = None
+        self._fuzzy_names: FuzzyNameIndex | None = None
+        self.build_timings: dict[str, float] = {}
+        self.mmap = False
+        self.result_cache = ResultCache()
+        # reference tables are only ever read, so they're shared rather than copied per request
+        self.reference_cache = ResultCache(max_entries=8, max_bytes=512 * 2 ** 20, copy_results=False)
+
+    def build_base(self, use_snapshot: bool = True, mmap: bool = False) -> None:
+        self._reset(mmap)
+        if not use_snapshot or not self._timed(self._load_snapshot):
+            self._build_frames()
+            if use_snapshot:
+                self._timed(self._save_snapshot)
+                # the freshly built copies are private to this process; the mapped ones are shared
+                if mmap:
+                    self._timed(self._load_snapshot)
+        self._build_indexes()
+        return
+
+    def update_base(self) -> pd.Index | None:
+        # re-reads only the sources that changed since the snapshot was saved and returns the names whose rows
+        # changed, or None when everything may have
+        self._reset(mmap=False)
+        manifest = read_manifest(Filepath.SNAPSHOT_DIR)
+        if not manifest:
+            self.build_base()
+            return None
+        sources = _fingerprint_sources(manifest['sources'])
+        changed = changed_fingerprints(manifest['sources'], sources)
+        for frame_name, df in load_frames(Filepath.SNAPSHOT_DIR, manifest).items():
+            setattr(self, frame_name, df)
+
+        years = {int(match.group(1)) for filepath in changed if (
+                match := re.search(Pattern.YEAR, os.path.basename(filepath)))}
+        calcd_years = set(years)
+        if Filepath.APPLICANTS_DATA in changed:
+            previous = self._applicants_data
+            self._load_applicants_data()
+            merged = previous.merge(self._applicants_data, on='year', how='outer', indicator=True)
+            calcd_years.update(merged[(merged._merge != 'both') | (merged.number_x != merged.number_y) | (
+                    merged.number_f_x != merged.number_f_y) | (merged.number_m_x != merged.number_m_y)].year)
+        if Filepath.AGE_PREDICTION_REFERENCE in changed:
+            self._load_predict_age_reference()
+
+        is_changed = self._raw.year.isin(years).to_numpy()
+        added_filepaths = [i for i in sources if i in changed and re.search(Pattern.YEAR, os.path.basename(i))]
+        added = self._read_name_files(added_filepaths) if added_filepaths else self._raw.iloc[:0]
+        names = pd.Index(self._raw.name[is_changed].unique().astype(str)).union(added.name.unique())
+        self._update_name_categories(self._raw[~is_changed], added)
+
+        kept_by_year = self._name_by_year[~self._name_by_year.year.isin(years)]
+        self._name_by_year = pd.concat((kept_by_year, _sum_by_name_and_year(self._raw[self._raw.year.isin(years)])))
+        self._name_by_year = self._name_by_year.sort_values(['name', 'year']).reset_index(drop=True)
+
+        # a name's peak rank can only move if it had rows in one of the changed years
+        is_affected = self._peaks.name.isin(names)
+        self._peaks = pd.concat((self._peaks[~is_affected], _find_peaks(
+            self._raw[self._raw.name.isin(names)], self._name_by_year[self._name_by_year.name.isin(names)])))
+        self._peaks = self._peaks.sort_values(['year', 'name', 'sex']).reset_index(drop=True)
+
+        kept_calcd = self._calcd[~self._calcd.year.isin(calcd_years)]
+        self._calcd = pd.concat((kept_calcd, _calculate_ratios_and_number_pct(
+            self._raw[self._raw.year.isin(calcd_years)],
+            self._name_by_year[self._name_by_year.year.isin(calcd_years)],
+            self._applicants_data,
+        ))).sort_values(['year', 'name']).reset_index(drop=True)
+
+        actuarial_changed = manifest['max_year'] != Year.MAX_YEAR or any(
+            Filepath.ACTUARIAL.format(sex=s) in changed for s in SsaSex.Both)
+        if actuarial_changed:
+            self._build_raw_with_actuarial()
+        else:
+            kept_living = self.raw_with_actuarial[~self.raw_with_actuarial.year.isin(years)]
+            self.raw_with_actuarial = pd.concat((kept_living, _merge_actuarial(self._raw[self._raw.year.isin(
+                years)]))).sort_values('year', kind='stable').reset_index(drop=True)
+
+        self._build_counts()
+        self._save_snapshot()
+        self._build_indexes()
+        return None if actuarial_changed else names
+
+    def _reset(self, mmap: bool) -> None:
+        self.build_timings = {}
+        self.result_cache.clear()
+        self.reference_cache.clear()
+        self._age_percentiles = {}
+        self._actuarial_counts = None
+        self._fuzzy_names = None
+        self.mmap = mmap
+        return
 
-    def build_base(self) -> None:
-        self._load_name_data()
-        self._load_applicants_data()
-        self._build_name_by_year()
-        self._build_peaks()
-        self._build_calcd_with_ratios_and_number_pct()
-        self._build_raw_with_actuarial()
+    def reload_predict_age_reference(self) -> None:
+        # the reference is generated from the other frames, so the snapshot saved with them is stale once it's rewritten
         self._load_predict_age_reference()
+        self._age_reference.name = self._age_reference.name.astype(self._raw.name.dtype)
+        self._age_percentiles = {}
+        self._save_snapshot()
+        return
+
+    def _update_name_categories(self, kept: pd.DataFrame, added: pd.DataFrame) -> None:
+        # the same categories a full build would end up with, applied to every frame that has names
+        name_dtype = pd.CategoricalDtype(pd.Index(kept.name.unique().astype(str)).union(
+            added.name.unique()).union(self._age_reference.name.unique().astype(str)))
+        self._raw = pd.concat((kept, added.astype(dict(name=name_dtype)))).sort_values(
+            'year', kind='stable').reset_index(drop=True)
+        for frame_name in self._SNAPSHOT_FRAMES:
+            df = getattr(self, frame_name)
+            if 'name' in df.columns and df.name.dtype != name_dtype:
+                setattr(self, frame_name, df.astype(dict(name=name_dtype)))
+        return
+
+    def _timed(self, step: Callable[[], _T]) -> _T:
+        start = perf_counter()
+        result = step()
+        self.build_timings[step.__name__] = perf_counter() - start
+        return result
+
+    def _build_frames(self) -> None:
+        for step in (
+                self._load_name_data,
+                self._load_predict_age_reference,
+                self._share_name_categories,
+                self._load_applicants_data,
+                self._build_name_by_year,
+                self._build_peaks,
+                self._build_calcd_with_ratios_and_number_pct,
+                self._build_raw_with_actuarial,
+                self._build_counts,
+        ):
+            self._timed(step)
+        return
+
+    def _build_indexes(self) -> None:
+        for step in (self._build_name_ngrams, self._build_name_indexes):
+            self._timed(step)
+        return
+
+    def _build_counts(self) -> None:
+        self._counts = NameYearCounts.from_raw(self._raw)
+        return
+
+    def _build_name_ngrams(self) -> None:
+        self._name_ngrams = NgramIndex(self._counts.names)
+        return
+
+    def _build_name_indexes(self) -> None:
+        self._calcd_by_name = _NameIndex(self._calcd)
+        self._peaks_by_name = _NameIndex(self._peaks)
+        return
+
+    def _load_snapshot(self) -> bool:
+        manifest = read_manifest(Filepath.SNAPSHOT_DIR)
+        if not manifest or manifest['max_year'] != Year.MAX_YEAR:
+            return False
+        if not fingerprints_match(manifest['sources'], _fingerprint_sources(manifest['sources'])):
+            return False
+        for frame_name, df in load_frames(Filepath.SNAPSHOT_DIR, manifest, self.mmap).items():
+            setattr(self, frame_name, df)
+        arrays = load_arrays(Filepath.SNAPSHOT_DIR, manifest, self.mmap)
+        names = pd.Index(arrays['count_names'], dtype=object)
+        self._counts = NameYearCounts(names, manifest['counts_first_year'], arrays['counts'])
+        return True
+
+    def _save_snapshot(self) -> None:
+        frames = {frame_name: getattr(self, frame_name) for frame_name in self._SNAPSHOT_FRAMES}
+        arrays = dict(counts=self._counts.cumulative, count_names=np.asarray(self._counts.names, dtype=str))
+        manifest = dict(
+            max_year=Year.MAX_YEAR, sources=_fingerprint_sources(), counts_first_year=self._counts.first_year)
+        save_frames(Filepath.SNAPSHOT_DIR, frames, manifest, arrays)
         return
 
     def _load_name_data(self) -> None:
-        self._raw = pd.concat([
-            _load_name_data_for_one_year(filename) for filename in os.listdir(Filepath.NATIONAL_DATA_DIR)
-            if filename.lower().endswith('.txt')
-        ])
-        self._raw.sex = self._raw.sex.str.lower()
-        self._raw.rank_ = self._raw.rank_.map(int)
+        self._raw = self._read_name_files(list_name_files(Filepath.NATIONAL_DATA_DIR, Filepath.NATIONAL_DATA_ARCHIVE))
         return
 
+    def _read_name_files(self, filepaths: list[str]) -> pd.DataFrame:
+        df = load_name_files(filepaths, _load_name_data_for_one_year, self.workers)
+        sex = df.sex.astype('category')
+        df.sex = sex.cat.rename_categories(sex.cat.categories.str.lower()).astype(Dtype.SEX)
+        return df
+
     def _load_predict_age_reference(self) -> None:
-        dtype = dict(name=str, sex=str, year=int, number_living_pct=float)
+        dtype = dict(name=str, sex=Dtype.SEX, year=Dtype.YEAR, number_living_pct=float)
         self._age_reference = pd.read_csv(Filepath.AGE_PREDICTION_REFERENCE, usecols=list(dtype.keys()), dtype=dtype)
         return
 
+    def _share_name_categories(self) -> None:
+        # one category dictionary for every frame, so merges and groupbys on name work on integer codes
+        name_dtype = pd.CategoricalDtype(pd.Index(self._raw.name.unique()).union(self._age_reference.name.unique()))
+        self._raw.name = self._raw.name.astype(name_dtype)
+        self._age_reference.name = self._age_reference.name.astype(name_dtype)
+        return
+
     def _load_applicants_data(self) -> None:
-        self._applicants_data = pd.read_csv(Filepath.APPLICANTS_DATA, dtype=int)
+        self._applicants_data = pd.read_csv(Filepath.APPLICANTS_DATA, dtype=int).astype(dict(year=Dtype.YEAR))
         return
 
     def _build_name_by_year(self) -> None:
-        self._name_by_year = self._raw.groupby(['name', 'year'], as_index=False).number.sum()
-        self._name_by_year['rank_'] = self._name_by_year.groupby('year').number.rank(method='min', ascending=False)
+        self._name_by_year = _sum_by_name_and_year(self._raw)
         return
 
     def _build_peaks(self) -> None:
-        peaks_base = pd.concat((self._raw, self._name_by_year.assign(sex=SsaSex.All)))
-        peaks_base = peaks_base[peaks_base.year >= Year.DATA_QUALITY_BEST_AFTER]
-        self._peaks = peaks_base.groupby(['name', 'sex'], as_index=False).agg(dict(rank_='min')).merge(
-            peaks_base, on=['name', 'sex', 'rank_'], how='left').sort_values('year')
-        self._peaks.rank_ = self._peaks.rank_.map(int)
+        self._peaks = _find_peaks(self._raw, self._name_by_year)
         return
 
     def _build_calcd_with_ratios_and_number_pct(self) -> None:
-        separate_by_sex = lambda x: self._raw[self._raw.sex == x].drop(columns='sex').rename(columns=dict(rank_='rank'))
-        merge_on = ['name', 'year']
-        self._calcd = (
-            separate_by_sex(SsaSex.Female)
-            .merge(separate_by_sex(SsaSex.Male), on=merge_on, suffixes=SsaSex.Suffix, how='outer')
-            .merge(self._name_by_year, on=merge_on).sort_values('year')
-        )
-        for s in SsaSex.Both:
-            self._calcd[f'number_{s}'] = self._calcd[f'number_{s}'].fillna(0).map(int)
-            self._calcd[f'rank_{s}'] = self._calcd[f'rank_{s}'].fillna(-1).map(int)
-        self._calcd.rank_ = self._calcd.rank_.map(int)
-
-        self._calcd = self._calcd.merge(self._applicants_data, on='year', suffixes=('', '_total'))
-        for s in SsaSex.Both:
-            self._calcd[f'number_pct_{s}'] = self._calcd[f'number_{s}'] / self._calcd[f'number_{s}_total']
-        self._calcd['number_pct'] = self._calcd.number / self._calcd.number_total
-        self._calcd = self._calcd.drop(columns=['number_f_total', 'number_m_total', 'number_total'])
+        self._calcd = _calculate_ratios_and_number_pct(self._raw, self._name_by_year, self._applicants_data)
         return
 
     def _build_raw_with_actuarial(self) -> None:
-        # loses years before 1900
-        self.raw_with_actuarial = self._raw.merge(_load_actuarial_data(), on=['sex', 'year'])
-        self.raw_with_actuarial[
-            'number_living'] = self.raw_with_actuarial.number * self.raw_with_actuarial.survival_prob
+        self.raw_with_actuarial = _merge_actuarial(self._raw)
         return
 
     @property
     def calculated(self) -> pd.DataFrame:
         return self._calcd
 
+    @property
+    def counts(self) -> NameYearCounts:
+        return self._counts
+
+    def age_percentiles(self, after: int = None) -> AgePercentiles:
+        # built on first use, since most processes only ever ask for one window
+        if after not in self._age_percentiles:
+            self._age_percentiles[after] = AgePercentiles(self._age_reference, after)
+        return self._age_percentiles[after]
+
+    def actuarial_counts(self) -> ActuarialCounts:
+        # built on first use too; only gender predictions need it
+        if self._actuarial_counts is None:
+            self._actuarial_counts = ActuarialCounts(self.raw_with_actuarial)
+        return self._actuarial_counts
+
+    def fuzzy_names(self) -> FuzzyNameIndex:
+        # also built on first use, for predictions that ask to match names that aren't known exactly
+        if self._fuzzy_names is None:
+            self._fuzzy_names = FuzzyNameIndex(self._counts.names, self._counts.window().sum(axis=1))
+        return self._fuzzy_names
+
+
+def _displayer_cache(params: dict) -> ResultCache:
+    return params['self'].result_cache
+
+
+def _standardize_name_param(params: dict) -> dict:
+    return dict(params, name=standardize_name(params['name']))
+
 
 class Displayer(Builder):
+    @cached_result(_displayer_cache, _standardize_name_param, uncached_if=('display',))
     def name(
             self,
             name: str,
@@ -144,16 +512,15 @@ class Displayer(Builder):
             year: int = None,
             display: bool | str = None,
     ) -> dict:
-        df = self._calcd.copy()
-
         # filter on name
-        name = _standardize_name(name)
-        df = df[df.name == name]
+        name = standardize_name(name)
+        df = self._calcd_by_name.get(name)
         if not len(df):
             return {}
 
         # build metadata
-        selected_year = {'selected_year': _restructure_earliest_or_latest(df[df.year == year].iloc[0])} if year else {}
+        selected_year = {
+            'selected_year': _restructure_earliest_or_latest(df[df.year == year].to_dict('records')[0])} if year else {}
         earliest, latest = df.iloc[[0, -1]].to_dict('records')
 
         # filter on years
@@ -165,23 +532,21 @@ class Displayer(Builder):
             _make_plot_for_name(df, name, display)
 
         # aggregate
-        grouped = df.groupby('name', as_index=False).agg(DFAgg.NUMBER_SUM)
-        for s in SsaSex.Both:
-            grouped[f'ratio_{s}'] = (grouped[f'number_{s}'] / grouped.number).round(3)
+        number_f, number_m = self._counts.get(name, year, after, before)
+        number = number_f + number_m
 
         # build output
-        grouped = grouped.iloc[0].to_dict()
         output = {
-            'name': grouped['name'],
+            'name': name,
             **dict(after=after, before=before, year=year),
             'numbers': {
-                SsaSex.Total: grouped['number'],
-                SsaSex.Female: grouped['number_f'],
-                SsaSex.Male: grouped['number_m'],
+                SsaSex.Total: number,
+                SsaSex.Female: number_f,
+                SsaSex.Male: number_m,
             },
             'ratios': {
-                SsaSex.Female: grouped['ratio_f'],
-                SsaSex.Male: grouped['ratio_m'],
+                SsaSex.Female: float(np.round(number_f / number, 3)),
+                SsaSex.Male: float(np.round(number_m / number, 3)),
             },
             'peak': self.get_peaks(name),
             'latest': _restructure_earliest_or_latest(latest),
@@ -190,6 +555,7 @@ class Displayer(Builder):
         }
         return output
 
+    @cached_result(_displayer_cache, uncached_if=('display',))
     def search(
             self,
             pattern: str = None,
@@ -214,105 +580,65 @@ class Displayer(Builder):
             sort_sex: str = None,
             display: bool = False,
     ) -> pd.DataFrame | list:
-        df = self._calcd.copy()
-        # exclude placeholder names
-        df = df[~df.name.isin(UnknownName.get())].copy()
-
-        # filter on years
-        df = _filter_on_years(df, year, after, before).copy()
+        text_filter = TextFilter(
+            pattern=pattern,
+            start=start,
+            end=end,
+            contains=contains,
+            contains_any=contains_any,
+            not_start=not_start,
+            not_end=not_end,
+            not_contains=not_contains,
+            order=order,
+        )
 
-        # aggregate
-        agg_fields = DFAgg.NUMBER_SUM.copy()
+        # aggregate over years, restricted to the names the n-gram index can't rule out
+        df = self._counts.frame(year, after, before, positions=self._name_ngrams.candidates(text_filter))
         if year:
-            agg_fields.update(dict(rank_='min', rank_f='min', rank_m='min'))
-        df = df.groupby('name', as_index=False).agg(agg_fields)
-        for s in SsaSex.Both:
-            df[f'ratio_{s}'] = df[f'number_{s}'] / df.number
-
-        # add lowercase name for filtering
-        df['name_lower'] = df.name.str.lower()
-
-        # filter on numbers
-        if number_min:
-            df = df[df.number >= number_min]
-        if number_max:
-            df = df[df.number <= number_max]
-
-        # filter on length
-        if length_min or length_max:
-            if length_min:
-                df = df[df.name.map(len) >= length_min]
-            if length_max:
-                df = df[df.name.map(len) <= length_max]
-
-        # filter on ratio
-        if gender:
-            df = df[(df.ratio_m >= gender[0]) & (df.ratio_m <= gender[1])]
-
-        # apply text filters
-        if pattern:
-            df = df[df.name.apply(lambda x: re.search(pattern, x, re.I)).map(bool)]
-        if start:
-            df = df[df.name_lower.str.startswith(tuple(i.lower() for i in start))]
-        if end:
-            df = df[df.name_lower.str.endswith(tuple(i.lower() for i in end))]
-        if contains:
-            df = df[df.name_lower.apply(lambda x: all((i.lower() in x for i in contains)))]
-        if contains_any:
-            df = df[df.name_lower.apply(lambda x: any((i.lower() in x for i in contains_any)))]
-        if order:
-            df = df[df.name_lower.apply(lambda x: re.search('.*'.join(order), x, re.I)).map(bool)]
-
-        # apply text not-filters
-        if not_start:
-            df = df[~df.name_lower.str.startswith(tuple(i.lower() for i in not_start))]
-        if not_end:
-            df = df[~df.name_lower.str.endswith(tuple(i.lower() for i in not_end))]
-        if not_contains:
-            df = df[~df.name_lower.apply(lambda x: any((i.lower() in x for i in not_contains)))]
-
-        if not len(df):
-            return df
-
-        sort_field = f'number_{sort_sex}' if sort_sex else 'number'
-        df = df.sort_values(sort_field, ascending=False).drop(columns='name_lower')
-
-        if peaked is not None:
-            df = df[df.name.isin(peaked.name)].copy()
-
-        if top:
-            df = df.head(top).copy()
-
-        if display:
-            return [_make_search_display_string(*i) for i in df[['name', 'number', 'ratio_f', 'ratio_m']].to_records(
-                index=False)]
-        return df
+            df = df.merge(self._calcd.loc[self._calcd.year == year, ['name', 'rank_', 'rank_f', 'rank_m']], on='name')
+
+        return _refine_search(
+            df,
+            text_filter,
+            number_min=number_min,
+            number_max=number_max,
+            length_min=length_min,
+            length_max=length_max,
+            gender=gender,
+            peaked=peaked,
+            top=top,
+            sort_sex=sort_sex,
+            display=display,
+        )
 
-    def predict_age(self, name: str, sex: str, mid_percentile: float = .68) -> pd.DataFrame:
-        name = _standardize_name(name)
+    @cached_result(_displayer_cache, _standardize_name_param)
+    def predict_age(
+            self,
+            name: str,
+            sex: str,
+            mid_percentile: float = .68,
+            after: int = Year.DATA_QUALITY_BEST_AFTER,
+    ) -> pd.DataFrame:
+        # over the years from Year.DATA_QUALITY_BEST_AFTER on by default, the same as predict_age_frame, so a name gets
+        # the same answer alone or in a batch; before, a single name was predicted over every year, which after=None
+        # still gives. A name or sex with no data gives an empty frame with the same columns and dtypes
+        name = standardize_name(name)
         lower_percentile = .5 - mid_percentile / 2
         upper_percentile = 1 - lower_percentile
+        bound = pd.Index(['lower', 'upper', 'band'], name='bound')
+
+        # a batch of one for the same engine predict_age_batch uses
+        years = self.age_percentiles(after).predict([name], [sex], mid_percentile)
+        if years.year_lower.isna().any():
+            return pd.DataFrame(dict(percentile=pd.Series(dtype=float), year=pd.Series(dtype=int)), index=bound[:0])
 
-        df = self._age_reference.copy()
-        df = df[(df.name == name) & (df.sex == sex)].drop(columns='sex')
-
-        df.number_living_pct = df.number_living_pct.cumsum()
-        df['lower'] = (lower_percentile - df.number_living_pct).abs()
-        df['upper'] = (upper_percentile - df.number_living_pct).abs()
-
-        df = (
-            df[(df.lower == df.lower.min()) | (df.upper == df.upper.min())]
-            .sort_values('year')
-            .assign(bound=['lower', 'upper'])
-            .assign(percentile=[lower_percentile, upper_percentile])
-            .set_index('bound')
-        )[['percentile', 'year']]
-        percentile_band = df.percentile.upper - df.percentile.lower
-        year_band = df.year.upper - df.year.lower
-        df = df.T.assign(band=[percentile_band, year_band]).T
-        df.year = df.year.map(int)
+        df = pd.DataFrame(dict(
+            percentile=[lower_percentile, upper_percentile, upper_percentile - lower_percentile],
+            year=years.iloc[0].astype(int).tolist(),
+        ), index=bound)
         return df
 
+    @cached_result(_displayer_cache, _standardize_name_param)
     def predict_gender(
             self,
             name: str,
@@ -322,34 +648,26 @@ class Displayer(Builder):
             living: bool = True,
     ) -> dict:
         # set up
-        name = _standardize_name(name)
+        name = standardize_name(name)
         output: dict[str, str | bool | int | float] = dict(name=name)
-        df = self.raw_with_actuarial.copy()
-
         if living:
-            df = df.drop(columns='number').rename(columns={'number_living': 'number'})
             output['living'] = True
-
-        # filter dataframe
-        df = df[df.name == name].copy()
         if year:
-            df = df[df.year == year]
             output['year'] = year
         else:
             if after:
-                df = df[df.year >= after]
                 output['after'] = after
             if before:
-                df = df[df.year <= before]
                 output['before'] = before
 
-        # add to output
-        number = df.number.sum()
+        # a batch of one for the same engine the batch predictions use
+        numbers = self.actuarial_counts().window([name], year, after, before, living)[0]
+        numbers = dict(zip(SsaSex.Both, numbers.tolist()))
+        number = sum(numbers.values())
         output['number'] = int(number)
 
         if number:
-            numbers = df.groupby('sex').number.sum()
-            prediction = SsaSex.Female if numbers.get(SsaSex.Female, 0) > numbers.get(SsaSex.Male, 0) else SsaSex.Male
+            prediction = SsaSex.Female if numbers[SsaSex.Female] > numbers[SsaSex.Male] else SsaSex.Male
             output.update(dict(
                 prediction=prediction,
                 confidence=round(numbers[prediction] / number, 2),
@@ -375,19 +693,97 @@ class Displayer(Builder):
         return df
 
     def get_peaks(self, name: str) -> pd.DataFrame:
-        return self._peaks[self._peaks.name == name].groupby(['sex', 'year'], as_index=False).agg(dict(
+        return self._peaks_by_name.get(name).groupby(['sex', 'year'], as_index=False, observed=True).agg(dict(
             rank_='min', number='max')).sort_values(['sex', 'year']).to_dict('records')
 
 
-def _load_name_data_for_one_year(filename: str) -> pd.DataFrame:
-    year = re.search(Pattern.YEAR, filename).group(1)
-    dtypes = dict(name=str, sex=str, number=int)
-    df = pd.read_csv(Filepath.NATIONAL_DATA_DIR + filename, names=list(dtypes.keys()), dtype=dtypes).assign(year=year)
-    df.year = df.year.map(int)
-    df['rank_'] = df.groupby('sex').number.rank(method='min', ascending=False)
+def _find_max_year() -> int:
+    filepaths = list_name_files(Filepath.NATIONAL_DATA_DIR, Filepath.NATIONAL_DATA_ARCHIVE)
+    return max(int(match.group(1)) for i in filepaths if (match := re.search(Pattern.YEAR, os.path.basename(i))))
+
+
+def _load_name_data_for_one_year(filepath: str) -> pd.DataFrame:
+    year = re.search(Pattern.YEAR, os.path.basename(filepath)).group(1)
+    dtypes = dict(name=str, sex=str, number=Dtype.NUMBER)
+    with open_name_file(filepath) as f:
+        df = pd.read_csv(f, names=list(dtypes.keys()), dtype=dtypes).assign(year=Dtype.YEAR(year))
+    df['rank_'] = _rank_min_descending(df.number.to_numpy(), pd.factorize(df.sex)[0])
     return df
 
 
+def _rank_min_descending(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    # same as groupby(groups).rank(method='min', ascending=False), but integral and without a groupby
+    ranks = np.empty(len(values), dtype=Dtype.RANK)
+    if not len(values):
+        return ranks
+    order = np.lexsort((-values.astype(np.int64), groups))
+    sorted_values, sorted_groups = values[order], groups[order]
+    positions = np.arange(len(values))
+    group_starts = np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1]))
+    tie_starts = group_starts | np.concatenate(([True], sorted_values[1:] != sorted_values[:-1]))
+    ranks[order] = (
+            np.maximum.accumulate(np.where(tie_starts, positions, 0)) -
+            np.maximum.accumulate(np.where(group_starts, positions, 0)) + 1
+    )
+    return ranks
+
+
+def _sum_by_name_and_year(raw: pd.DataFrame) -> pd.DataFrame:
+    name_by_year = raw.groupby(['name', 'year'], as_index=False, observed=True).number.sum()
+    name_by_year['rank_'] = _rank_min_descending(name_by_year.number.to_numpy(), name_by_year.year.to_numpy())
+    return name_by_year
+
+
+def _find_peaks(raw: pd.DataFrame, name_by_year: pd.DataFrame) -> pd.DataFrame:
+    peaks_base = pd.concat((raw, name_by_year.assign(sex=SsaSex.All).astype(dict(sex=Dtype.SEX))))
+    peaks_base = peaks_base[peaks_base.year >= Year.DATA_QUALITY_BEST_AFTER]
+    # sorted on the full key so that rebuilding only some names gives the same order as rebuilding all of them
+    return peaks_base.groupby(['name', 'sex'], as_index=False, observed=True).agg(dict(rank_='min')).merge(
+        peaks_base, on=['name', 'sex', 'rank_'], how='left').sort_values(['year', 'name', 'sex']).reset_index(drop=True)
+
+
+def _calculate_ratios_and_number_pct(
+        raw: pd.DataFrame,
+        name_by_year: pd.DataFrame,
+        applicants_data: pd.DataFrame,
+) -> pd.DataFrame:
+    separate_by_sex = lambda x: raw[raw.sex == x].drop(columns='sex').rename(columns=dict(rank_='rank'))
+    merge_on = ['name', 'year']
+    calcd = (
+        separate_by_sex(SsaSex.Female)
+        .merge(separate_by_sex(SsaSex.Male), on=merge_on, suffixes=SsaSex.Suffix, how='outer')
+        .merge(name_by_year, on=merge_on).sort_values(['year', 'name'])
+    )
+    for s in SsaSex.Both:
+        calcd[f'number_{s}'] = calcd[f'number_{s}'].fillna(0).astype(Dtype.NUMBER)
+        calcd[f'rank_{s}'] = calcd[f'rank_{s}'].fillna(-1).astype(Dtype.RANK)
+
+    calcd = calcd.merge(applicants_data, on='year', suffixes=('', '_total'))
+    for s in SsaSex.Both:
+        calcd[f'number_pct_{s}'] = calcd[f'number_{s}'] / calcd[f'number_{s}_total']
+    calcd['number_pct'] = calcd.number / calcd.number_total
+    return calcd.drop(columns=['number_f_total', 'number_m_total', 'number_total'])
+
+
+def _merge_actuarial(raw: pd.DataFrame) -> pd.DataFrame:
+    # loses years before 1900
+    raw_with_actuarial = raw.merge(_load_actuarial_data(), on=['sex', 'year'])
+    raw_with_actuarial['number_living'] = raw_with_actuarial.number * raw_with_actuarial.survival_prob
+    return raw_with_actuarial
+
+
+def _fingerprint_sources(previous: dict[str, dict] = None) -> dict[str, dict]:
+    name_filepaths = list_name_files(Filepath.NATIONAL_DATA_DIR, Filepath.NATIONAL_DATA_ARCHIVE)
+    members = [i for i in name_filepaths if split_archive_path(i)[0]]
+    filepaths = [
+        *(i for i in name_filepaths if not split_archive_path(i)[0]),
+        *(Filepath.ACTUARIAL.format(sex=s) for s in SsaSex.Both),
+        Filepath.APPLICANTS_DATA,
+        Filepath.AGE_PREDICTION_REFERENCE,
+    ]
+    return fingerprint_files(filepaths, previous) | fingerprint_archive_members(members)
+
+
 def _load_actuarial_data() -> pd.DataFrame:
     actuarial = pd.concat(pd.read_csv(Filepath.ACTUARIAL.format(sex=s), usecols=[
         'year', 'age', 'survivors'], dtype=int).assign(sex=s) for s in SsaSex.Both)
@@ -395,10 +791,11 @@ def _load_actuarial_data() -> pd.DataFrame:
     actuarial['birth_year'] = actuarial.year - actuarial.age
     actuarial['survival_prob'] = actuarial.survivors / 100_000
     actuarial = actuarial.drop(columns=['year', 'survivors']).rename(columns={'birth_year': 'year'})
-    return actuarial
+    return actuarial.astype(dict(sex=Dtype.SEX, year=Dtype.YEAR, age=Dtype.YEAR))
 
 
 def _make_plot_for_name(df: pd.DataFrame, name: str, display: bool | str) -> None:
+    import seaborn as sns  # slow to import and only ever needed here
     value_field_name = 'number' if type(display) == bool else display
     year_field = 'year'
     display_fields = list(map(lambda x: f'{value_field_name}_{x}', SsaSex.Both))
@@ -421,6 +818,65 @@ def _filter_on_years(df: pd.DataFrame, year: int = None, after: int = None, befo
     return df
 
 
+def _refine_search(
+        df: pd.DataFrame,
+        text_filter: TextFilter,
+        number_min: int = None,
+        number_max: int = None,
+        length_min: int = None,
+        length_max: int = None,
+        gender: tuple[float, float] = None,
+        peaked: pd.DataFrame = None,
+        top: int = 20,
+        sort_sex: str = None,
+        display: bool = False,
+) -> pd.DataFrame | list:
+    # exclude placeholder names
+    df = df[~df.name.isin(UnknownName.get())].copy()
+
+    for s in SsaSex.Both:
+        df[f'ratio_{s}'] = df[f'number_{s}'] / df.number
+
+    # filter on numbers
+    if number_min:
+        df = df[df.number >= number_min]
+    if number_max:
+        df = df[df.number <= number_max]
+
+    # filter on length
+    if length_min or length_max:
+        lengths = df.name.str.len()
+        if length_min:
+            df = df[lengths >= length_min]
+        if length_max:
+            df = df[lengths <= length_max]
+
+    # filter on ratio
+    if gender:
+        df = df[(df.ratio_m >= gender[0]) & (df.ratio_m <= gender[1])]
+
+    # apply text filters
+    if text_filter:
+        df = df[text_filter.mask(df.name)]
+
+    if not len(df):
+        return df
+
+    sort_field = f'number_{sort_sex}' if sort_sex else 'number'
+    df = df.sort_values(sort_field, ascending=False)
+
+    if peaked is not None:
+        df = df[df.name.isin(peaked.name)].copy()
+
+    if top:
+        df = df.head(top).copy()
+
+    if display:
+        return [_make_search_display_string(*i) for i in df[['name', 'number', 'ratio_f', 'ratio_m']].to_records(
+            index=False)]
+    return df
+
+
 def _make_display_ratio(ratio_f: float, ratio_m: float, ignore_ones: bool = False) -> str:
     if ignore_ones and (ratio_f == 1 or ratio_m == 1):
         return ''
@@ -446,36 +902,13 @@ def _restructure_earliest_or_latest(earliest: dict) -> dict:
     )
 
 
-def _standardize_name(name: str) -> str:
-    reference = {
-        'a': 'à|á',
-        'c': 'ç',
-        'e': 'è|é|ê|ë',
-        'i': 'í|î',
-        'n': 'ñ',
-        'o': 'ó|ô',
-        'u': 'ù|ú|ü',
-    }
-    name = name.lower()
-    for deacc, acc in reference.items():
-        name = re.sub(acc, deacc, name)
-    return ''.join(re.findall(f'[{string.ascii_lowercase}]+', name)).title()
-
-
 def build_predict_gender_reference(
         displayer: Displayer,
         after: int = None,
         before: int = None,
         ratio_min: float = .8,
 ) -> pd.DataFrame:
-    df = displayer.calculated.copy()
-
-    if after:
-        df = df[df.year >= after]
-    if before:
-        df = df[df.year <= before]
-
-    df = df.groupby('name', as_index=False).agg(DFAgg.NUMBER_SUM)
+    df = displayer.counts.frame(after=after, before=before)
 
     df.loc[df.number_f > df.number_m, 'gender_prediction'] = 'f'
     df.loc[df.number_f < df.number_m, 'gender_prediction'] = 'm'
@@ -490,13 +923,19 @@ def build_predict_gender_reference(
     df.gender_prediction = df.gender_prediction.fillna('unk')
 
     df = df[['name', 'gender_prediction']]
-    df.to_csv(Filepath.GENDER_PREDICTION_REFERENCE, index=False)
+    _write_csv_if_changed(df, Filepath.GENDER_PREDICTION_REFERENCE)
     return df
 
 
-def build_total_number_living_from_actuarial(raw_with_actuarial: pd.DataFrame) -> None:
-    total_number_living = raw_with_actuarial.groupby(['name', 'sex'], as_index=False).number_living.sum()
-    total_number_living.to_csv(Filepath.TOTAL_NUMBER_LIVING_REFERENCE, index=False)
+def build_total_number_living_from_actuarial(raw_with_actuarial: pd.DataFrame, names: pd.Index = None) -> None:
+    if names is not None:
+        raw_with_actuarial = raw_with_actuarial[raw_with_actuarial.name.isin(names)]
+    total_number_living = raw_with_actuarial.groupby(
+        ['name', 'sex'], as_index=False, observed=True).number_living.sum()
+    if names is not None:
+        total_number_living = _replace_generated_rows(
+            Filepath.TOTAL_NUMBER_LIVING_REFERENCE, total_number_living, names, ['name', 'sex'])
+    _write_csv_if_changed(total_number_living, Filepath.TOTAL_NUMBER_LIVING_REFERENCE)
     return
 
 
@@ -505,22 +944,50 @@ def _read_total_number_living() -> pd.DataFrame:
     return pd.read_csv(Filepath.TOTAL_NUMBER_LIVING_REFERENCE, usecols=list(dtype.keys()), dtype=dtype)
 
 
-def build_predict_age_reference(raw_with_actuarial: pd.DataFrame) -> None:
+def build_predict_age_reference(raw_with_actuarial: pd.DataFrame, names: pd.Index = None) -> bool:
+    if names is not None:
+        raw_with_actuarial = raw_with_actuarial[raw_with_actuarial.name.isin(names)]
     ref = raw_with_actuarial[['name', 'sex', 'year', 'number_living']].copy()
-    ref = ref.groupby(['name', 'sex', 'year'], as_index=False).number_living.sum().merge(
+    ref = ref.groupby(['name', 'sex', 'year'], as_index=False, observed=True).number_living.sum().merge(
         _read_total_number_living(), on=['name', 'sex'], suffixes=('', '_name'))
     ref = ref[ref.number_living_name >= 20].copy()
     ref['number_living_pct'] = ref.number_living / ref.number_living_name
-    ref = ref.drop(columns=['number_living', 'number_living_name']).sort_values('year')
-    ref.to_csv(Filepath.AGE_PREDICTION_REFERENCE, index=False)
-    return
+    ref = ref.drop(columns=['number_living', 'number_living_name']).sort_values('year', kind='stable')
+    if names is not None:
+        ref = _replace_generated_rows(Filepath.AGE_PREDICTION_REFERENCE, ref, names, ['year', 'name', 'sex'])
+    return _write_csv_if_changed(ref, Filepath.AGE_PREDICTION_REFERENCE)
+
+
+def _replace_generated_rows(filepath: str, df: pd.DataFrame, names: pd.Index, sort_by: list[str]) -> pd.DataFrame:
+    # everything is compared as written, so rows of untouched names come back out byte for byte
+    read_as_written = dict(dtype=str, keep_default_na=False)
+    previous = pd.read_csv(filepath, **read_as_written)
+    updated = pd.read_csv(io.StringIO(df.to_csv(index=False)), **read_as_written)
+    df = pd.concat((previous[~previous.name.isin(names)], updated))
+    return df.sort_values(sort_by, kind='stable')
+
+
+def _write_csv_if_changed(df: pd.DataFrame, filepath: str) -> bool:
+    text = df.to_csv(index=False)
+    if os.path.exists(filepath):
+        with open(filepath, newline='') as f:
+            if f.read() == text:
+                return False
+    with open(filepath, 'w', newline='') as f:
+        f.write(text)
+    return True
 
 
-def build_all_generated_data() -> None:
+def build_all_generated_data(incremental: bool = False) -> None:
     displayer = Displayer()
-    displayer.build_base()
+    names = None
+    if incremental:
+        names = displayer.update_base()
+    else:
+        displayer.build_base()
 
     build_predict_gender_reference(displayer)
-    build_total_number_living_from_actuarial(displayer.raw_with_actuarial)
-    build_predict_age_reference(displayer.raw_with_actuarial)
+    build_total_number_living_from_actuarial(displayer.raw_with_actuarial, names)
+    if build_predict_age_reference(displayer.raw_with_actuarial, names):
+        displayer.reload_predict_age_reference()
     return
@@ -1,31 +1,481 @@
 import os
 
+import numpy as np
 import pandas as pd
 
-from core import Builder
+from core import (
+    Builder, Dtype, Filepath, NameYearCounts, UnknownName, Year, _displayer_cache, _filter_on_years, _name_codes,
+    _rank_min_descending, _refine_search, _restructure_earliest_or_latest, _standardize_name_param, _year_bounds)
+from demos import SsaSex
+from name_filter import TextFilter
+from name_loader import list_name_files, open_name_file, load_name_files
+from name_normalization import standardize_name
+from result_cache import ResultCache, cached_result
 
 
 class StateFilepath:
     NAME_DATA_DIR: str = 'data/namesbystate/'
+    NAME_DATA_ARCHIVE: str = 'data/namesbystate.zip'
+
+
+class Region:
+    Northeast: tuple[str, ...] = ('CT', 'MA', 'ME', 'NH', 'NJ', 'NY', 'PA', 'RI', 'VT')
+    Midwest: tuple[str, ...] = ('IA', 'IL', 'IN', 'KS', 'MI', 'MN', 'MO', 'ND', 'NE', 'OH', 'SD', 'WI')
+    South: tuple[str, ...] = (
+        'AL', 'AR', 'DC', 'DE', 'FL', 'GA', 'KY', 'LA', 'MD', 'MS', 'NC', 'OK', 'SC', 'TN', 'TX', 'VA', 'WV')
+    West: tuple[str, ...] = ('AK', 'AZ', 'CA', 'CO', 'HI', 'ID', 'MT', 'NM', 'NV', 'OR', 'UT', 'WA', 'WY')
+
+    NAMES: tuple[str, ...] = ('northeast', 'midwest', 'south', 'west', 'territories')
+
+    @classmethod
+    def get(cls, region: str, territories: tuple[str, ...] = ()) -> tuple[str, ...]:
+        # territories are whichever areas the territory files cover
+        regions = dict(northeast=cls.Northeast, midwest=cls.Midwest, south=cls.South, west=cls.West)
+        return regions.get(region.lower(), territories if region.lower() == 'territories' else ())
+
+
+class StateNameYearCounts:
+    def __init__(
+            self,
+            states: pd.Index,
+            names: pd.Index,
+            first_year: int,
+            last_year: int,
+            offsets: np.ndarray,
+            name_codes: np.ndarray,
+            numbers: np.ndarray,
+    ) -> None:
+        self.states: pd.Index = pd.Index(states)
+        self.names: pd.Index = pd.Index(names)
+        self.first_year: int = first_year
+        self.last_year: int = last_year
+        # one row per (state, year, name) with any births, sorted in that order; a state's rows over a span of years
+        # are one slice, starting at offsets[state * years + year]
+        self._offsets = offsets
+        self._name_codes = name_codes
+        self._numbers = numbers  # (rows, [f, m])
+        years = last_year - first_year + 1
+        blocks = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        self._ranks = _rank_within_blocks(numbers, blocks)  # (rows, [all, f, m]), -1 where there were no births
+        # births over every name, cumulative along the years with a leading zero: (states, years + 1, [f, m])
+        self._totals = np.zeros((len(self.states), years + 1, len(SsaSex.Both)), dtype=np.int64)
+        for i in range(len(SsaSex.Both)):
+            self._totals[:, 1:, i] = np.bincount(blocks, weights=numbers[:, i], minlength=len(offsets) - 1).reshape(
+                len(self.states), years)
+        np.cumsum(self._totals, axis=1, out=self._totals)
+        # row positions grouped by name, as in _NameIndex
+        self._by_name = np.argsort(name_codes, kind='stable').astype(np.int32)
+        self._name_offsets = np.concatenate(([0], np.cumsum(np.bincount(name_codes, minlength=len(self.names)))))
+
+    @classmethod
+    def from_raw(cls, raw: pd.DataFrame) -> 'StateNameYearCounts':
+        state_codes, states = _name_codes(raw.state)
+        name_codes, names = _name_codes(raw.name)
+        first_year, last_year = int(raw.year.min()), int(raw.year.max())
+        numbers = np.zeros((len(raw), len(SsaSex.Both)), dtype=np.int64)
+        numbers[np.arange(len(raw)), (raw.sex == SsaSex.Male).to_numpy().astype(np.intp)] = raw.number.to_numpy()
+        year_codes = raw.year.to_numpy().astype(np.int64) - first_year
+        return cls._from_rows(states, names, first_year, last_year, state_codes, year_codes, name_codes, numbers)
+
+    @classmethod
+    def _from_rows(
+            cls,
+            states: pd.Index,
+            names: pd.Index,
+            first_year: int,
+            last_year: int,
+            state_codes: np.ndarray,
+            year_codes: np.ndarray,
+            name_codes: np.ndarray,
+            numbers: np.ndarray,
+    ) -> 'StateNameYearCounts':
+        # rows with the same (state, year, name) are summed
+        blocks = state_codes.astype(np.int64) * (last_year - first_year + 1) + year_codes
+        order = np.lexsort((name_codes, blocks))
+        blocks, name_codes, numbers = blocks[order], name_codes[order], numbers[order]
+        starts = np.flatnonzero(np.concatenate((
+            [True], (blocks[1:] != blocks[:-1]) | (name_codes[1:] != name_codes[:-1]))))[:len(blocks)]
+        numbers = np.add.reduceat(numbers, starts, axis=0) if len(starts) else numbers
+        offsets = np.searchsorted(blocks[starts], np.arange(len(states) * (last_year - first_year + 1) + 1))
+        return cls(states, names, first_year, last_year, offsets, name_codes[starts].astype(np.int32), _narrow(
+            numbers))
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self._offsets, self._name_codes, self._numbers, self._ranks, self._totals, self._by_name,
+                  self._name_offsets)
+        return sum(i.nbytes for i in arrays)
+
+    @property
+    def rows(self) -> int:
+        return len(self._name_codes)
+
+    def merge(self, states: tuple[str, ...]) -> 'StateNameYearCounts':
+        # the states' rows summed into a single area, so ranks are within the area as a whole
+        years = self.last_year - self.first_year + 1
+        rows = np.concatenate([np.empty(0, dtype=np.int64), *(np.arange(
+            self._offsets[i * years], self._offsets[(i + 1) * years]) for i in self.states.get_indexer(states))])
+        year_codes = (np.searchsorted(self._offsets, rows, side='right') - 1) % years
+        return self._from_rows(
+            pd.Index(['+'.join(states)]), self.names, self.first_year, self.last_year, np.zeros(len(rows), np.int64),
+            year_codes, self._name_codes[rows], self._numbers[rows].astype(np.int64))
+
+    def _state_rows(self, state: int, year: int = None, after: int = None, before: int = None) -> slice:
+        lo, hi = _year_bounds(self.first_year, self.last_year, year, after, before)
+        years = self.last_year - self.first_year + 1
+        return slice(self._offsets[state * years + lo], self._offsets[state * years + hi])
+
+    def _name_rows(self, name: str) -> np.ndarray:
+        if name not in self.names:
+            return np.empty(0, dtype=np.int32)
+        code = self.names.get_loc(name)
+        return self._by_name[self._name_offsets[code]:self._name_offsets[code + 1]]
+
+    def totals(self, state: int | np.ndarray, year: int = None, after: int = None, before: int = None) -> np.ndarray:
+        lo, hi = _year_bounds(self.first_year, self.last_year, year, after, before)
+        return self._totals[state, hi] - self._totals[state, lo]
+
+    def window(self, state: int, year: int = None, after: int = None, before: int = None) -> np.ndarray:
+        rows = self._state_rows(state, year, after, before)
+        return np.stack([np.bincount(
+            self._name_codes[rows], weights=self._numbers[rows, i], minlength=len(self.names),
+        ) for i in range(len(SsaSex.Both))], axis=1).astype(np.int64)
+
+    def by_state(self, name: str, year: int = None, after: int = None, before: int = None) -> np.ndarray:
+        # one name's births in each state: (states, [f, m])
+        lo, hi = _year_bounds(self.first_year, self.last_year, year, after, before)
+        years = self.last_year - self.first_year + 1
+        rows = self._name_rows(name)
+        blocks = np.searchsorted(self._offsets, rows, side='right') - 1
+        is_kept = (blocks % years >= lo) & (blocks % years < hi)
+        numbers = np.zeros((len(self.states), len(SsaSex.Both)), dtype=np.int64)
+        np.add.at(numbers, blocks[is_kept] // years, self._numbers[rows[is_kept]])
+        return numbers
+
+    def frame(
+            self,
+            state: int,
+            year: int = None,
+            after: int = None,
+            before: int = None,
+            positions: np.ndarray = None,
+    ) -> pd.DataFrame:
+        numbers = self.window(state, year, after, before)
+        names = self.names
+        if positions is not None:
+            numbers, names = numbers[positions], names[positions]
+        df = pd.DataFrame(dict(
+            name=names,
+            number=numbers.sum(axis=1),
+            number_f=numbers[:, 0],
+            number_m=numbers[:, 1],
+        ))
+        return df[df.number > 0].reset_index(drop=True)
+
+    def ranks(self, state: int, year: int) -> pd.DataFrame:
+        rows = self._state_rows(state, year)
+        ranks = self._ranks[rows].astype(Dtype.RANK)
+        return pd.DataFrame(dict(
+            name=self.names[self._name_codes[rows]], rank_=ranks[:, 0], rank_f=ranks[:, 1], rank_m=ranks[:, 2]))
+
+    def name_frame(self, name: str, state: int) -> pd.DataFrame:
+        # one row per year the name was given in the state, like the national calculated frame
+        years = self.last_year - self.first_year + 1
+        rows = self._name_rows(name)
+        rows = rows[np.searchsorted(rows, self._offsets[state * years]):np.searchsorted(
+            rows, self._offsets[(state + 1) * years])]
+        numbers = self._numbers[rows].astype(Dtype.NUMBER)
+        ranks = self._ranks[rows].astype(Dtype.RANK)
+        return pd.DataFrame(dict(
+            year=((np.searchsorted(self._offsets, rows, side='right') - 1) % years + self.first_year).astype(
+                Dtype.YEAR),
+            number=numbers.sum(axis=1),
+            number_f=numbers[:, 0],
+            number_m=numbers[:, 1],
+            rank_=ranks[:, 0],
+            rank_f=ranks[:, 1],
+            rank_m=ranks[:, 2],
+        ))
 
 
 class StateBuilder(Builder):
+    def __init__(self, workers: int = None) -> None:
+        super().__init__(workers)
+        self._counts: StateNameYearCounts
+        self._national_counts: NameYearCounts
+        self._all_states_counts: StateNameYearCounts
+        # each merged cube is about as large as the rows it was merged from, so only a few selections are kept
+        self._merged_counts = ResultCache(max_entries=8, max_bytes=256 * 2 ** 20, copy_results=False)
+        self.territories: tuple[str, ...] = ()
+
     def build_base(self) -> None:
-        self._load_name_data()
+        self._reset(mmap=False)
+        self._merged_counts.clear()
+        for step in (
+                self._load_name_data, self._build_counts, self._build_national_counts, self._build_all_states_counts,
+                self._build_name_ngrams):
+            self._timed(step)
         return
 
     def _load_name_data(self) -> None:
-        self._raw = pd.concat([
-            _load_name_data_for_one_state(filename) for filename in os.listdir(StateFilepath.NAME_DATA_DIR)
-            if filename.lower().endswith('.txt')
-        ])
-        self._raw.sex = self._raw.sex.str.lower()
-        self._raw.rank_ = self._raw.rank_.map(int)
+        territory_filepaths = list_name_files(Filepath.TERRITORIES_DATA_DIR, Filepath.TERRITORIES_DATA_ARCHIVE)
+        self._raw = load_name_files([
+            *list_name_files(StateFilepath.NAME_DATA_DIR, StateFilepath.NAME_DATA_ARCHIVE),
+            *territory_filepaths,
+        ], _load_name_data_for_one_state, self.workers)
+        sex = self._raw.sex.astype('category')
+        self._raw.sex = sex.cat.rename_categories(sex.cat.categories.str.lower()).astype(Dtype.SEX)
+        self._raw = self._raw.astype(dict(state='category', name='category'))
+        self.territories = tuple(sorted(os.path.splitext(os.path.basename(i))[0].upper() for i in territory_filepaths))
         return
 
+    def _build_counts(self) -> None:
+        self._counts = StateNameYearCounts.from_raw(self._raw)
+        return
+
+    def _build_national_counts(self) -> None:
+        # every state summed by name and year, so comparisons with the whole country need no pass over the states;
+        # territories aren't part of it
+        self._national_counts = NameYearCounts.from_raw(self._raw[~self._raw.state.isin(self.territories)])
+        return
+
+    def _build_all_states_counts(self) -> None:
+        # the default selection, merged up front so no request pays for it
+        self._all_states_counts = self._counts.merge(self._selected_states())
+        return
+
+    def _national_states(self) -> np.ndarray:
+        return np.flatnonzero(~self._counts.states.isin(self.territories))
+
+    def _selected_states(self, state: str | tuple[str, ...] = None, region: str = None) -> tuple[str, ...]:
+        # every state but not the territories when neither is given, as in the national counts
+        if not state and not region:
+            return tuple(sorted(self._counts.states[self._national_states()]))
+        # an unknown code or region would otherwise select nothing, which looks just like a name that was never given
+        states = {i.upper() for i in ({state} if isinstance(state, str) else set(state or ()))}
+        if unknown := sorted(states.difference(self._counts.states)):
+            raise ValueError(f'unknown state(s) {", ".join(f"`{i}`" for i in unknown)}; expected one of'
+                             f' {", ".join(sorted(self._counts.states))}')
+        if region:
+            if region.lower() not in Region.NAMES:
+                raise ValueError(f'unknown region `{region}`; expected one of {", ".join(Region.NAMES)}')
+            # a region's states that the data doesn't cover are left out
+            states.update(i for i in Region.get(region, self.territories) if i in self._counts.states)
+        return tuple(sorted(states))
+
+    def _select(self, state: str | tuple[str, ...] = None, region: str = None) -> tuple[StateNameYearCounts, int]:
+        # a single state is read from the cube as is; any other selection is merged into a cube of its own on first
+        # use
+        states = self._selected_states(state, region)
+        if len(states) == 1:
+            return self._counts, self._counts.states.get_loc(states[0])
+        if '+'.join(states) == self._all_states_counts.states[0]:
+            return self._all_states_counts, 0
+        return self._merged_counts.get_or_compute(states, lambda: self._counts.merge(states)), 0
+
+
+class StateDisplayer(StateBuilder):
+    @cached_result(_displayer_cache, _standardize_name_param)
+    def name(
+            self,
+            name: str,
+            state: str | tuple[str, ...] = None,
+            region: str = None,
+            after: int = None,
+            before: int = None,
+            year: int = None,
+    ) -> dict:
+        # filter on name and area
+        name = standardize_name(name)
+        counts, code = self._select(state, region)
+        df = counts.name_frame(name, code)
+        if not len(df):
+            return {}
+
+        # build metadata
+        selected = df[df.year == year].to_dict('records') if year else []
+        selected_year = {'selected_year': _restructure_earliest_or_latest(selected[0])} if selected else {}
+        earliest, latest = df.iloc[[0, -1]].to_dict('records')
+
+        # filter on years
+        df = _filter_on_years(df, year, after, before)
+        if not len(df):
+            return {}
+
+        # aggregate
+        number_f, number_m = int(df.number_f.sum()), int(df.number_m.sum())
+        number = number_f + number_m
+
+        # build output
+        output = {
+            'name': name,
+            **dict(state=state, region=region, after=after, before=before, year=year),
+            'numbers': {
+                SsaSex.Total: number,
+                SsaSex.Female: number_f,
+                SsaSex.Male: number_m,
+            },
+            'ratios': {
+                SsaSex.Female: float(np.round(number_f / number, 3)),
+                SsaSex.Male: float(np.round(number_m / number, 3)),
+            },
+            'peak': self.get_peaks(name, state, region),
+            'latest': _restructure_earliest_or_latest(latest),
+            'earliest': _restructure_earliest_or_latest(earliest),
+            **selected_year,
+        }
+        return output
+
+    @cached_result(_displayer_cache, uncached_if=('display',))
+    def search(
+            self,
+            pattern: str = None,
+            start: tuple = None,
+            end: tuple = None,
+            contains: tuple = None,
+            contains_any: tuple = None,
+            not_start: tuple = None,
+            not_end: tuple = None,
+            not_contains: tuple = None,
+            order: tuple = None,
+            length_min: int = None,
+            length_max: int = None,
+            number_min: int = None,
+            number_max: int = None,
+            gender: tuple[float, float] = None,
+            state: str | tuple[str, ...] = None,
+            region: str = None,
+            after: int = None,
+            before: int = None,
+            year: int = None,
+            peaked: pd.DataFrame = None,
+            top: int = 20,
+            sort_sex: str = None,
+            display: bool = False,
+    ) -> pd.DataFrame | list:
+        text_filter = TextFilter(
+            pattern=pattern,
+            start=start,
+            end=end,
+            contains=contains,
+            contains_any=contains_any,
+            not_start=not_start,
+            not_end=not_end,
+            not_contains=not_contains,
+            order=order,
+        )
+
+        # aggregate over the area's years, restricted to the names the n-gram index can't rule out
+        counts, code = self._select(state, region)
+        df = counts.frame(code, year, after, before, positions=self._name_ngrams.candidates(text_filter))
+        if year:
+            df = df.merge(counts.ranks(code, year), on='name')
+
+        return _refine_search(
+            df,
+            text_filter,
+            number_min=number_min,
+            number_max=number_max,
+            length_min=length_min,
+            length_max=length_max,
+            gender=gender,
+            peaked=peaked,
+            top=top,
+            sort_sex=sort_sex,
+            display=display,
+        )
+
+    @cached_result(_displayer_cache, _standardize_name_param)
+    def distribution(self, name: str, after: int = None, before: int = None, year: int = None) -> pd.DataFrame:
+        # where a name was given, as a share of each state's births over the same years and relative to the share
+        # across the country
+        name = standardize_name(name)
+        numbers = self._counts.by_state(name, year, after, before)
+        births = self._counts.totals(np.arange(len(self._counts.states)), year, after, before)
+        national = self._national_states()
+        df = pd.DataFrame(dict(
+            state=self._counts.states,
+            number=numbers.sum(axis=1),
+            number_f=numbers[:, 0],
+            number_m=numbers[:, 1],
+            births=births.sum(axis=1),
+        ))
+        df = df[df.number > 0].copy()
+        df['share'] = df.number / df.births
+        # a territory isn't part of the country's births, so its own are added to the baseline it's compared with
+        outside = df.state.isin(self.territories)
+        baseline = (numbers[national].sum() + df.number.where(outside, 0)) / (
+                births[national].sum() + df.births.where(outside, 0))
+        df['concentration'] = df.share / baseline
+        df = df.sort_values(['share', 'state'], ascending=[False, True]).reset_index(drop=True)
+        df['rank_'] = df.share.rank(method='min', ascending=False).astype(Dtype.RANK)
+        return df
+
+    @cached_result(_displayer_cache)
+    def over_represented(
+            self,
+            state: str | tuple[str, ...] = None,
+            region: str = None,
+            after: int = None,
+            before: int = None,
+            year: int = None,
+            number_min: int = 100,
+            top: int = 20,
+    ) -> pd.DataFrame:
+        # names whose share of the area's births is furthest above their share of the country's
+        counts, code = self._select(state, region)
+        numbers = counts.window(code, year, after, before).sum(axis=1)
+        national = self._national_counts.window(year, after, before).sum(axis=1)
+        # territories in the area aren't part of the country's births, so they're added to the baseline; otherwise a
+        # name only given there would have no national share to compare with
+        territories = [i for i in self._selected_states(state, region) if i in self.territories]
+        for i in self._counts.states.get_indexer(territories):
+            national += self._counts.window(i, year, after, before).sum(axis=1)
+        is_kept = numbers >= max(number_min or 0, 1)
+        df = pd.DataFrame(dict(name=counts.names[is_kept], number=numbers[is_kept], number_national=national[is_kept]))
+        df = df[~df.name.isin(UnknownName.get())].copy()
+        df['share'] = df.number / counts.totals(code, year, after, before).sum()
+        df['share_national'] = df.number_national / national.sum()
+        df['ratio'] = df.share / df.share_national
+        df = df.sort_values(['ratio', 'number'], ascending=False)
+        if top:
+            df = df.head(top)
+        return df.reset_index(drop=True)
+
+    def get_peaks(self, name: str, state: str | tuple[str, ...] = None, region: str = None) -> list[dict]:
+        counts, code = self._select(state, region)
+        df = counts.name_frame(name, code)
+        df = df[df.year >= Year.DATA_QUALITY_BEST_AFTER]
+        columns = {SsaSex.All: ('number', 'rank_'), **{s: (f'number_{s}', f'rank_{s}') for s in SsaSex.Both}}
+        # each sex's best rank and every year it was reached, the same records the national get_peaks gives
+        peaks = []
+        for s, (number_col, rank_col) in columns.items():
+            ranks = df[rank_col].to_numpy()
+            if not (ranks > 0).any():
+                continue
+            is_peak = ranks == ranks[ranks > 0].min()
+            peaks += [dict(sex=s, year=year, rank_=rank_, number=number) for year, rank_, number in zip(
+                df.year[is_peak].tolist(), ranks[is_peak].tolist(), df[number_col][is_peak].tolist())]
+        return peaks
+
+
+def _narrow(values: np.ndarray) -> np.ndarray:
+    # state-level counts and ranks are small, so most selections fit in half the width
+    fits = not len(values) or np.abs(values).max() <= np.iinfo(np.int16).max
+    return values.astype(np.int16 if fits else np.int32)
+
+
+def _rank_within_blocks(numbers: np.ndarray, blocks: np.ndarray) -> np.ndarray:
+    ranks = np.empty((len(numbers), 1 + len(SsaSex.Both)), dtype=np.int32)
+    for i, values in enumerate((numbers.sum(axis=1, dtype=np.int64), *numbers.T)):
+        ranks[:, i] = np.where(values > 0, _rank_min_descending(values, blocks), -1)
+    return _narrow(ranks)
+
 
-def _load_name_data_for_one_state(filename: str) -> pd.DataFrame:
-    dtypes = dict(state=str, sex=str, year=int, name=str, number=int)
-    df = pd.read_csv(StateFilepath.NAME_DATA_DIR + filename, names=tuple(dtypes.keys()), dtype=dtypes)
-    df['rank_'] = df.groupby('sex').number.rank(method='min', ascending=False)
+def _load_name_data_for_one_state(filepath: str) -> pd.DataFrame:
+    dtypes = dict(state=str, sex=str, year=Dtype.YEAR, name=str, number=Dtype.NUMBER)
+    with open_name_file(filepath) as f:
+        df = pd.read_csv(f, names=tuple(dtypes.keys()), dtype=dtypes)
+    # each file holds every year of one state, so ranks are within each year as well as each sex
+    df['rank_'] = _rank_min_descending(df.number.to_numpy(), df.groupby(['year', 'sex']).ngroup().to_numpy())
     return df
@@ -19,24 +19,18 @@ def add_ratios(calcd: pd.DataFrame) -> pd.DataFrame:
 
 
 def offset_plot_year_by_sex(df: pd.DataFrame, year_field: str) -> pd.DataFrame:
-    df[year_field] = df[year_field].map(float)
+    df[year_field] = df[year_field].astype(float)
     df.loc[df.sex == 'f', year_field] -= .25
     df.loc[df.sex == 'm', year_field] += .25
     return df
 
 
 def convert_year_to_decade_or_half_decade(series: pd.Series, half: bool = False) -> pd.Series:
-    year_str_acc = series.map(str).str
-    decade = year_str_acc.slice(0, 3)
-    if half:
-        half_decade = year_str_acc.slice(-1).map(int).apply(lambda x: 0 if x < 5 else 5).map(str)
-        series = decade + half_decade
-    else:
-        series = decade + '0'
-    return series.map(int)
+    step = 5 if half else 10
+    return series.astype(int) // step * step
 
 
 def rerank_by_decade_or_half_decade(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.groupby(['name', 'year', 'sex'], as_index=False).number.sum()
-    df['rank_'] = df.groupby(['year', 'sex']).number.rank(method='min', ascending=False)
+    df = df.groupby(['name', 'year', 'sex'], as_index=False, observed=True).number.sum()
+    df['rank_'] = df.groupby(['year', 'sex'], observed=True).number.rank(method='min', ascending=False)
     return df
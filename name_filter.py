@@ -0,0 +1,128 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+class TextFilter:
+    def __init__(
+            self,
+            pattern: str = None,
+            start: tuple = None,
+            end: tuple = None,
+            contains: tuple = None,
+            contains_any: tuple = None,
+            not_start: tuple = None,
+            not_end: tuple = None,
+            not_contains: tuple = None,
+            order: tuple = None,
+    ) -> None:
+        self.start = _lower(start)
+        self.end = _lower(end)
+        self.not_start = _lower(not_start)
+        self.not_end = _lower(not_end)
+        self.contains = _lower(contains)
+        self.contains_any = _lower(contains_any)
+        self.not_contains = _lower(not_contains)
+        self.order = tuple(order) if order else ()
+        self.pattern = re.compile(pattern, re.I) if pattern else None
+        self.combined = _compile_combined(self.contains, self.contains_any, self.order, self.not_contains)
+
+    def __bool__(self) -> bool:
+        return bool(self.start or self.end or self.not_start or self.not_end or self.combined or self.pattern)
+
+    def mask(self, names: pd.Series) -> np.ndarray:
+        lower = names.str.lower()
+        mask = np.ones(len(names), dtype=bool)
+
+        # prefixes and suffixes are cheap, so they narrow the candidates before any regex runs
+        if self.start:
+            mask &= lower.str.startswith(self.start).to_numpy()
+        if self.end:
+            mask &= lower.str.endswith(self.end).to_numpy()
+        if self.not_start:
+            mask &= ~lower.str.startswith(self.not_start).to_numpy()
+        if self.not_end:
+            mask &= ~lower.str.endswith(self.not_end).to_numpy()
+
+        if self.combined:
+            mask[mask] = _matches(self.combined.match, lower[mask])
+        if self.pattern:
+            mask[mask] = _matches(self.pattern.search, names[mask])
+        return mask
+
+
+def _matches(method, values: pd.Series) -> np.ndarray:
+    return np.fromiter((method(i) is not None for i in values), dtype=bool, count=len(values))
+
+
+def _lower(values: tuple) -> tuple[str, ...]:
+    return tuple(i.lower() for i in values) if values else ()
+
+
+def _compile_combined(contains: tuple, contains_any: tuple, order: tuple, not_contains: tuple) -> re.Pattern | None:
+    # every predicate becomes a lookahead anchored at the start, so one match call evaluates all of them
+    lookaheads = [f'(?=.*?{re.escape(i)})' for i in contains]
+    if contains_any:
+        lookaheads.append(f'(?=.*?(?:{"|".join(map(re.escape, contains_any))}))')
+    if order:
+        lookaheads.append(f'(?=.*?(?:{".*".join(order)}))')
+    if not_contains:
+        lookaheads.append(f'(?!.*?(?:{"|".join(map(re.escape, not_contains))}))')
+    return re.compile(''.join(lookaheads), re.I) if lookaheads else None
+
+
+class NgramIndex:
+    def __init__(self, names: pd.Index, n: int = 3) -> None:
+        self.n = n
+        encoded = ('^' + pd.Series(names, dtype=object).str.lower() + '$').str.encode('utf-8')
+        lengths = encoded.str.len().to_numpy()
+        width = int(lengths.max())
+        chars = np.array(encoded.tolist(), dtype=f'S{width}').view(np.uint8).reshape(len(encoded), width)
+
+        # every gram of up to n bytes becomes one integer code, so lookups never touch strings
+        codes, positions = [], []
+        for size in range(1, n + 1):
+            for offset in range(width - size + 1):
+                has_gram = np.flatnonzero(lengths >= offset + size)
+                code = np.zeros(len(has_gram), dtype=np.int64)
+                for i in range(offset, offset + size):
+                    code = code * 256 + chars[has_gram, i]
+                codes.append(code)
+                positions.append(has_gram)
+
+        # one sorted, de-duplicated posting list of name positions per gram
+        keys = np.unique(np.concatenate(codes) * len(encoded) + np.concatenate(positions))
+        codes, postings = np.divmod(keys, len(encoded))
+        grams, bounds = np.unique(codes, return_index=True)
+        postings = np.split(postings.astype(np.int32), bounds[1:])
+        self._postings: dict[int, np.ndarray] = dict(zip(grams.tolist(), postings))
+        self._empty = np.array([], dtype=np.int32)
+
+    def _lookup(self, text: str) -> np.ndarray:
+        text = text.encode('utf-8')
+        grams = [text] if len(text) <= self.n else [text[i:i + self.n] for i in range(len(text) - self.n + 1)]
+        return _intersect([self._postings.get(int.from_bytes(gram, 'big'), self._empty) for gram in grams])
+
+    def candidates(self, text_filter: TextFilter) -> np.ndarray | None:
+        required = []
+        if text_filter.start:
+            required.append(np.unique(np.concatenate([self._lookup('^' + i) for i in text_filter.start])))
+        if text_filter.end:
+            required.append(np.unique(np.concatenate([self._lookup(i + '$') for i in text_filter.end])))
+        required.extend(self._lookup(i) for i in text_filter.contains if i)
+        if text_filter.contains_any and all(text_filter.contains_any):
+            required.append(np.unique(np.concatenate([self._lookup(i) for i in text_filter.contains_any])))
+        # order items are regexes; only plain literals are guaranteed substrings
+        required.extend(self._lookup(i.lower()) for i in text_filter.order if i and re.escape(i) == i)
+        return _intersect(required) if required else None
+
+
+def _intersect(postings: list[np.ndarray]) -> np.ndarray:
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for posting in postings[1:]:
+        if not len(result):
+            break
+        result = np.intersect1d(result, posting, assume_unique=True)
+    return result
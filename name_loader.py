@@ -0,0 +1,112 @@
+import os
+import threading
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import IO, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+
+_ARCHIVE_SEPARATOR: str = '.zip/'
+_THREAD_ARCHIVES = threading.local()
+
+
+def default_workers() -> int:
+    return min(8, os.cpu_count() or 1)
+
+
+def list_name_files(directory: str, archive: str = None) -> list[str]:
+    # the downloaded archive is read in place when there is one; its members are addressed as archive.zip/member
+    if archive and os.path.isfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            return sorted(os.path.join(archive, i) for i in z.namelist() if i.lower().endswith('.txt'))
+    return sorted(directory + i for i in os.listdir(directory) if i.lower().endswith('.txt'))
+
+
+def split_archive_path(filepath: str) -> tuple[str | None, str]:
+    archive, separator, member = filepath.partition(_ARCHIVE_SEPARATOR)
+    if not separator:
+        return None, filepath
+    return archive + separator.rstrip('/'), member
+
+
+@contextmanager
+def open_name_file(filepath: str) -> Iterator[IO[bytes]]:
+    archive, member = split_archive_path(filepath)
+    if archive is None:
+        with open(filepath, 'rb') as f:
+            yield f
+        return
+    with _open_archive(archive).open(member) as f:
+        yield f
+    return
+
+
+def _open_archive(archive: str) -> zipfile.ZipFile:
+    # reading the central directory costs more than unpacking one member, so each thread keeps its archives open;
+    # separate handles per thread let members be decompressed in parallel
+    archives: dict[tuple[str, int], zipfile.ZipFile] = vars(_THREAD_ARCHIVES).setdefault('archives', {})
+    key = (archive, os.stat(archive).st_mtime_ns)
+    if key not in archives:
+        for stale in [i for i in archives if i[0] == archive]:
+            archives.pop(stale).close()
+        archives[key] = zipfile.ZipFile(archive)
+    return archives[key]
+
+
+def fingerprint_archive_members(filepaths: list[str]) -> dict[str, dict]:
+    # archives already record each member's size and crc, so members are fingerprinted without reading them
+    fingerprint = {}
+    members_by_archive: dict[str, set[str]] = {}
+    for filepath in filepaths:
+        archive, member = split_archive_path(filepath)
+        members_by_archive.setdefault(archive, set()).add(member)
+    for archive, members in members_by_archive.items():
+        with zipfile.ZipFile(archive) as z:
+            for info in z.infolist():
+                if info.filename in members:
+                    fingerprint[os.path.join(archive, info.filename)] = dict(size=info.file_size, crc32=info.CRC)
+    return fingerprint
+
+
+def load_name_files(
+        filepaths: list[str],
+        read_one: Callable[[str], pd.DataFrame],
+        workers: int = None,
+        processes: bool = False,
+) -> pd.DataFrame:
+    if not filepaths:
+        # every caller needs at least one file's columns, so fail here rather than on a missing column later
+        raise FileNotFoundError('no name files found; download the SSA data first')
+    filepaths = sorted(filepaths)
+    executor_type: type[Executor] = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_type(max_workers=workers or default_workers()) as executor:
+        row_counts = np.fromiter(executor.map(_count_rows, filepaths), dtype=np.int64, count=len(filepaths))
+        offsets = np.concatenate(([0], np.cumsum(row_counts)))
+        rows_read = np.zeros(len(filepaths), dtype=np.int64)
+        columns: dict[str, np.ndarray] = {}
+
+        # copy each file into its slot of the preallocated columns as soon as it's parsed
+        futures = {executor.submit(read_one, filepath): i for i, filepath in enumerate(filepaths)}
+        for future in as_completed(futures):
+            i = futures[future]
+            df = future.result()
+            if not columns:
+                columns = {col: np.empty(offsets[-1], dtype=dtype) for col, dtype in df.dtypes.items()}
+            for col in columns:
+                columns[col][offsets[i]:offsets[i] + len(df)] = df[col].to_numpy()
+            rows_read[i] = len(df)
+
+    # blank lines are counted up front but not parsed, so drop the unused tail of those slots
+    if (rows_read != row_counts).any():
+        keep = np.concatenate([np.arange(offsets[i], offsets[i] + n) for i, n in enumerate(rows_read)])
+        columns = {col: values[keep] for col, values in columns.items()}
+    return pd.DataFrame(columns)
+
+
+def _count_rows(filepath: str) -> int:
+    with open_name_file(filepath) as f:
+        content = f.read()
+    return content.count(b'\n') + (not content.endswith(b'\n') and len(content) > 0)
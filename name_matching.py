@@ -0,0 +1,258 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+# vowels (and y) separate letters with the same digit; h and w don't, so they have no entry
+_SOUNDEX_DIGITS: dict[str, str] = {char: str(digit) for digit, chars in enumerate(
+    ('aeiouy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')) for char in chars}
+_PAIRS_PER_CHUNK: int = 2 ** 17
+_VOWELS: str = 'aeiou'
+# silent first letters, as in knight, gnome, pneuma, aesop and wright
+_METAPHONE_SILENT_STARTS: tuple[str, ...] = ('kn', 'gn', 'pn', 'ae', 'wr')
+# letters that always sound the same; the rest depend on their neighbours
+_METAPHONE_LETTERS: dict[str, str] = dict(b='B', f='F', j='J', l='L', m='M', n='N', q='K', r='R', v='F', x='KS', z='S')
+_METAPHONE_MAX_LENGTH: int = 12
+
+
+def soundex(name: str) -> str:
+    name = name.lower()
+    if not name:
+        return ''
+    digits, previous = [], _SOUNDEX_DIGITS.get(name[0])
+    for char in name[1:]:
+        if (digit := _SOUNDEX_DIGITS.get(char)) is None:
+            continue
+        if digit != previous and digit != '0':
+            digits.append(digit)
+        previous = digit
+    return (name[0].upper() + ''.join(digits) + '000')[:4]
+
+
+def metaphone(name: str) -> str:
+    # a simplified metaphone: unlike soundex it reads letters in context, so names that are spelled differently from
+    # the first letter on (Catherine and Katherine, Philip and Filip) can still sound the same
+    name = ''.join(i for i in name.lower() if 'a' <= i <= 'z')
+    if name.startswith(_METAPHONE_SILENT_STARTS):
+        name = name[1:]
+    elif name.startswith('x'):
+        name = 's' + name[1:]
+    elif name.startswith('wh'):
+        name = 'w' + name[2:]
+    key = []
+    for i, char in enumerate(name):
+        previous, following, after_next = name[i - 1:i], name[i + 1:i + 2], name[i + 2:i + 3]
+        if char == previous and char != 'c':
+            continue
+        if char in _VOWELS:
+            code = 'A' if i == 0 else ''
+        elif char in _METAPHONE_LETTERS:
+            code = '' if char == 'b' and previous == 'm' and not following else _METAPHONE_LETTERS[char]
+        elif char == 'c':
+            if following == 'h':
+                code = 'K' if previous == 's' or after_next == 'r' else 'X'
+            elif following == 'i' and after_next == 'a':
+                code = 'X'
+            else:
+                code = 'S' if following in ('i', 'e', 'y') else 'K'
+        elif char == 'd':
+            code = 'J' if following == 'g' and after_next in ('e', 'i', 'y') else 'T'
+        elif char == 'g':
+            if (following == 'h' and after_next and after_next not in _VOWELS) or (following == 'n' and not after_next):
+                code = ''
+            else:
+                code = 'J' if following in ('i', 'e', 'y') else 'K'
+        elif char == 'h':
+            code = 'H' if following in _VOWELS and following and previous not in ('c', 's', 'p', 't', 'g') else ''
+        elif char == 'k':
+            code = '' if previous == 'c' else 'K'
+        elif char == 'p':
+            code = 'F' if following == 'h' else 'P'
+        elif char == 's':
+            code = 'X' if following == 'h' or (following == 'i' and after_next in ('o', 'a')) else 'S'
+        elif char == 't':
+            if following == 'i' and after_next in ('o', 'a'):
+                code = 'X'
+            else:
+                code = '0' if following == 'h' else '' if following == 'c' and after_next == 'h' else 'T'
+        else:
+            # w and y only sound before a vowel
+            code = char.upper() if following and following in _VOWELS else ''
+        key.append(code)
+    return ''.join(key)[:_METAPHONE_MAX_LENGTH]
+
+
+class FuzzyNameIndex:
+    def __init__(self, names: pd.Index, numbers: np.ndarray, max_distance: int = 2, prefix_length: int = 7) -> None:
+        self.names = pd.Index(names)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._chars, self._lengths = _encode(self.names)
+        self._soundex = _soundex_codes(self.names)
+        self._metaphone = _metaphone_codes(self.names)
+
+        # postings are kept most popular first, so a capped candidate list keeps the likeliest names
+        by_popularity = np.argsort(-np.asarray(numbers), kind='stable')
+        self._ranks = np.empty(len(self.names), dtype=np.int64)
+        self._ranks[by_popularity] = np.arange(len(self.names))
+        self._soundex_keys, self._soundex_names = self._postings(self._soundex[:, None], by_popularity)
+        self._metaphone_keys, self._metaphone_names = self._postings(self._metaphone[:, None], by_popularity)
+
+        # symspell: two names within max_distance edits share a string made by deleting up to max_distance letters
+        # from each one's prefix, and every such string is packed into one integer
+        codes, valid = self._deletes(self._chars, self._lengths)
+        self._delete_keys, self._delete_names = self._postings(codes, by_popularity, valid)
+
+    def _postings(
+            self,
+            codes: np.ndarray,
+            by_popularity: np.ndarray,
+            valid: np.ndarray = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # codes can take up to 60 bits, so each is replaced by its position among the distinct codes before it's
+        # packed with a row
+        rows = np.broadcast_to(self._ranks[:, None], codes.shape)
+        codes, rows = (codes[valid], rows[valid]) if valid is not None else (codes.ravel(), rows.ravel())
+        uniques, dense = np.unique(codes, return_inverse=True)
+        dense, ranks = np.divmod(np.unique(_pack(dense, rows, len(self.names))), len(self.names))
+        return uniques[dense], by_popularity[ranks].astype(np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(i.nbytes for i in (
+            self._chars, self._lengths, self._soundex, self._metaphone, self._ranks, self._soundex_keys,
+            self._soundex_names, self._metaphone_keys, self._metaphone_names, self._delete_keys, self._delete_names))
+
+    def _deletes(self, chars: np.ndarray, lengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # (names, deletions) packed codes, fewest deletions first, and whether each deletion is inside the name
+        prefix = np.zeros((len(chars), self.prefix_length), dtype=np.int64)
+        prefix[:, :min(chars.shape[1], self.prefix_length)] = chars[:, :self.prefix_length]
+        prefix_lengths = np.minimum(lengths, self.prefix_length)
+        codes, valid = [], []
+        for distance in range(self.max_distance + 1):
+            for deleted in combinations(range(self.prefix_length), distance):
+                kept = np.delete(prefix, deleted, axis=1)
+                code = np.zeros(len(chars), dtype=np.int64)
+                for i in range(self.prefix_length):
+                    code = code * 32 + (kept[:, i] if i < kept.shape[1] else 0)
+                codes.append(code)
+                valid.append(prefix_lengths > (deleted[-1] if deleted else -1))
+        return np.stack(codes, axis=1), np.stack(valid, axis=1)
+
+    def match(self, names: pd.Series, max_candidates: int = 32, score_min: float = .5) -> pd.DataFrame:
+        # the known name closest to each standardized input, scored 1 for an exact match and less the more edits it
+        # took; each distinct input is matched once and examines at most max_candidates names of each kind
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+        uniques = pd.Index(uniques, dtype=object)
+        positions = self.names.get_indexer(uniques)
+        scores = np.where(positions >= 0, 1., np.nan)
+        if len(missing := np.flatnonzero((positions < 0) & (uniques.str.len() > 0))):
+            positions[missing], scores[missing] = self._nearest(uniques[missing], max_candidates, score_min)
+        matched = np.where(positions >= 0, self.names.to_numpy(dtype=object)[np.maximum(positions, 0)], None)
+        # missing inputs have code -1, which picks the no-match appended to the end
+        matched, scores = np.append(matched, None), np.append(scores, np.nan)
+        return pd.DataFrame(dict(matched_name=matched[codes], match_score=scores[codes]))
+
+    def _nearest(self, queries: pd.Index, max_candidates: int, score_min: float) -> tuple[np.ndarray, np.ndarray]:
+        chars, lengths = _encode(queries)
+        query_soundex, query_metaphone = _soundex_codes(queries), _metaphone_codes(queries)
+        delete_codes, valid = self._deletes(chars, lengths)
+        candidates = [
+            _capped_postings(self._delete_keys, self._delete_names, delete_codes, valid, max_candidates),
+            _capped_postings(self._soundex_keys, self._soundex_names, query_soundex[:, None], None, max_candidates),
+            _capped_postings(
+                self._metaphone_keys, self._metaphone_names, query_metaphone[:, None], None, max_candidates),
+        ]
+        keys = np.unique(np.concatenate([_pack(rows, found, len(self.names)) for rows, found in candidates]))
+        query_rows, name_rows = np.divmod(keys, len(self.names))
+
+        # shared deletions only bound the distance from below; lengths too far apart can't be within it
+        same_sound = (self._soundex[name_rows] == query_soundex[query_rows]) | (
+                (self._metaphone[name_rows] == query_metaphone[query_rows]) & (query_metaphone[query_rows] > 0))
+        kept = same_sound | (np.abs(lengths[query_rows] - self._lengths[name_rows]) <= self.max_distance)
+        query_rows, name_rows, same_sound = query_rows[kept], name_rows[kept], same_sound[kept]
+        distances = np.zeros(len(query_rows), dtype=np.int16)
+        for i in range(0, len(query_rows), _PAIRS_PER_CHUNK):
+            chunk = slice(i, i + _PAIRS_PER_CHUNK)
+            distances[chunk] = _edit_distances(
+                chars[query_rows[chunk]], lengths[query_rows[chunk]],
+                self._chars[name_rows[chunk]], self._lengths[name_rows[chunk]])
+        scores = 1 - distances / np.maximum(lengths[query_rows], self._lengths[name_rows])
+
+        # fewest edits first, then a name that sounds the same, then the most popular
+        keep = np.flatnonzero(((distances <= self.max_distance) | same_sound) & (scores >= score_min))
+        keep = keep[np.lexsort((
+            self._ranks[name_rows[keep]], ~same_sound[keep], distances[keep], query_rows[keep]))]
+        matched, first = np.unique(query_rows[keep], return_index=True)
+        positions, best_scores = np.full(len(queries), -1), np.full(len(queries), np.nan)
+        positions[matched], best_scores[matched] = name_rows[keep[first]], scores[keep[first]]
+        return positions, best_scores
+
+
+def _encode(names: pd.Index) -> tuple[np.ndarray, np.ndarray]:
+    # (names, letters) as 1-26, zero-padded, and each name's length
+    encoded = pd.Series(names, dtype=object).str.lower().str.encode('ascii', 'ignore')
+    lengths = encoded.str.len().to_numpy().astype(np.int64)
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    chars = np.array(encoded.tolist(), dtype=f'S{width}').view(np.uint8).reshape(len(encoded), width)
+    return np.where(chars > 0, chars - 96, 0).astype(np.uint8), lengths
+
+
+def _soundex_codes(names: pd.Index) -> np.ndarray:
+    return np.array([int(f'{ord(key[0])}{key[1:]}') if (key := soundex(i)) else 0 for i in names], dtype=np.int64)
+
+
+def _pack(high: np.ndarray, low: np.ndarray, base: int) -> np.ndarray:
+    # high * base + low as one int64, refusing rather than wrapping around when it doesn't fit
+    if len(high) and int(high.max()) >= (np.iinfo(np.int64).max - base) // max(base, 1):
+        raise OverflowError(f'{int(high.max())} * {base} does not fit in 64 bits')
+    return high.astype(np.int64) * base + low
+
+
+def _metaphone_codes(names: pd.Index) -> np.ndarray:
+    # each key's letters packed five bits apiece, with 0 for a name that has no key
+    alphabet = {char: i for i, char in enumerate('0ABFHJKLMNPRSTWXY', 1)}
+    return np.array([int(''.join(f'{alphabet[i]:05b}' for i in metaphone(name)) or '0', 2) for name in names],
+                    dtype=np.int64)
+
+
+def _capped_postings(
+        keys: np.ndarray,
+        values: np.ndarray,
+        codes: np.ndarray,
+        valid: np.ndarray | None,
+        max_candidates: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    # (query rows, values) for every code's posting list, cut off once a query has max_candidates of them; codes are
+    # in order of preference, so the lists that get cut short are the least likely ones
+    lo, hi = np.searchsorted(keys, codes, 'left'), np.searchsorted(keys, codes, 'right')
+    counts = hi - lo if valid is None else np.where(valid, hi - lo, 0)
+    taken = np.clip(max_candidates - (np.cumsum(counts, axis=1) - counts), 0, counts).ravel()
+    rows = np.repeat(np.repeat(np.arange(len(codes)), codes.shape[1]), taken)
+    offsets = np.arange(taken.sum()) - np.repeat(np.cumsum(taken) - taken, taken)
+    return rows, values[np.repeat(lo.ravel(), taken) + offsets]
+
+
+def _edit_distances(a: np.ndarray, a_lengths: np.ndarray, b: np.ndarray, b_lengths: np.ndarray) -> np.ndarray:
+    # optimal string alignment distance for every pair of rows at once, a dynamic-programming row at a time; the
+    # letters are transposed so each step reads one contiguous column
+    width_a, width_b = max(int(a_lengths.max(initial=0)), 1), max(int(b_lengths.max(initial=0)), 1)
+    a, b = np.ascontiguousarray(a[:, :width_a].T), np.ascontiguousarray(b[:, :width_b].T)
+    pairs = np.arange(a.shape[1])
+    previous = np.repeat(np.arange(width_b + 1, dtype=np.int16)[:, None], len(pairs), axis=1)
+    earlier = previous
+    distances = b_lengths.astype(np.int16)
+    for i in range(1, width_a + 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        for j in range(1, width_b + 1):
+            value = np.minimum(previous[j], current[j - 1]) + 1
+            np.minimum(value, previous[j - 1] + (a[i - 1] != b[j - 1]), out=value)
+            if i > 1 and j > 1:
+                swapped = (a[i - 1] == b[j - 2]) & (a[i - 2] == b[j - 1])
+                np.minimum(value, np.where(swapped, earlier[j - 2] + 1, value), out=value)
+            current[j] = value
+        done = a_lengths == i
+        distances[done] = current[b_lengths[done], pairs[done]]
+        earlier, previous = previous, current
+    return distances
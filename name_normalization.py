@@ -0,0 +1,33 @@
+import string
+import unicodedata
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# lowercases ascii letters and deletes every other ascii character
+_ASCII_LETTERS_ONLY: dict[int, int | None] = str.maketrans(
+    string.ascii_uppercase,
+    string.ascii_lowercase,
+    ''.join(i for i in map(chr, range(128)) if i not in string.ascii_letters),
+)
+
+
+@lru_cache(maxsize=2 ** 16)
+def standardize_name(name: str) -> str:
+    if not name.isascii():
+        # split accented letters into base letter + combining mark, then drop everything that isn't ascii
+        name = unicodedata.normalize('NFKD', name.lower()).encode('ascii', 'ignore').decode('ascii')
+    return name.translate(_ASCII_LETTERS_ONLY).title()
+
+
+def standardize_names(names: 'pd.Series') -> 'pd.Series':
+    # pandas is imported here so that code only standardizing single names doesn't pay for it
+    import numpy as np
+    import pandas as pd
+
+    # batches repeat the same names heavily, so each distinct value is only standardized once
+    codes, uniques = pd.factorize(names.astype(str))
+    standardized = np.array([standardize_name(i) for i in uniques], dtype=object)
+    return pd.Series(standardized[codes], index=names.index, dtype=object)
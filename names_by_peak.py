@@ -1,8 +1,13 @@
+import numpy as np
 import pandas as pd
 
 from core import Year, UnknownName, Displayer
+from demos import SsaSex
+from result_cache import ResultCache, cached_result
+from snapshot import fingerprint_files, fingerprints_match, read_manifest, save_frames, load_frames, load_arrays
 
 _OUTPUT_FILEPATH: str = 'data_extras/names_by_peak/data.csv'
+_SNAPSHOT_DIR: str = 'data_extras/names_by_peak/snapshot/'
 _GENDER_CATEGORY_AFTER: int = 1960
 
 
@@ -10,9 +15,10 @@ def build_gender_ratio_after_year(raw: pd.DataFrame) -> pd.DataFrame:
     ratios = pd.concat(raw.loc[raw.year >= year, ['name', 'sex', 'number']].assign(after=year) for year in range(
         _GENDER_CATEGORY_AFTER, Year.MAX_YEAR + 1, 10))
 
-    totals_by_name = ratios.groupby(['name', 'after'], as_index=False).number.sum()
+    totals_by_name = ratios.groupby(['name', 'after'], as_index=False, observed=True).number.sum()
 
-    ratios = ratios[ratios.sex == 'f'].drop(columns='sex').groupby(['name', 'after'], as_index=False).sum().merge(
+    ratios = ratios[ratios.sex == 'f'].drop(columns='sex').groupby(
+        ['name', 'after'], as_index=False, observed=True).sum().merge(
         totals_by_name, on=['name', 'after'], suffixes=('', '_total'), how='right')
     ratios.number = ratios.number.fillna(0)
 
@@ -30,29 +36,14 @@ def build_gender_ratio_after_year(raw: pd.DataFrame) -> pd.DataFrame:
         x.sort()
         return ', '.join(x)
 
-    df = ratios.groupby('name', as_index=False).agg(dict(gender=_make_sorted_string))
+    df = ratios.groupby('name', as_index=False, observed=True).agg(dict(gender=_make_sorted_string))
     return df
 
 
-def build_age_percentile_reference(age_reference: pd.DataFrame, mid_percentile: float) -> pd.DataFrame:
-    lower_percentile = .5 - mid_percentile / 2
-    upper_percentile = 1 - lower_percentile
-
-    df = age_reference[age_reference.year >= Year.DATA_QUALITY_BEST_AFTER].copy()
-    id_cols = ['name', 'sex']
-
-    df.number_living_pct = df.groupby(id_cols).number_living_pct.cumsum()
-    df['lower'] = (lower_percentile - df.number_living_pct).abs()
-    df['upper'] = (upper_percentile - df.number_living_pct).abs()
-
-    lower_and_upper_mins = df.groupby(id_cols, as_index=False)[['lower', 'upper']].min()
-    agg_cols = [*id_cols, 'lower']
-    lowers = df.merge(lower_and_upper_mins[agg_cols], on=agg_cols)
-    agg_cols = [*id_cols, 'upper']
-    uppers = df.merge(lower_and_upper_mins[agg_cols], on=agg_cols)
-    df = pd.concat((lowers, uppers)).rename(columns=dict(year='middle_lo'))
-    df['middle_hi'] = df.middle_lo.copy()
-    df = df.groupby(['name', 'sex'], as_index=False).agg(dict(middle_lo='min', middle_hi='max'))
+def build_age_percentile_reference(displayer: Displayer, mid_percentile: float) -> pd.DataFrame:
+    df = displayer.age_percentiles(Year.DATA_QUALITY_BEST_AFTER).bounds(mid_percentile).rename(
+        columns=dict(year_lower='middle_lo', year_upper='middle_hi'))
+    df = df[~df.name.isin(UnknownName.get())]
 
     df = df[df.sex == 'f'].drop(columns='sex').merge(
         df[df.sex == 'm'].drop(columns='sex'), on='name', how='outer', suffixes=('_f', '_m'))
@@ -64,23 +55,20 @@ def combine_to_create_final(displayer: Displayer, number_min: int = 1000) -> pd.
     raw: pd.DataFrame = displayer._raw
     # noinspection PyProtectedMember
     peaks: pd.DataFrame = displayer._peaks
-    # noinspection PyProtectedMember
-    age_reference: pd.DataFrame = displayer._age_reference
 
     raw_wo_unk = raw[~raw.name.isin(UnknownName.get())].copy()
     peaks_wo_unk = peaks[~peaks.name.isin(UnknownName.get())].copy()
-    age_ref_wo_unk = age_reference[~age_reference.name.isin(UnknownName.get())].copy()
 
     total_number = raw_wo_unk[raw_wo_unk.year >= Year.DATA_QUALITY_BEST_AFTER].groupby(
-        'name', as_index=False).number.sum().rename(columns=dict(number='total_usages'))
+        'name', as_index=False, observed=True).number.sum().rename(columns=dict(number='total_usages'))
 
     latest_peaks = peaks_wo_unk.rename(columns=dict(year='peak_year', rank_='peak_rank'))
     peak_cols = ['name', 'peak_year', 'peak_rank']
     latest_peaks = latest_peaks.loc[latest_peaks.sex == 'f', peak_cols].merge(
         latest_peaks.loc[latest_peaks.sex == 'm', peak_cols], on='name', how='outer', suffixes=('_f', '_m'))
 
-    age_percentile_ref1 = build_age_percentile_reference(age_ref_wo_unk, .5)
-    age_percentile_ref2 = build_age_percentile_reference(age_ref_wo_unk, .8)
+    age_percentile_ref1 = build_age_percentile_reference(displayer, .5)
+    age_percentile_ref2 = build_age_percentile_reference(displayer, .8)
     age_percentile_ref = age_percentile_ref1.merge(age_percentile_ref2, on='name', how='outer', suffixes=('50', '80'))
 
     ratios = build_gender_ratio_after_year(raw_wo_unk)
@@ -91,19 +79,103 @@ def combine_to_create_final(displayer: Displayer, number_min: int = 1000) -> pd.
     return df
 
 
-def load_final(recreate: bool = False) -> pd.DataFrame:
+class PeakTable:
+    _INTEGER_COLUMNS: tuple[str, ...] = (
+        'peak_year_f', 'peak_rank_f', 'peak_year_m', 'peak_rank_m',
+        'middle_lo_f50', 'middle_hi_f50', 'middle_lo_m50', 'middle_hi_m50',
+        'middle_lo_f80', 'middle_hi_f80', 'middle_lo_m80', 'middle_hi_m80',
+    )
+    _RANGE_COLUMNS: tuple[str, ...] = (*_INTEGER_COLUMNS, 'total_usages')
+
+    def __init__(self, df: pd.DataFrame, arrays: dict[str, np.ndarray] = None) -> None:
+        self.df = df
+        # per column, the row order that sorts it and the sorted values, so range filters are two binary searches
+        if arrays is None:
+            arrays = {}
+            for col in self._RANGE_COLUMNS:
+                order = np.argsort(df[col].to_numpy(), kind='stable').astype(np.int32)
+                arrays[f'order_{col}'] = order
+                arrays[f'sorted_{col}'] = df[col].to_numpy()[order]
+            arrays['gender_categories'], arrays['gender_bits'] = _encode_gender_categories(df.gender)
+        self.arrays = arrays
+        self._gender_bits = {i: 1 << bit for bit, i in enumerate(arrays['gender_categories'].tolist())}
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    @classmethod
+    def from_final(cls, final: pd.DataFrame) -> 'PeakTable':
+        df = final.reset_index(drop=True)
+        df = df.assign(**{col: df[col].fillna(0).astype(int) for col in cls._INTEGER_COLUMNS})
+        return cls(df)
+
+    def in_range(self, col: str, low: int = None, high: int = None, low_inclusive: bool = True) -> np.ndarray:
+        values = self.arrays[f'sorted_{col}']
+        start = 0 if low is None else np.searchsorted(values, low, 'left' if low_inclusive else 'right')
+        stop = len(values) if high is None else np.searchsorted(values, high, 'right')
+        mask = np.zeros(len(values), dtype=bool)
+        mask[self.arrays[f'order_{col}'][start:stop]] = True
+        return mask
+
+    def only_gender_categories(self, categories: tuple[str, ...]) -> np.ndarray:
+        allowed = sum(self._gender_bits.get(i, 0) for i in set(categories))
+        return (self.arrays['gender_bits'] & ~allowed) == 0
+
+
+def _encode_gender_categories(gender: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    dummies = gender.str.get_dummies(sep=', ')
+    weights = 1 << np.arange(dummies.shape[1], dtype=np.int64)
+    return np.asarray(dummies.columns, dtype=str), (dummies.to_numpy() * weights).sum(axis=1)
+
+
+def load_final(recreate: bool = False, mmap: bool = False) -> PeakTable:
     if recreate:
         displayer = Displayer()
         displayer.build_base()
         df = combine_to_create_final(displayer)
         df.to_csv(_OUTPUT_FILEPATH, index=False)
+    elif mmap:
+        return _load_final_mapped()
     else:
         df = pd.read_csv(_OUTPUT_FILEPATH)
-    return df
+    return PeakTable.from_final(df)
+
+
+def _load_final_mapped() -> PeakTable:
+    # the csv is prepared into columnar files once, then every process maps the same files
+    manifest = read_manifest(_SNAPSHOT_DIR)
+    if manifest and 'gender_bits' not in manifest['arrays']:
+        manifest = {}  # written before the table was prepared
+    if not manifest or not fingerprints_match(manifest['sources'], fingerprint_files(
+            [_OUTPUT_FILEPATH], manifest['sources'])):
+        table = PeakTable.from_final(pd.read_csv(_OUTPUT_FILEPATH))
+        save_frames(_SNAPSHOT_DIR, dict(final=table.df), dict(sources=fingerprint_files([_OUTPUT_FILEPATH])),
+                    table.arrays)
+        manifest = read_manifest(_SNAPSHOT_DIR)
+    return PeakTable(load_frames(_SNAPSHOT_DIR, manifest, mmap=True)['final'], load_arrays(
+        _SNAPSHOT_DIR, manifest, mmap=True))
+
 
+_FILTER_CACHE = ResultCache(max_entries=256)
 
-def filter_final(final: pd.DataFrame, **kwargs) -> pd.DataFrame:
-    df: pd.DataFrame = final.copy()
+
+def _filter_cache(params: dict) -> ResultCache:
+    _FILTER_CACHE.track_source(params['final'])
+    return _FILTER_CACHE
+
+
+def _drop_final_param(params: dict) -> dict:
+    return {k: v for k, v in params.items() if k != 'final'}
+
+
+def filter_cache_stats() -> dict[str, int | float]:
+    return _FILTER_CACHE.stats()
+
+
+@cached_result(_filter_cache, _drop_final_param)
+def filter_final(final: PeakTable | pd.DataFrame, **kwargs) -> pd.DataFrame:
+    table = final if isinstance(final, PeakTable) else PeakTable.from_final(final)
+    mask = np.ones(len(table), dtype=bool)
 
     year: int = kwargs.get('year')
     year_band: int = kwargs.get('yearBand')
@@ -118,40 +190,30 @@ def filter_final(final: pd.DataFrame, **kwargs) -> pd.DataFrame:
     after = year - year_band
     before = year + year_band
 
-    for integer_col in (
-            'peak_year_f', 'peak_rank_f', 'peak_year_m', 'peak_rank_m',
-            'middle_lo_f50', 'middle_hi_f50', 'middle_lo_m50', 'middle_hi_m50',
-            'middle_lo_f80', 'middle_hi_f80', 'middle_lo_m80', 'middle_hi_m80',
-    ):
-        df[integer_col] = df[integer_col].fillna(0).map(int)
-
     final_cols = {'name': 'Name', 'total_usages': f'Total {Year.DATA_QUALITY_BEST_AFTER}-{Year.MAX_YEAR}'}
 
     if use_peak:
         if sex:
-            df = df[(df[f'peak_year_{sex}'] >= after) & (df[f'peak_year_{sex}'] <= before)]
+            mask &= table.in_range(f'peak_year_{sex}', after, before)
             final_cols.update({f'peak_year_{sex}': 'Peak Year', f'peak_rank_{sex}': 'Peak Rank'})
         else:
-            df = df[
-                (df.peak_year_f >= after) & (df.peak_year_f <= before) &
-                (df.peak_year_m >= after) & (df.peak_year_m <= before)
-                ]
+            mask &= table.in_range('peak_year_f', after, before) & table.in_range('peak_year_m', after, before)
             final_cols.update({
                 'peak_year_f': 'F Peak Year', 'peak_rank_f': 'F Peak Rank',
                 'peak_year_m': 'M Peak Year', 'peak_rank_m': 'M Peak Rank',
             })
     if age_ballpark:
         if sex:
-            df = df[(df[f'middle_lo_{sex}{age_ballpark}'] <= year) & (df[f'middle_hi_{sex}{age_ballpark}'] >= year)]
+            mask &= table.in_range(f'middle_lo_{sex}{age_ballpark}', high=year)
+            mask &= table.in_range(f'middle_hi_{sex}{age_ballpark}', low=year)
             final_cols.update({
                 f'middle_lo_{sex}{age_ballpark}': 'Age Ballpark Lower',
                 f'middle_hi_{sex}{age_ballpark}': 'Age Ballpark Upper',
             })
         else:
-            df = df[
-                (df[f'middle_lo_f{age_ballpark}'] <= year) & (df[f'middle_hi_f{age_ballpark}'] >= year) &
-                (df[f'middle_lo_m{age_ballpark}'] <= year) & (df[f'middle_hi_m{age_ballpark}'] >= year)
-                ]
+            for s in SsaSex.Both:
+                mask &= table.in_range(f'middle_lo_{s}{age_ballpark}', high=year)
+                mask &= table.in_range(f'middle_hi_{s}{age_ballpark}', low=year)
             final_cols.update({
                 f'middle_lo_f{age_ballpark}': 'F Age Ballpark Lower',
                 f'middle_hi_f{age_ballpark}': 'F Age Ballpark Upper',
@@ -160,10 +222,11 @@ def filter_final(final: pd.DataFrame, **kwargs) -> pd.DataFrame:
             })
 
     if sex and never_top:
-        df = df[df[f'peak_rank_{sex}'] > never_top]
+        mask &= table.in_range(f'peak_rank_{sex}', low=never_top, low_inclusive=False)
         final_cols.update({f'peak_year_{sex}': 'Peak Year', f'peak_rank_{sex}': 'Peak Rank'})
     elif never_top:
-        df = df[(df.peak_rank_f > never_top) & (df.peak_rank_m > never_top)]
+        mask &= table.in_range('peak_rank_f', low=never_top, low_inclusive=False)
+        mask &= table.in_range('peak_rank_m', low=never_top, low_inclusive=False)
         final_cols.update({
             'peak_year_f': 'F Peak Year', 'peak_rank_f': 'F Peak Rank',
             'peak_year_m': 'M Peak Year', 'peak_rank_m': 'M Peak Rank',
@@ -172,23 +235,20 @@ def filter_final(final: pd.DataFrame, **kwargs) -> pd.DataFrame:
     final_cols.update({'gender': 'Gender Category'})
 
     if gender_category:
-        remaining_cat_from_input = df.gender.str.split(', ').map(set) - set(gender_category)
-        df = df[remaining_cat_from_input.map(len) == 0]  # you want names that had a null set
+        mask &= table.only_gender_categories(gender_category)  # you want names that had no other category
 
-    if number_low:
-        df = df[df.total_usages >= number_low]
-    if number_high:
-        df = df[df.total_usages <= number_high]
+    if number_low or number_high:
+        mask &= table.in_range('total_usages', number_low or None, number_high or None)
 
-    df = df.copy()
+    df = table.df[mask]
     # keep only the peak closest to year
-    df['year_peak_gap'] = (
+    df = df.assign(year_peak_gap=(
         (year - df[f'peak_year_{sex}']).abs() if sex else
         ((year - df.peak_year_f).abs() + (year - df.peak_year_m).abs()) / 2
-    )
+    ))
     df = df.sort_values('year_peak_gap').drop_duplicates(subset=['name'], keep='first')
     df = df.sort_values('total_usages', ascending=False)
 
-    df.total_usages = df.total_usages.map(lambda x: f'{x:,}')
+    df.total_usages = df.total_usages.map('{:,}'.format)
     df = df[final_cols.keys()].rename(columns=final_cols)
     return df
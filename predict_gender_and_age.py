@@ -1,6 +1,22 @@
+import numpy as np
 import pandas as pd
 
-from core import Year, DFAgg, Displayer, _standardize_name
+from core import Year, Displayer
+from name_normalization import standardize_names
+from result_cache import ResultCache, cached_result
+
+
+def _reference_cache(params: dict) -> ResultCache:
+    return params['displayer'].reference_cache
+
+
+def _predict_gender_reference_key(params: dict) -> dict:
+    return dict(
+        after=params['after'],
+        before=params['before'],
+        ratio_min=params['ratio_min'],
+        number_min=max(params['number_min'], 25),
+    )
 
 
 def _build_predict_gender_reference(
@@ -10,16 +26,13 @@ def _build_predict_gender_reference(
         number_min: int = 25,
         displayer: Displayer = None,
 ) -> pd.DataFrame:
-    df = displayer.calculated.copy()
-    number_min = max(number_min, 25)  # shouldn't be less than 25
+    df = displayer.counts.frame(after=after, before=before)
+    return _classify_gender(df, ratio_min, number_min)
 
-    if after:
-        df = df[df.year >= after]
-    if before:
-        df = df[df.year <= before]
-
-    df = df.groupby('name', as_index=False).agg(DFAgg.NUMBER_SUM)
 
+def _classify_gender(df: pd.DataFrame, ratio_min: float, number_min: int) -> pd.DataFrame:
+    number_min = max(number_min, 25)  # shouldn't be less than 25
+    df = df.assign(gender_prediction=None)
     df.loc[df.number_f > df.number_m, 'gender_prediction'] = 'f'
     df.loc[df.number_f < df.number_m, 'gender_prediction'] = 'm'
     df.loc[df.number_f == df.number_m, 'gender_prediction'] = 'x'
@@ -28,59 +41,116 @@ def _build_predict_gender_reference(
     ratio_m = df.number_m / df.number
     df.loc[(ratio_f < ratio_min) & (ratio_m < ratio_min), 'gender_prediction'] = 'x'
 
-    df['f_pct'] = (ratio_f * 100).round().map(int)
-    df['m_pct'] = (ratio_m * 100).round().map(int)
+    df['f_pct'] = (ratio_f * 100).round().astype(int)
+    df['m_pct'] = (ratio_m * 100).round().astype(int)
 
     df.loc[df.number < number_min, 'gender_prediction'] = 'rare'
     df.gender_prediction = df.gender_prediction.fillna('unk')
     return df[['name', 'gender_prediction', 'f_pct', 'm_pct']]
 
 
+@cached_result(_reference_cache, _predict_gender_reference_key)
+def _get_predict_gender_reference(
+        after: int = Year.DATA_QUALITY_BEST_AFTER,
+        before: int = None,
+        ratio_min: float = .8,
+        number_min: int = 25,
+        displayer: Displayer = None,
+) -> pd.DataFrame:
+    reference = _build_predict_gender_reference(after, before, ratio_min, number_min, displayer)
+    return reference.rename(columns=dict(name='matched_name')).set_index('matched_name')
+
+
+def _get_living_predict_gender_reference(
+        names: pd.Series,
+        after: int = Year.DATA_QUALITY_BEST_AFTER,
+        before: int = None,
+        year: int = None,
+        ratio_min: float = .8,
+        number_min: int = 25,
+        displayer: Displayer = None,
+) -> pd.DataFrame:
+    # only the batch's own names, each answered from its cumulative living counts, so any window costs the same
+    names = pd.Series(names.unique())
+    numbers = displayer.actuarial_counts().window(names, year, after, before, living=True)
+    df = pd.DataFrame(dict(name=names, number=numbers.sum(axis=1), number_f=numbers[:, 0], number_m=numbers[:, 1]))
+    reference = _classify_gender(df[df.number > 0], ratio_min, number_min)
+    return reference.rename(columns=dict(name='matched_name')).set_index('matched_name')
+
+
+def warm_predict_gender_reference(displayer: Displayer) -> None:
+    _get_predict_gender_reference(displayer=displayer)
+    displayer.actuarial_counts()
+    return
+
+
 def predict_gender_batch(data: list[dict], **kwargs) -> list[dict]:
     df = pd.DataFrame(data)
     if 'name' not in df.columns:
         return []
-    df = df.dropna(subset=['name'])
-    df['matched_name'] = df.name.astype(str).map(_standardize_name)
+    return predict_gender_frame(df, **kwargs).to_dict('records')
+
+
+def _match_fuzzy(df: pd.DataFrame, displayer: Displayer) -> pd.DataFrame:
+    # inputs that aren't known names take the closest one that is, and keep their own when nothing is close enough
+    matches = displayer.fuzzy_names().match(df.matched_name)
+    matched_name = np.where(matches.matched_name.isna(), df.matched_name, matches.matched_name)
+    return df.assign(matched_name=matched_name, match_score=matches.match_score.to_numpy())
 
-    reference = _build_predict_gender_reference(**kwargs)
-    df = df.merge(reference.rename(columns=dict(name='matched_name')), on='matched_name', how='left')
+
+def predict_gender_frame(
+        df: pd.DataFrame,
+        living: bool = False,
+        year: int = None,
+        fuzzy: bool = False,
+        **kwargs,
+) -> pd.DataFrame:
+    df = df.dropna(subset=['name'])
+    df = df.assign(matched_name=standardize_names(df.name))
+    if fuzzy:
+        df = _match_fuzzy(df, kwargs['displayer'])
+
+    if living:
+        reference = _get_living_predict_gender_reference(df.matched_name, year=year, **kwargs)
+    else:
+        reference = _get_predict_gender_reference(**(dict(kwargs, after=year, before=year) if year else kwargs))
+    df = df.join(reference, on='matched_name')
     df.gender_prediction = df.gender_prediction.fillna('unk')
-    return df.to_dict('records')
-
-
-def _create_age_reference_for_mid_percentile(displayer: Displayer, mid_percentile: float) -> pd.DataFrame:
-    lower_percentile = .5 - mid_percentile / 2
-    upper_percentile = 1 - lower_percentile
-    # noinspection PyProtectedMember
-    age_reference: pd.DataFrame = displayer._age_reference.copy()
-    id_cols = ['name', 'sex']
-
-    df = age_reference[age_reference.year >= Year.DATA_QUALITY_BEST_AFTER].copy()
-    df.number_living_pct = df.groupby(id_cols).number_living_pct.cumsum()
-    df['lower'] = (lower_percentile - df.number_living_pct).abs()
-    df['upper'] = (upper_percentile - df.number_living_pct).abs()
-
-    lower_and_upper_mins = df.groupby(id_cols, as_index=False)[['lower', 'upper']].min()
-    agg_cols = [*id_cols, 'lower']
-    lowers = df.merge(lower_and_upper_mins[agg_cols], on=agg_cols)
-    agg_cols = [*id_cols, 'upper']
-    uppers = df.merge(lower_and_upper_mins[agg_cols], on=agg_cols)
-    df = pd.concat((lowers, uppers)).rename(columns=dict(year='year_lower'))
-    df['year_upper'] = df.year_lower.copy()
-    df = df.groupby(id_cols, as_index=False).agg(dict(year_lower='min', year_upper='max'))
     return df
 
 
-def predict_age_batch(displayer: Displayer, mid_percentile: float, data: list[dict[str, str]]) -> list[dict]:
+def warm_predict_age_reference(displayer: Displayer, mid_percentile: float = .68) -> None:
+    displayer.age_percentiles(Year.DATA_QUALITY_BEST_AFTER).bounds(mid_percentile)
+    return
+
+
+def predict_age_batch(
+        displayer: Displayer,
+        mid_percentile: float,
+        data: list[dict[str, str]],
+        fuzzy: bool = False,
+) -> list[dict]:
     names = pd.DataFrame(data)
     if 'name' not in names.columns or 'sex' not in names.columns:
         return []
-    names = names.dropna()
-    names['matched_name'] = names.name.astype(str).map(_standardize_name)
-    names['matched_sex'] = names.sex.astype(str).str.lower()
-
-    df = _create_age_reference_for_mid_percentile(displayer, mid_percentile)
-    df = names.merge(df, left_on=['matched_name', 'matched_sex'], right_on=['name', 'sex'], how='left', suffixes=(
-        '', '_ref')).drop(columns=['name_ref', 'sex_ref'])
-    return df.to_dict('records')
+    return predict_age_frame(displayer, mid_percentile, names, fuzzy).to_dict('records')
+
+
+def predict_age_frame(
+        displayer: Displayer,
+        mid_percentile: float,
+        names: pd.DataFrame,
+        fuzzy: bool = False,
+        after: int = Year.DATA_QUALITY_BEST_AFTER,
+) -> pd.DataFrame:
+    # a row may carry its own mid_percentile; the argument is the default
+    if 'mid_percentile' in names.columns:
+        names = names.assign(mid_percentile=names.mid_percentile.fillna(mid_percentile))
+    names = names.dropna().reset_index(drop=True)
+    names = names.assign(matched_name=standardize_names(names.name), matched_sex=names.sex.astype(str).str.lower())
+    if fuzzy:
+        names = _match_fuzzy(names, displayer)
+
+    years = displayer.age_percentiles(after).predict(
+        names.matched_name, names.matched_sex, names.get('mid_percentile', mid_percentile))
+    return names.assign(year_lower=years.year_lower, year_upper=years.year_upper)
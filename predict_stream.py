@@ -0,0 +1,132 @@
+import argparse
+import os
+import sys
+from typing import IO, Callable, Iterator
+
+import pandas as pd
+
+from core import Displayer
+from predict_gender_and_age import predict_gender_frame, predict_age_frame
+
+CHUNK_SIZE: int = 100_000
+
+
+class StreamFormat:
+    CSV: str = 'csv'
+    JSONL: str = 'jsonl'
+
+    @classmethod
+    def from_filepath(cls, filepath: str, default: str = JSONL) -> str:
+        extension = os.path.splitext(filepath)[1].lstrip('.').lower()
+        return {cls.CSV: cls.CSV, cls.JSONL: cls.JSONL, 'ndjson': cls.JSONL}.get(extension, default)
+
+
+def parse_flag(value: str | bool | int | None) -> bool:
+    # query strings and json bodies both send flags, as true, 1 or "false" alike
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+class Predictor:
+    GENDER: str = 'gender'
+    AGE: str = 'age'
+    REQUIRED_COLUMNS: dict[str, tuple[str, ...]] = {GENDER: ('name',), AGE: ('name', 'sex')}
+    PARAMETERS: dict[str, dict[str, Callable[[str], object]]] = {
+        GENDER: dict(
+            after=int, before=int, year=int, ratio_min=float, number_min=int, living=parse_flag, fuzzy=parse_flag),
+        AGE: dict(mid_percentile=float, fuzzy=parse_flag),
+    }
+    # missing matches would otherwise turn these into floats in some chunks and not others
+    INTEGER_COLUMNS: tuple[str, ...] = ('f_pct', 'm_pct', 'year_lower', 'year_upper')
+
+
+def read_chunks(file: IO, fmt: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    # nothing is read until the first chunk is asked for, so bad input fails there rather than when the stream is set up
+    if fmt == StreamFormat.CSV:
+        # names like "Na" or "Null" are names, not missing values
+        yield from pd.read_csv(file, dtype=str, keep_default_na=False, na_values=[''], chunksize=chunk_size)
+        return
+    if fmt == StreamFormat.JSONL:
+        yield from pd.read_json(file, lines=True, dtype=False, chunksize=chunk_size)
+        return
+    raise ValueError(f'unsupported format `{fmt}`')
+
+
+def predict_chunks(
+        chunks: Iterator[pd.DataFrame],
+        predictor: str,
+        displayer: Displayer,
+        **kwargs,
+) -> Iterator[pd.DataFrame]:
+    for chunk in chunks:
+        if missing := [i for i in Predictor.REQUIRED_COLUMNS[predictor] if i not in chunk.columns]:
+            raise ValueError(f'input is missing column(s) {", ".join(f"`{i}`" for i in missing)}')
+        if predictor == Predictor.GENDER:
+            df = predict_gender_frame(chunk, displayer=displayer, **kwargs)
+        else:
+            df = predict_age_frame(displayer, kwargs.get('mid_percentile', .68), chunk, kwargs.get('fuzzy', False))
+        integer_cols = [i for i in Predictor.INTEGER_COLUMNS if i in df.columns]
+        yield df.astype({i: 'Int64' for i in integer_cols})
+    return
+
+
+def write_chunks(frames: Iterator[pd.DataFrame], fmt: str) -> Iterator[str]:
+    header = True
+    for df in frames:
+        if not len(df):
+            continue
+        if fmt == StreamFormat.CSV:
+            yield df.to_csv(index=False, header=header)
+            header = False
+        else:
+            yield df.to_json(orient='records', lines=True, force_ascii=False)
+    return
+
+
+def stream_predictions(
+        file: IO,
+        predictor: str,
+        displayer: Displayer,
+        input_format: str,
+        output_format: str = None,
+        chunk_size: int = CHUNK_SIZE,
+        **kwargs,
+) -> Iterator[str]:
+    chunks = read_chunks(file, input_format, chunk_size)
+    return write_chunks(predict_chunks(chunks, predictor, displayer, **kwargs), output_format or input_format)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('predictor', choices=[Predictor.GENDER, Predictor.AGE])
+    parser.add_argument('input', help='csv or jsonl file, or - for stdin')
+    parser.add_argument('-o', '--output', default='-', help='csv or jsonl file, or - for stdout')
+    parser.add_argument('--input-format', choices=[StreamFormat.CSV, StreamFormat.JSONL])
+    parser.add_argument('--output-format', choices=[StreamFormat.CSV, StreamFormat.JSONL])
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--after', type=int)
+    parser.add_argument('--before', type=int)
+    parser.add_argument('--year', type=int)
+    parser.add_argument('--ratio-min', type=float)
+    parser.add_argument('--number-min', type=int)
+    parser.add_argument('--mid-percentile', type=float)
+    parser.add_argument('--living', action='store_true', default=None, help='count only people still living')
+    parser.add_argument('--fuzzy', action='store_true', default=None, help='match unknown names to the closest known')
+    args = parser.parse_args()
+
+    input_format = args.input_format or StreamFormat.from_filepath(args.input)
+    output_format = args.output_format or StreamFormat.from_filepath(args.output, input_format)
+    kwargs = {k: v for k in Predictor.PARAMETERS[args.predictor] if (v := getattr(args, k)) is not None}
+
+    displayer = Displayer()
+    displayer.build_base()
+    infile = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    with infile, outfile:
+        for text in stream_predictions(
+                infile, args.predictor, displayer, input_format, output_format, args.chunk_size, **kwargs):
+            outfile.write(text)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -1,80 +1,237 @@
+import functools
+import json
+import os
+import threading
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
-from time import sleep
+from typing import Callable
 
 import pandas as pd
-from requests import Session
+from requests import HTTPError, Session
+from requests.adapters import HTTPAdapter
 
-from core import Filepath, build_all_generated_data
+from core import Filepath, Year, build_all_generated_data
+
+CHUNK_SIZE: int = 2 ** 20
+_DOWNLOAD_STATE_FILEPATH: str = Filepath.DATA_DIR + 'downloads.json'
+
+
+class SsaUrl:
+    BASE: str = 'https://www.ssa.gov/oact/'
+    NAME_DATA: tuple[str, ...] = (
+        'babynames/names.zip',
+        'babynames/state/namesbystate.zip',
+        'babynames/territory/namesbyterritory.zip',
+    )
+    APPLICANTS: str = 'babynames/numberUSbirths.html'
+    ACTUARIAL: str = 'HistEst/CohLifeTables/{0}/CohLifeTables_{1}_Alt2_TR{0}.txt'
 
 
 class SsaDataDownloader:
-    def __init__(self, max_year: int) -> None:
+    def __init__(
+            self,
+            max_year: int,
+            base_url: str = SsaUrl.BASE,
+            workers: int = 3,
+            chunk_size: int = CHUNK_SIZE,
+            extract: bool = False,
+    ) -> None:
         self._max_year: int = max_year
+        self._base_url: str = base_url.rstrip('/') + '/'
+        self._workers: int = workers
+        self._chunk_size: int = chunk_size
+        # the builders read the archives directly, so extracting them is only needed for other tools
+        self._extract: bool = extract
+        self._state: dict[str, dict] = {}
+        self._state_lock = threading.Lock()
+        self.bytes_downloaded: int = 0
+        self.changed: list[str] = []
 
     def download(self) -> None:
         self._open_session()
-        self._download_name_data()
-        self._download_applicants_data()
-        self._download_actuarial_data()
-        self._close_session()
+        self._state = _read_download_state()
+        try:
+            # a small pool instead of fixed sleeps: ssa.gov is only ever asked for a few files at once
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                futures = [
+                    *(executor.submit(self._download_name_data, url) for url in SsaUrl.NAME_DATA),
+                    executor.submit(self._download_applicants_data),
+                    *(executor.submit(self._download_actuarial_data, s) for s in ('F', 'M')),
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            self._close_session()
         return
 
     def _open_session(self) -> None:
         self._session: Session = Session()
         self._session.headers.update({'User-Agent': f'name-finder/{self._max_year - 1} Update'})
+        self._session.mount('https://', HTTPAdapter(pool_maxsize=self._workers))
+        self._session.mount('http://', HTTPAdapter(pool_maxsize=self._workers))
         return
 
     def _close_session(self) -> None:
         self._session.close()
         return
 
-    def _download_name_data(self) -> None:
-        for url in (
-                'https://www.ssa.gov/oact/babynames/names.zip',
-                'https://www.ssa.gov/oact/babynames/state/namesbystate.zip',
-                'https://www.ssa.gov/oact/babynames/territory/namesbyterritory.zip',
-        ):
-            filepath = Filepath.DATA_DIR + url.rsplit('/', 1)[1]
-            with open(filepath, 'wb') as f:
-                response = self._session.get(url)
-                for chunk in response.iter_content(chunk_size=128):
-                    f.write(chunk)
-            sleep(3)
-            with zipfile.ZipFile(filepath) as z:
-                z.extractall(filepath[:-4])
+    def _fetch(
+            self,
+            url: str,
+            filepath: str,
+            process: Callable[[str], None] = None,
+            missing_ok: bool = False,
+    ) -> bool:
+        # returns whether filepath was replaced; an unchanged file costs one conditional request and no body
+        known = self._state.get(url, {})
+        partial_filepath = filepath + '.part'
+        headers = {}
+        if os.path.exists(filepath):
+            if known.get('etag'):
+                headers['If-None-Match'] = known['etag']
+            if known.get('last_modified'):
+                headers['If-Modified-Since'] = known['last_modified']
+        resume_from = os.path.getsize(partial_filepath) if os.path.exists(partial_filepath) else 0
+        if resume_from and known.get('partial'):
+            # If-Range makes the server send the whole file instead if it changed since the partial was started
+            headers.update({'Range': f'bytes={resume_from}-', 'If-Range': known['partial']})
+
+        with self._session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return False
+            if response.status_code == 416:
+                # the partial file is already as long as the file, or longer, so start over
+                os.remove(partial_filepath)
+                return self._fetch(url, filepath, process, missing_ok)
+            if missing_ok and not response.ok:
+                return False
+            response.raise_for_status()
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            resumed = response.status_code == 206
+            if resumed and not response.headers.get('Content-Range', '').startswith(f'bytes {resume_from}-'):
+                # a range that doesn't start where the partial file ends can't be appended to it
+                if not resume_from:
+                    raise HTTPError(f'unexpected partial response for {url}', response=response)
+                os.remove(partial_filepath)
+                return self._fetch(url, filepath, process, missing_ok)
+            if not resumed:
+                self._update_download_state(url, dict(known, partial=etag or last_modified))
+            nbytes = 0
+            try:
+                with open(partial_filepath, 'ab' if resumed else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self._chunk_size):
+                        f.write(chunk)
+                        nbytes += len(chunk)
+            finally:
+                self._count_bytes(nbytes)
+
+        os.replace(partial_filepath, filepath)
+        # the validators are only kept once the file is processed, so a failure is retried on the next run
+        if process:
+            process(filepath)
+        self._update_download_state(url, dict(etag=etag, last_modified=last_modified))
+        self.changed.append(filepath)
+        return True
+
+    def _count_bytes(self, nbytes: int) -> None:
+        with self._state_lock:
+            self.bytes_downloaded += nbytes
+        return
+
+    def _update_download_state(self, url: str, entry: dict) -> None:
+        with self._state_lock:
+            self._state[url] = entry
+            _write_download_state(self._state)
+        return
+
+    def _download_name_data(self, url: str) -> None:
+        filepath = Filepath.DATA_DIR + url.rsplit('/', 1)[1]
+        if not self._extract:
+            self._fetch(self._base_url + url, filepath)
+            return
+        extract = lambda x: _extract_changed_members(x, x[:-4], self._chunk_size)
+        if not self._fetch(self._base_url + url, filepath, extract) and not os.path.isdir(filepath[:-4]):
+            extract(filepath)
         return
 
     def _download_applicants_data(self) -> None:
-        response = self._session.get('https://www.ssa.gov/oact/babynames/numberUSbirths.html')
-        html = StringIO(response.text)
-        table = pd.read_html(html)[0]
-        table = table.rename(columns=dict((col, ''.join(col.split())) for col in table.columns)).rename(columns=dict(
-            Yearofbirth='year', Male='number_m', Female='number_f', Total='number'))
-        table.to_csv(Filepath.APPLICANTS_DATA, index=False)
+        filepath = Filepath.DATA_DIR + SsaUrl.APPLICANTS.rsplit('/', 1)[1]
+        self._fetch(self._base_url + SsaUrl.APPLICANTS, filepath, _convert_applicants_data)
         return
 
-    def _download_actuarial_data(self) -> None:
-        url = 'https://www.ssa.gov/oact/HistEst/CohLifeTables/{0}/CohLifeTables_{1}_Alt2_TR{0}.txt'
-        columns = {'Year': 'year', 'x': 'age', 'l(x)': 'survivors'}
-        for s in ('F', 'M'):
-            response = self._session.get(url.format(self._max_year + 1, s))
-            if not response.ok:
-                return
-            sleep(3)
-            lines = [line.split() for line in response.text.splitlines()]
-            df = pd.DataFrame(lines[6:], columns=lines[5])
-            df = df[list(columns.keys())].rename(columns=columns)
-            for col in df.columns:
-                df[col] = df[col].map(int)
-            df.to_csv(Filepath.ACTUARIAL.format(sex=s.lower()), index=False)
+    def _download_actuarial_data(self, s: str) -> None:
+        url = SsaUrl.ACTUARIAL.format(self._max_year + 1, s)
+        # tables for the next trustees report aren't always published yet
+        self._fetch(self._base_url + url, Filepath.DATA_DIR + url.rsplit('/', 1)[1], functools.partial(
+            _convert_actuarial_data, s=s), missing_ok=True)
         return
 
 
+def _convert_applicants_data(filepath: str) -> None:
+    with open(filepath, encoding='utf-8') as f:
+        html = StringIO(f.read())
+    table = pd.read_html(html)[0]
+    table = table.rename(columns=dict((col, ''.join(col.split())) for col in table.columns)).rename(columns=dict(
+        Yearofbirth='year', Male='number_m', Female='number_f', Total='number'))
+    table.to_csv(Filepath.APPLICANTS_DATA, index=False)
+    return
+
+
+def _convert_actuarial_data(filepath: str, s: str) -> None:
+    columns = {'Year': 'year', 'x': 'age', 'l(x)': 'survivors'}
+    with open(filepath) as f:
+        lines = [line.split() for line in f.read().splitlines()]
+    df = pd.DataFrame(lines[6:], columns=lines[5])
+    df = df[list(columns.keys())].rename(columns=columns)
+    df = df.astype(int)
+    df.to_csv(Filepath.ACTUARIAL.format(sex=s.lower()), index=False)
+    return
+
+
+def _read_download_state() -> dict[str, dict]:
+    try:
+        with open(_DOWNLOAD_STATE_FILEPATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_download_state(state: dict[str, dict]) -> None:
+    with open(_DOWNLOAD_STATE_FILEPATH + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(_DOWNLOAD_STATE_FILEPATH + '.tmp', _DOWNLOAD_STATE_FILEPATH)
+    return
+
+
+def _extract_changed_members(filepath: str, directory: str, chunk_size: int = CHUNK_SIZE) -> None:
+    # members already on disk with the same size and crc are left alone, so their mtimes (and the hashes the
+    # snapshot keeps for them) stay valid
+    with zipfile.ZipFile(filepath) as z:
+        for member in z.infolist():
+            target = os.path.join(directory, member.filename)
+            if member.is_dir() or _matches_member(target, member, chunk_size):
+                continue
+            z.extract(member, directory)
+    return
+
+
+def _matches_member(filepath: str, member: zipfile.ZipInfo, chunk_size: int) -> bool:
+    if not os.path.isfile(filepath) or os.path.getsize(filepath) != member.file_size:
+        return False
+    crc = 0
+    with open(filepath, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            crc = zlib.crc32(chunk, crc)
+    return crc == member.CRC
+
+
 def main() -> None:
     downloader = SsaDataDownloader(2025)
     downloader.download()
-    build_all_generated_data()
+    Year.MAX_YEAR = None  # a new year may have just been downloaded
+    build_all_generated_data(incremental=True)
     return
 
 
@@ -0,0 +1,138 @@
+import copy
+import functools
+import inspect
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import pandas as pd
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 2 ** 20, copy_results: bool = True) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.copy_results = copy_results
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._source: object = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        # callers are free to mutate what they get back, so the cached value itself is never handed out
+        if entry is not None:
+            return copy.deepcopy(entry[0]) if self.copy_results else entry[0]
+
+        value = compute()
+        nbytes = _estimate_nbytes(value)
+        if self.max_entries and nbytes <= self.max_bytes:
+            with self._lock:
+                self._store(key, copy.deepcopy(value) if self.copy_results else value, nbytes)
+        return value
+
+    def _store(self, key: Hashable, value: Any, nbytes: int) -> None:
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+            self.nbytes -= self._entries.popitem(last=False)[1][1]
+            self.evictions += 1
+        return
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        return
+
+    def track_source(self, source: object) -> None:
+        # results computed from one object are stale once callers switch to another one; the object itself is kept,
+        # since a new one could otherwise reuse a freed one's id
+        if source is not self._source:
+            self.clear()
+            self._source = source
+        return
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return dict(
+            entries=len(self._entries),
+            max_entries=self.max_entries,
+            bytes=self.nbytes,
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=round(self.hits / lookups, 3) if lookups else 0.,
+        )
+
+
+def cached_result(
+        get_cache: Callable[..., ResultCache],
+        normalize: Callable[[dict], dict] = None,
+        uncached_if: tuple[str, ...] = (),
+) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            params = dict(arguments.arguments)
+            cache = get_cache(params)
+            params.pop('self', None)
+            key = _make_key(func.__name__, normalize(params) if normalize else params, uncached_if)
+            if key is None:
+                return func(*args, **kwargs)
+            return cache.get_or_compute(key, lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+def _make_key(func_name: str, params: dict, uncached_if: tuple[str, ...]) -> tuple | None:
+    if any(params.get(i) for i in uncached_if):
+        return None
+    key = (func_name, *((k, _canonicalize(v)) for k, v in sorted(params.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _canonicalize(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonicalize(i) for i in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _canonicalize(v)) for k, v in value.items()))
+    return value
+
+
+def _estimate_nbytes(value: Any) -> int:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_estimate_nbytes(k) + _estimate_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_estimate_nbytes(i) for i in value)
+    if isinstance(nbytes := getattr(value, 'nbytes', None), int):
+        return nbytes
+    return sys.getsizeof(value)
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_VERSION: int = 4
+_MANIFEST_FILENAME: str = 'manifest.json'
+_INDEX_COLUMN: str = '__index__'
+_ARRAYS_DIRNAME: str = '__arrays__'
+# where fcntl is missing the lock is a file that exists while it's held; publishing only takes a couple of renames, so
+# one held this long was left by a worker that died
+_STALE_LOCK_SECONDS: float = 60.
+_LOCK_POLL_SECONDS: float = .01
+
+
+def fingerprint_files(filepaths: list[str], previous: dict[str, dict] = None) -> dict[str, dict]:
+    previous = previous or {}
+    fingerprint = {}
+    for filepath in sorted(filepaths):
+        stat = os.stat(filepath)
+        entry = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        known = previous.get(filepath, {})
+        if known.get('size') == entry['size'] and known.get('mtime_ns') == entry['mtime_ns']:
+            entry['sha256'] = known['sha256']
+        else:
+            with open(filepath, 'rb') as f:
+                entry['sha256'] = hashlib.file_digest(f, 'sha256').hexdigest()
+        fingerprint[filepath] = entry
+    return fingerprint
+
+
+def changed_fingerprints(a: dict[str, dict], b: dict[str, dict]) -> set[str]:
+    # members of an archive carry the crc32 the archive records for them instead of a sha256
+    digest = lambda entry: entry.get('sha256', entry.get('crc32'))
+    return {k for k in a.keys() | b.keys() if k not in a or k not in b or digest(a[k]) != digest(b[k])}
+
+
+def fingerprints_match(a: dict[str, dict], b: dict[str, dict]) -> bool:
+    return not changed_fingerprints(a, b)
+
+
+def read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, _MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return {}
+    return manifest
+
+
+def save_frames(
+        directory: str,
+        frames: dict[str, pd.DataFrame],
+        manifest: dict,
+        arrays: dict[str, np.ndarray] = None,
+) -> bool:
+    # returns whether this call published the snapshot; when another worker already published the same build, its copy
+    # is kept and this one is dropped
+    directory = directory.rstrip('/')
+    arrays = arrays or {}
+    build = json.loads(json.dumps(dict(manifest, arrays=list(arrays))))
+    # several workers may build at once, so each one stages separately and the first to finish wins
+    staging = f'{directory}.tmp{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(os.path.join(staging, _ARRAYS_DIRNAME))
+
+    for array_name, values in arrays.items():
+        np.save(os.path.join(staging, _ARRAYS_DIRNAME, array_name + '.npy'), values)
+
+    manifest = dict(manifest, version=SNAPSHOT_VERSION, frames={}, arrays=list(arrays))
+    for frame_name, df in frames.items():
+        frame_dir = os.path.join(staging, frame_name)
+        os.makedirs(frame_dir)
+        columns = {}
+        if not isinstance(df.index, pd.RangeIndex):
+            df = df.assign(**{_INDEX_COLUMN: df.index.to_numpy()})
+        for col in df.columns:
+            columns[col] = _save_column(frame_dir, col, df[col])
+        manifest['frames'][frame_name] = dict(rows=len(df), columns=columns)
+
+    with open(os.path.join(staging, _MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    retired = f'{directory}.old{os.getpid()}'
+    with _exclusive_lock(directory + '.lock'):
+        published = read_manifest(directory)
+        if published and all(published.get(k) == v for k, v in build.items()):
+            # other workers may be mapping the published copy, so it's never touched
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+        # only a stale snapshot gets replaced; nothing maps one after checking it, and files that were already mapped
+        # stay readable once they're unlinked
+        if os.path.exists(directory):
+            os.rename(directory, retired)
+        os.rename(staging, directory)
+    shutil.rmtree(retired, ignore_errors=True)
+    return True
+
+
+@contextmanager
+def _exclusive_lock(filepath: str) -> Iterator[None]:
+    try:
+        import fcntl  # posix only
+    except ImportError:
+        with _lock_file(filepath):
+            yield
+        return
+    with open(filepath, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return
+
+
+@contextmanager
+def _lock_file(filepath: str) -> Iterator[None]:
+    # held by whoever created the file; one left behind by a worker that died long ago is broken
+    while True:
+        try:
+            os.close(os.open(filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(filepath).st_mtime > _STALE_LOCK_SECONDS:
+                    os.remove(filepath)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(_LOCK_POLL_SECONDS)
+    try:
+        yield
+    finally:
+        os.remove(filepath)
+    return
+
+
+def load_frames(directory: str, manifest: dict, mmap: bool = False) -> dict[str, pd.DataFrame]:
+    frames = {}
+    dtypes: list[pd.CategoricalDtype] = []
+    for frame_name, frame_meta in manifest['frames'].items():
+        frame_dir = os.path.join(directory, frame_name)
+        data = {col: _load_column(frame_dir, col, kind, dtypes, mmap) for col, kind in frame_meta['columns'].items()}
+        index = data.pop(_INDEX_COLUMN, None)
+        # consolidating columns into blocks would copy the mapped arrays into private memory
+        frames[frame_name] = pd.DataFrame(data, index=index, copy=not mmap)
+    return frames
+
+
+def load_arrays(directory: str, manifest: dict, mmap: bool = False) -> dict[str, np.ndarray]:
+    return {array_name: np.load(
+        os.path.join(directory, _ARRAYS_DIRNAME, array_name + '.npy'), mmap_mode='r' if mmap else None,
+    ) for array_name in manifest['arrays']}
+
+
+def _save_column(frame_dir: str, col: str, series: pd.Series) -> str:
+    filepath = os.path.join(frame_dir, col)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # codes keep pandas' own width, so mapped codes can back a Categorical without a copy
+        np.save(filepath + '.codes.npy', series.cat.codes.to_numpy())
+        np.save(filepath + '.categories.npy', np.asarray(series.cat.categories, dtype=str))
+        return 'category'
+    if series.dtype == object:
+        codes, categories = pd.factorize(series)
+        np.save(filepath + '.codes.npy', codes.astype(np.int32))
+        np.save(filepath + '.categories.npy', np.asarray(categories, dtype=str))
+        return 'object'
+    np.save(filepath + '.npy', series.to_numpy())
+    return 'numeric'
+
+
+def _load_column(
+        frame_dir: str,
+        col: str,
+        kind: str,
+        dtypes: list[pd.CategoricalDtype],
+        mmap: bool = False,
+) -> np.ndarray | pd.Categorical:
+    filepath = os.path.join(frame_dir, col)
+    mmap_mode = 'r' if mmap else None
+    if kind == 'numeric':
+        return np.load(filepath + '.npy', mmap_mode=mmap_mode)
+    categories = np.load(filepath + '.categories.npy')
+    # columns that were saved with the same categories share one dtype again after loading
+    dtype = next((i for i in dtypes if np.array_equal(i.categories, categories)), None)
+    if dtype is None:
+        dtype = pd.CategoricalDtype(categories)
+        dtypes.append(dtype)
+    values = pd.Categorical.from_codes(np.load(filepath + '.codes.npy', mmap_mode=mmap_mode), dtype=dtype)
+    if kind == 'category':
+        return values
+    return np.asarray(values, dtype=object)
@@ -0,0 +1,100 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import core_state
+from core import Filepath
+
+# (state, sex, year, name, number) rows; Yadiel is only ever given in a territory
+_ROWS: list[tuple[str, str, int, str, int]] = [
+    ('CA', 'F', 2000, 'Mary', 50), ('CA', 'M', 2000, 'John', 40), ('CA', 'F', 2001, 'Maria', 30),
+    ('NY', 'F', 2000, 'Mary', 20), ('NY', 'M', 2001, 'John', 60), ('NY', 'F', 2001, 'Maria', 5),
+    ('TX', 'M', 2000, 'Jose', 70), ('TX', 'F', 2001, 'Maria', 45),
+    ('PR', 'M', 2000, 'Jose', 80), ('PR', 'F', 2001, 'Maria', 90), ('PR', 'M', 2001, 'Yadiel', 25),
+    ('GU', 'F', 2000, 'Mary', 8),
+]
+_TERRITORIES: tuple[str, ...] = ('GU', 'PR')
+
+
+@pytest.fixture(scope='module')
+def displayer(tmp_path_factory) -> core_state.StateDisplayer:
+    directory = tmp_path_factory.mktemp('names')
+    for area in ('states', 'territories'):
+        os.makedirs(directory / area)
+    df = pd.DataFrame(_ROWS, columns=['state', 'sex', 'year', 'name', 'number'])
+    for state, rows in df.groupby('state'):
+        area = 'territories' if state in _TERRITORIES else 'states'
+        rows.to_csv(directory / area / f'{state}.TXT', header=False, index=False)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(core_state.StateFilepath, 'NAME_DATA_DIR', f'{directory}/states/')
+        monkeypatch.setattr(core_state.StateFilepath, 'NAME_DATA_ARCHIVE', '')
+        monkeypatch.setattr(Filepath, 'TERRITORIES_DATA_DIR', f'{directory}/territories/')
+        monkeypatch.setattr(Filepath, 'TERRITORIES_DATA_ARCHIVE', '')
+        displayer = core_state.StateDisplayer()
+        displayer.build_base()
+    return displayer
+
+
+def _numbers(df: pd.DataFrame) -> dict[str, int]:
+    return df.set_index('name').number.astype(int).to_dict()
+
+
+def test_default_selection_is_every_state_but_no_territory(displayer) -> None:
+    assert displayer.territories == _TERRITORIES
+    counts, code = displayer._select()
+    assert counts is displayer._all_states_counts
+    assert _numbers(displayer.search(top=None)) == dict(Maria=80, John=100, Mary=70, Jose=70)
+    # naming every state is the same selection
+    assert displayer._select(('ca', 'NY', 'TX'))[0] is displayer._all_states_counts
+
+
+def test_merged_selections_are_bounded(displayer) -> None:
+    displayer._merged_counts.clear()
+    selections = [('CA', 'NY'), ('CA', 'TX'), ('NY', 'TX'), ('CA', 'PR'), ('NY', 'PR'), ('TX', 'PR'), ('CA', 'GU'),
+                  ('NY', 'GU'), ('TX', 'GU'), ('PR', 'GU')]
+    for states in selections:
+        displayer._select(states)
+    assert len(displayer._merged_counts) == displayer._merged_counts.max_entries < len(selections)
+    assert _numbers(displayer.search(state=('PR', 'GU'), top=None)) == dict(Maria=90, Jose=80, Yadiel=25, Mary=8)
+    assert _numbers(displayer.search(region='territories', top=None)) == dict(Maria=90, Jose=80, Yadiel=25, Mary=8)
+    np.testing.assert_array_equal(displayer._select(('CA', 'NY'))[0].window(0).sum(axis=1), displayer._select(
+        ('NY', 'CA'))[0].window(0).sum(axis=1))
+
+
+def test_territory_only_name_is_compared_with_a_baseline_that_includes_it(displayer) -> None:
+    df = displayer.over_represented(region='territories', number_min=1, top=None).set_index('name')
+    assert np.isfinite(df.ratio).all()
+    assert (df.number_national >= df.number).all()
+    # Yadiel's only births are in the selection, so its national share is its share of the selection and the baseline
+    births = dict(national=320, territories=203)
+    assert df.ratio['Yadiel'] == pytest.approx((25 / births['territories']) / (25 / (births['national'] + 203)))
+
+
+def test_distribution_concentration_is_finite_for_territories(displayer) -> None:
+    df = displayer.distribution('Yadiel').set_index('state')
+    assert df.index.tolist() == ['PR']
+    assert df.concentration['PR'] == pytest.approx((320 + 195) / 195)
+    df = displayer.distribution('Maria').set_index('state')
+    assert np.isfinite(df.concentration).all()
+    # a state is still compared with the states alone
+    assert df.concentration['TX'] == pytest.approx((45 / 115) / (80 / 320))
+
+
+@pytest.mark.parametrize('kwargs, message', [
+    (dict(state='ZZ'), 'unknown state(s) `ZZ`; expected one of CA, GU, NY, PR, TX'),
+    (dict(state=('ca', 'QQ', 'XX')), 'unknown state(s) `QQ`, `XX`'),
+    (dict(region='southwest'), 'unknown region `southwest`; expected one of northeast, midwest, south, west'),
+])
+def test_unknown_state_or_region_is_rejected(displayer, kwargs: dict, message: str) -> None:
+    for query in (lambda: displayer.search(**kwargs), lambda: displayer.name('Mary', **kwargs),
+                  lambda: displayer.over_represented(**kwargs)):
+        with pytest.raises(ValueError, match=re.escape(message)):
+            query()
+
+
+def test_region_states_missing_from_the_data_are_left_out(displayer) -> None:
+    assert displayer._selected_states(region='West') == ('CA',)
+    assert displayer._selected_states('ny', 'south') == ('NY', 'TX')
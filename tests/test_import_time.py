@@ -0,0 +1,34 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import(module: str) -> tuple[float, set[str]]:
+    # a fresh interpreter, so nothing imported by other tests counts; returns seconds taken and top-level modules loaded
+    code = (f'import json, sys, time; s = time.perf_counter(); import {module}; elapsed = time.perf_counter() - s; '
+            f'print(json.dumps([elapsed, sorted({{i.split(".")[0] for i in sys.modules}})]))')
+    stdout = subprocess.run([sys.executable, '-c', code], cwd=_REPO, check=True, capture_output=True, text=True).stdout
+    elapsed, modules = json.loads(stdout)
+    return elapsed, set(modules)
+
+
+# budgets are several times what the imports take on a laptop, so only a heavy import sneaking back in trips them
+@pytest.mark.parametrize('module, budget, absent', [
+    ('core', 2., {'seaborn', 'matplotlib'}),
+    ('name_normalization', .2, {'seaborn', 'matplotlib', 'pandas', 'numpy'}),
+])
+def test_import_is_light(module: str, budget: float, absent: set[str]) -> None:
+    elapsed, modules = _import(module)
+    assert not absent & modules
+    assert elapsed < budget
+
+
+def test_core_imports_without_fcntl() -> None:
+    # as on windows, where fcntl doesn't exist
+    code = 'import sys; sys.modules["fcntl"] = None; import core, snapshot'
+    subprocess.run([sys.executable, '-c', code], cwd=_REPO, check=True, capture_output=True)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from name_matching import FuzzyNameIndex, metaphone
+
+
+@pytest.fixture(scope='module')
+def index() -> FuzzyNameIndex:
+    return FuzzyNameIndex(pd.Index(['Mary', 'Catherine', 'Philip', 'Christopher', 'Zoe']), np.array([100, 5, 4, 3, 2]))
+
+
+def test_missing_inputs_have_no_match(index) -> None:
+    # factorize codes None and NaN as -1, which mustn't index the last distinct input
+    matches = index.match(pd.Series(['Zoe', None, 'Marry', np.nan, '']))
+    assert matches.matched_name.tolist() == ['Zoe', None, 'Mary', None, None]
+    assert matches.match_score.isna().tolist() == [False, True, False, True, True]
+    assert index.match(pd.Series([None, None])).matched_name.tolist() == [None, None]
+
+
+@pytest.mark.parametrize('a, b', [
+    ('Catherine', 'Katherine'), ('Philip', 'Filip'), ('Xavier', 'Zavier'), ('Christopher', 'Kristopher'),
+    ('Caitlin', 'Kaitlyn'), ('Stephen', 'Steven'), ('Knight', 'Night'),
+])
+def test_metaphone_keys_spellings_alike(a: str, b: str) -> None:
+    assert metaphone(a) == metaphone(b)
+
+
+def test_spellings_that_only_sound_alike_are_matched(index) -> None:
+    # three edits apart, with different soundex codes
+    matches = index.match(pd.Series(['Kathryn', 'Khristofer']), score_min=0)
+    assert matches.matched_name.tolist() == ['Catherine', 'Christopher']
+
+
+def test_long_metaphone_keys_round_trip() -> None:
+    # a 12-letter key takes 60 bits, so packed with a row number it would overflow without dense codes
+    long_names = ['Jacksonkristofferson', 'Maximiliantheodorsen', 'Christophermontgomery']
+    rng = np.random.default_rng(0)
+    filler = [''.join(rng.choice(list('bcdfgklmnprstvz'), 8)).title() for _ in range(2000)]
+    names = pd.Index(sorted(set(filler) - set(long_names)) + long_names)
+    index = FuzzyNameIndex(names, rng.integers(5, 1000, len(names)))
+    assert len(metaphone('Jacksonkristofferson')) == 12
+    # every name is listed under its own key
+    lo = np.searchsorted(index._metaphone_keys, index._metaphone, 'left')
+    hi = np.searchsorted(index._metaphone_keys, index._metaphone, 'right')
+    assert all(i in index._metaphone_names[start:stop] for i, (start, stop) in enumerate(zip(lo, hi)))
+    matches = index.match(pd.Series(['Jaxonkrystofersen', 'Kristophermontgomerie']), score_min=0)
+    assert matches.matched_name.tolist() == ['Jacksonkristofferson', 'Christophermontgomery']
@@ -0,0 +1,46 @@
+import re
+import string
+
+import pandas as pd
+import pytest
+
+from name_normalization import standardize_name, standardize_names
+
+_NAMES = [
+    'Mary', 'mary', 'MARY', 'mArY', 'Anne-Marie', "O'Brien", 'Mary Jane', 'J.R.', 'Zoë', 'José', 'Ñandú', 'Çelik',
+    'Hélène', 'Iñíguez', 'Renée!', 'François', 'Ólafur', 'Ùrsula', 'ÉMILE', 'Àdam', 'john3', '  Liam  ', '',
+    '-', '123', "'", 'Jean-Luc Picard', 'Noël', 'Ignacio', 'Raphaël',
+]
+
+
+def _legacy_standardize_name(name: str) -> str:
+    # the implementation standardize_name replaced, kept here as the reference it must agree with
+    reference = {
+        'a': 'à|á',
+        'c': 'ç',
+        'e': 'è|é|ê|ë',
+        'i': 'í|î',
+        'n': 'ñ',
+        'o': 'ó|ô',
+        'u': 'ù|ú|ü',
+    }
+    name = name.lower()
+    for deacc, acc in reference.items():
+        name = re.sub(acc, deacc, name)
+    return ''.join(re.findall(f'[{string.ascii_lowercase}]+', name)).title()
+
+
+@pytest.mark.parametrize('name', _NAMES)
+def test_standardize_name_matches_legacy(name: str) -> None:
+    assert standardize_name(name) == _legacy_standardize_name(name)
+
+
+def test_standardize_names_matches_legacy() -> None:
+    names = pd.Series(_NAMES * 3, index=range(100, 100 + len(_NAMES) * 3))
+    result = standardize_names(names)
+    assert result.tolist() == [_legacy_standardize_name(i) for i in names]
+    assert result.index.equals(names.index)
+
+
+def test_standardize_names_empty() -> None:
+    assert standardize_names(pd.Series([], dtype=object)).tolist() == []
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import AppDataset, create_app
+from core import Displayer, Year
+from predict_gender_and_age import predict_age_frame
+
+_NAMES: tuple[str, ...] = ('Mary', 'John', 'Ethel', 'Jayden')
+_PEAK_TABLE_HEADER: str = (
+    'name,total_usages,peak_year_f,peak_rank_f,peak_year_m,peak_rank_m,middle_lo_f50,middle_hi_f50,middle_lo_m50,'
+    'middle_hi_m50,middle_lo_f80,middle_hi_f80,middle_lo_m80,middle_hi_m80,gender\n')
+
+
+@pytest.fixture(scope='module')
+def displayer() -> Displayer:
+    # curves over every year, some with most of their living share before the default window starts
+    rng = np.random.default_rng(0)
+    years = np.arange(Year.MIN_YEAR, 2021)
+    frames = []
+    for i, name in enumerate(_NAMES):
+        for sex in ('f', 'm'):
+            weights = rng.random(len(years)) * np.exp(-((years - (1900 + 30 * i)) / 25) ** 2)
+            frames.append(pd.DataFrame(dict(name=name, sex=sex, year=years, number_living_pct=weights / weights.sum())))
+    displayer = Displayer()
+    displayer._age_reference = pd.concat(frames, ignore_index=True).astype(dict(name='category', sex='category'))
+    return displayer
+
+
+@pytest.mark.parametrize('mid_percentile', [.25, .68, .95])
+def test_single_name_matches_the_batch(displayer, mid_percentile: float) -> None:
+    names = pd.DataFrame(dict(name=[i for i in _NAMES for _ in 'fm'], sex=[*'fm'] * len(_NAMES)))
+    batch = predict_age_frame(displayer, mid_percentile, names)
+    for row in batch.itertuples():
+        single = displayer.predict_age(row.name, row.sex, mid_percentile).year
+        assert (single.lower, single.upper, single.band) == (
+            row.year_lower, row.year_upper, row.year_upper - row.year_lower)
+
+
+def test_window_is_shared(displayer) -> None:
+    # the window changes some answers, and both paths take the same one when it's given
+    names = pd.DataFrame(dict(name=['Mary', 'Mary'], sex=['f', 'm']))
+    assert not predict_age_frame(displayer, .68, names).equals(predict_age_frame(displayer, .68, names, after=None))
+    batch = predict_age_frame(displayer, .68, names, after=None)
+    for row in batch.itertuples():
+        single = displayer.predict_age(row.name, row.sex, after=None).year
+        assert (single.lower, single.upper) == (row.year_lower, row.year_upper)
+
+
+def test_unknown_name_gives_an_empty_prediction(displayer, monkeypatch, tmp_path) -> None:
+    df = displayer.predict_age('Notaname', 'f')
+    assert not len(df)
+    assert df.dtypes.to_dict() == dict(percentile=np.dtype(float), year=np.dtype(int))
+
+    # the app loads the peak table on startup; an empty one is enough here
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data_extras/names_by_peak')
+    with open('data_extras/names_by_peak/data.csv', 'w') as f:
+        f.write(_PEAK_TABLE_HEADER)
+    client = create_app(dataset=AppDataset(displayer=displayer)).test_client()
+    for name, sex in (('Notaname', 'f'), ('Mary', 'x')):
+        response = client.post('/predict-age', json=dict(name=name, sex=sex))
+        assert response.status_code == 200
+    assert client.post('/predict-age', json=dict(name='Notaname', sex='f')).json == dict(
+        params=dict(name='Notaname', sex='f'), data={})
+    assert client.post('/predict-age', json=dict(name='Mary', sex='f')).json['data']['band']['percentile'] == .68
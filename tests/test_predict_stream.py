@@ -0,0 +1,40 @@
+import io
+
+import pandas as pd
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from predict_stream import Predictor, StreamFormat, parse_flag, read_chunks
+
+
+def test_read_chunks_defers_parsing() -> None:
+    # the app reads the first chunk inside its error handling, so setting up the stream must not parse anything
+    chunks = read_chunks(io.StringIO(''), StreamFormat.CSV)
+    with pytest.raises(ValueError):
+        next(chunks)
+
+
+def test_read_chunks_csv_keeps_names_like_na() -> None:
+    chunks = list(read_chunks(io.StringIO('name\nNa\nNull\n\n'), StreamFormat.CSV, chunk_size=1))
+    assert pd.concat(chunks).name.tolist() == ['Na', 'Null']
+
+
+def test_read_chunks_unsupported_format() -> None:
+    with pytest.raises(ValueError):
+        next(read_chunks(io.StringIO('name\nMary\n'), 'xml'))
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), (False, False), (1, True), (0, False), (None, False), ('true', True), ('True', True), ('1', True),
+    ('yes', True), ('false', False), ('0', False), ('', False),
+])
+def test_parse_flag(value, expected: bool) -> None:
+    assert parse_flag(value) is expected
+
+
+def test_gender_parameters_parse_living_and_year() -> None:
+    # as the app reads them from the query string
+    args = MultiDict(dict(living='false', year='1990', fuzzy='true'))
+    parameters = Predictor.PARAMETERS[Predictor.GENDER]
+    assert {k: v for k, type_ in parameters.items() if (v := args.get(k, type=type_)) is not None} == dict(
+        living=False, year=1990, fuzzy=True)
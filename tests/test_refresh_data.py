@@ -0,0 +1,211 @@
+import http.server
+import io
+import os
+import re
+import threading
+import zipfile
+import zlib
+from time import perf_counter
+from typing import Iterator
+
+import pandas as pd
+import pytest
+from requests.exceptions import RequestException
+
+from core import Filepath
+from refresh_data import SsaDataDownloader, SsaUrl, _read_download_state
+
+_MAX_YEAR: int = 2023
+# small enough that a dropped connection leaves part of a file behind
+_CHUNK_SIZE: int = 4096
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    # just enough of ssa.gov to answer conditional and range requests, serving files held in memory
+    def do_GET(self) -> None:
+        server = self.server
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = f'"{zlib.crc32(body):x}-{len(body):x}"'
+        server.requests.append((self.path, dict(self.headers)))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            server.statuses.append(304)
+            return
+
+        start = 0
+        if (requested := re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))) and self.headers.get(
+                'If-Range') == etag:
+            start = int(requested.group(1))
+        # a server listed in ignore_range answers every range with the whole file, still as a partial response
+        partial = bool(start) or self.path in server.ignore_range
+        if self.path in server.ignore_range:
+            start = 0
+        self.send_response(206 if partial else 200)
+        if partial:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        server.statuses.append(206 if partial else 200)
+        body = body[start:]
+        # the first request for a path listed in drop_after is cut off partway, like a dropped connection
+        if (cut := server.drop_after.pop(self.path, None)) is not None:
+            body = body[:cut]
+        self.wfile.write(body)
+        server.bytes_sent += len(body)
+        return
+
+    def log_message(self, *args) -> None:
+        return
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch) -> Iterator[http.server.ThreadingHTTPServer]:
+    monkeypatch.chdir(tmp_path)
+    for filepath in (Filepath.APPLICANTS_DATA, Filepath.ACTUARIAL):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.files, server.drop_after, server.ignore_range = {}, {}, set()
+    server.requests, server.statuses, server.bytes_sent = [], [], 0
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _reset_counts(server: http.server.ThreadingHTTPServer) -> None:
+    server.requests, server.statuses, server.bytes_sent = [], [], 0
+    return
+
+
+def _fetch(server: http.server.ThreadingHTTPServer, path: str, filepath: str) -> tuple[SsaDataDownloader, bool]:
+    downloader = SsaDataDownloader(_MAX_YEAR, server.base_url, chunk_size=_CHUNK_SIZE)
+    downloader._open_session()
+    downloader._state = _read_download_state()
+    try:
+        return downloader, downloader._fetch(server.base_url + path, filepath)
+    finally:
+        downloader._close_session()
+
+
+def _read(filepath: str) -> bytes:
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+def _interrupt(server: http.server.ThreadingHTTPServer, path: str, filepath: str) -> int:
+    # returns how much of the file was kept
+    server.drop_after[path] = len(server.files[path]) // 3
+    with pytest.raises(RequestException):
+        _fetch(server, path.lstrip('/'), filepath)
+    partial = _read(filepath + '.part')
+    assert 0 < len(partial) <= len(server.files[path]) // 3
+    assert partial == server.files[path][:len(partial)]
+    return len(partial)
+
+
+def test_resume_appends_the_rest_of_the_file(server) -> None:
+    path, filepath = '/names.zip', 'data/names.zip'
+    server.files[path] = os.urandom(300_000)
+    kept = _interrupt(server, path, filepath)
+
+    _reset_counts(server)
+    _, changed = _fetch(server, 'names.zip', filepath)
+    assert changed
+    assert _read(filepath) == server.files[path]
+    assert not os.path.exists(filepath + '.part')
+    assert server.statuses == [206]
+    assert server.requests[0][1]['Range'] == f'bytes={kept}-'
+    assert server.bytes_sent == len(server.files[path]) - kept
+
+
+def test_unchanged_file_is_skipped(server) -> None:
+    path, filepath = '/names.zip', 'data/names.zip'
+    server.files[path] = os.urandom(50_000)
+    _fetch(server, 'names.zip', filepath)
+    mtime = os.stat(filepath).st_mtime_ns
+
+    _reset_counts(server)
+    downloader, changed = _fetch(server, 'names.zip', filepath)
+    assert not changed
+    assert downloader.changed == []
+    assert server.statuses == [304]
+    assert server.bytes_sent == 0
+    assert os.stat(filepath).st_mtime_ns == mtime
+
+
+def test_changed_etag_restarts_from_zero(server) -> None:
+    path, filepath = '/names.zip', 'data/names.zip'
+    server.files[path] = os.urandom(300_000)
+    _interrupt(server, path, filepath)
+
+    # the file changes before the resume, so If-Range no longer matches and the whole new file comes back
+    server.files[path] = os.urandom(200_000)
+    _reset_counts(server)
+    _, changed = _fetch(server, 'names.zip', filepath)
+    assert changed
+    assert _read(filepath) == server.files[path]
+    assert server.statuses == [200]
+    assert server.bytes_sent == len(server.files[path])
+
+
+def test_partial_response_for_another_range_restarts_from_zero(server) -> None:
+    path, filepath = '/names.zip', 'data/names.zip'
+    server.files[path] = os.urandom(300_000)
+    _interrupt(server, path, filepath)
+
+    server.ignore_range.add(path)
+    _reset_counts(server)
+    _, changed = _fetch(server, 'names.zip', filepath)
+    assert changed
+    assert _read(filepath) == server.files[path]
+    assert server.statuses == [206, 206]
+    assert 'Range' not in server.requests[1][1]
+
+
+def _zip(filename: str, text: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(filename, text)
+    return buffer.getvalue()
+
+
+def _serve_all_files(server: http.server.ThreadingHTTPServer) -> None:
+    for url, filename in zip(SsaUrl.NAME_DATA, ('yob2022.txt', 'AK.TXT', 'PR.TXT')):
+        server.files['/' + url] = _zip(filename, 'Mary,F,100\nJohn,M,90\n' * 1000)
+    applicants = pd.DataFrame({'Year of birth': [2021, 2022], 'Male': [10, 11], 'Female': [9, 10], 'Total': [19, 21]})
+    server.files['/' + SsaUrl.APPLICANTS] = applicants.to_html(index=False).encode()
+    table = pd.DataFrame({'Year': [_MAX_YEAR] * 3, 'x': [0, 1, 2], 'l(x)': [100_000, 99_000, 98_000]})
+    for s in ('F', 'M'):
+        server.files['/' + SsaUrl.ACTUARIAL.format(_MAX_YEAR + 1, s)] = (
+                '\n' * 5 + table.to_string(index=False) + '\n').encode()
+    return
+
+
+def test_no_change_refresh(server) -> None:
+    _serve_all_files(server)
+    downloader = SsaDataDownloader(_MAX_YEAR, server.base_url)
+    downloader.download()
+    assert len(downloader.changed) == len(server.files)
+    assert pd.read_csv(Filepath.APPLICANTS_DATA).number.tolist() == [19, 21]
+    assert pd.read_csv(Filepath.ACTUARIAL.format(sex='f')).survivors.tolist() == [100_000, 99_000, 98_000]
+
+    # a refresh with nothing changed costs one conditional request per file and no bodies
+    _reset_counts(server)
+    start = perf_counter()
+    downloader = SsaDataDownloader(_MAX_YEAR, server.base_url)
+    downloader.download()
+    elapsed = perf_counter() - start
+    assert downloader.changed == []
+    assert server.statuses == [304] * len(server.files)
+    assert server.bytes_sent == 0
+    assert downloader.bytes_downloaded == 0
+    assert elapsed < 5
@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import snapshot
+from snapshot import load_arrays, load_frames, read_manifest, save_frames
+
+
+def _save(directory: str, value: int, sources: dict) -> bool:
+    frames = dict(final=pd.DataFrame(dict(name=['Mary', 'John'], number=[value, value])))
+    return save_frames(directory, frames, dict(sources=sources), dict(values=np.array([value])))
+
+
+def _load_number(directory: str) -> int:
+    manifest = read_manifest(directory)
+    return int(load_frames(directory, manifest, mmap=True)['final'].number[0])
+
+
+def test_first_published_copy_wins(tmp_path) -> None:
+    directory = str(tmp_path / 'snapshot')
+    assert _save(directory, 1, dict(a=1))
+    inode = os.stat(directory).st_ino
+    mapped = load_frames(directory, read_manifest(directory), mmap=True)['final']
+
+    # a later worker with the same build drops its own copy and leaves the published one in place
+    assert not _save(directory, 2, dict(a=1))
+    assert os.stat(directory).st_ino == inode
+    assert _load_number(directory) == 1
+    assert mapped.number.tolist() == [1, 1]
+    assert sorted(os.listdir(tmp_path)) == ['snapshot', 'snapshot.lock']
+
+
+def test_stale_snapshot_is_replaced(tmp_path) -> None:
+    directory = str(tmp_path / 'snapshot')
+    assert _save(directory, 1, dict(a=1))
+    mapped = load_frames(directory, read_manifest(directory), mmap=True)['final']
+    assert _save(directory, 2, dict(a=2))
+    assert _load_number(directory) == 2
+    assert load_arrays(directory, read_manifest(directory)).get('values').tolist() == [2]
+    # the retired copy's mapped files stay readable after it's removed
+    assert mapped.number.tolist() == [1, 1]
+    assert sorted(os.listdir(tmp_path)) == ['snapshot', 'snapshot.lock']
+
+
+def test_snapshot_with_other_arrays_is_replaced(tmp_path) -> None:
+    directory = str(tmp_path / 'snapshot')
+    save_frames(directory, dict(final=pd.DataFrame(dict(number=[1]))), dict(sources=dict(a=1)))
+    assert _save(directory, 2, dict(a=1))
+    assert read_manifest(directory)['arrays'] == ['values']
+
+
+def _save_without_fcntl(directory: str, value: int, sources: dict) -> bool:
+    # as on a platform without fcntl, in a pool worker of its own
+    sys.modules['fcntl'] = None
+    return _save(directory, value, sources)
+
+
+def test_lock_file_is_used_without_fcntl(tmp_path, monkeypatch) -> None:
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    directory = str(tmp_path / 'snapshot')
+    assert _save(directory, 1, dict(a=1))
+    assert not _save(directory, 2, dict(a=1))
+    assert _save(directory, 3, dict(a=2))
+    assert _load_number(directory) == 3
+    # the lock file only exists while it's held
+    assert sorted(os.listdir(tmp_path)) == ['snapshot']
+
+
+def test_lock_file_left_behind_is_broken_once_stale(tmp_path, monkeypatch) -> None:
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    directory = str(tmp_path / 'snapshot')
+    lock = directory + '.lock'
+    open(lock, 'w').close()
+    stale = time.time() - snapshot._STALE_LOCK_SECONDS - 1
+    os.utime(lock, (stale, stale))
+    assert _save(directory, 1, dict(a=1))
+    assert sorted(os.listdir(tmp_path)) == ['snapshot']
+
+
+@pytest.mark.parametrize('save', [_save, _save_without_fcntl])
+def test_concurrent_workers_publish_once_with_either_lock(tmp_path, save) -> None:
+    directory = str(tmp_path / 'snapshot')
+    with multiprocessing.Pool(4) as pool:
+        published = pool.starmap(save, [(directory, i, dict(a=1)) for i in range(8)])
+    assert sum(published) == 1
+    assert _load_number(directory) == published.index(True)